@@ -0,0 +1,148 @@
+'''
+Contains the AsyncThesisDataAccessor class, an asyncio front end to the data
+accessor. Queries are written exactly as with the synchronous accessor, then
+awaited: the query is resolved on a thread pool, so loading and decoding a
+cold transcript never blocks the event loop.
+Ex: adata = AsyncThesisDataAccessor()
+    events = await adata.debates['75950'].transcripts.events
+'''
+
+import asyncio
+import collections
+import functools
+import itertools
+import operator
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from ThesisDataAccessor import Accessor
+
+
+class AsyncQuery:
+    '''
+    A query against the data accessor that has not been run yet. Attribute and item
+    access extend the query; awaiting it runs it on the async accessor's thread pool
+    and returns what the synchronous accessor would (a value or a PDO), and async
+    iteration runs it and yields each item of the result as soon as the pool has
+    produced it.
+    '''
+
+    __slots__ = ('_adata', '_path')
+
+    def __init__(self, adata, path):
+        self._adata = adata
+        self._path = path
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return AsyncQuery(self._adata, self._path + ((getattr, name),))
+
+    def __getitem__(self, key):
+        return AsyncQuery(self._adata, self._path + ((operator.getitem, key),))
+
+    def resolve(self):
+        '''Run the query synchronously and return its result.'''
+        value = self._adata.accessor
+        for step, arg in self._path:
+            value = step(value, arg)
+        return value
+
+    def __await__(self):
+        return self._adata.run(self.resolve).__await__()
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        done = object()
+        items = await self._adata.run(lambda: iter(self.resolve()))
+        while True:
+            item = await self._adata.run(next, items, done)
+            if item is done:
+                break
+            yield item
+
+    def __repr__(self):
+        return "AsyncQuery({0})".format("".join(
+            ".{0}".format(arg) if step is getattr else "[{0!r}]".format(arg) for step, arg in self._path))
+
+
+class AsyncThesisDataAccessor:
+    '''
+    Wraps a ThesisDataAccessor (by default, the shared one) for use from asyncio code.
+    At most maxConcurrency queries run at once, each on a thread of the accessor's own
+    pool; the data manager is thread-safe, so concurrent queries for the same cold
+    instance share a single load. The limit is enforced per event loop, so the same
+    async accessor can be used from several loops (e.g. successive asyncio.run calls).
+    '''
+
+    def __init__(self, accessor=None, maxConcurrency=8):
+        self.accessor = Accessor if accessor is None else accessor
+        self.maxConcurrency = maxConcurrency
+        self._executor = ThreadPoolExecutor(max_workers=maxConcurrency, thread_name_prefix="async-accessor")
+        # One semaphore per event loop, each created on first use in its loop
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return AsyncQuery(self, ((getattr, name),))
+
+    def __getitem__(self, key):
+        return AsyncQuery(self, ((operator.getitem, key),))
+
+    async def run(self, f, *args):
+        '''
+        Call f with the given arguments on the thread pool, limited by the semaphore.
+        '''
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.maxConcurrency)
+        async with semaphore:
+            return await loop.run_in_executor(self._executor, functools.partial(f, *args))
+
+    async def getDataSourceInstance(self, dataSourceName, _id):
+        '''Return a data source instance (as a plain value), loading it if necessary.'''
+        return await self.run(self.accessor.dataManager.getDataSourceInstance, dataSourceName, _id)
+
+    async def prefetch(self, dataSourceName, ids=None, readAhead=8):
+        '''
+        Asynchronously iterate over the entities of a multiple-file data source's data type
+        (by default, every entity with an instance in the data source), as with
+        ThesisDataAccessor.prefetch. The next readAhead instances are loaded concurrently
+        while the caller works on the current one, so by the time an entity is yielded,
+        its instance is loaded and querying it does not touch the disk.
+        Ex: async for debate in adata.prefetch('transcripts'):
+                debate.transcripts.events ...
+        '''
+        manager = await self.run(lambda: self.accessor.dataManager)
+        dataType = manager.locations[dataSourceName]['dataType']
+        if ids is None:
+            ids = await self.run(self.accessor.entityIds, dataSourceName)
+        else:
+            # Load the data type's ids off the event loop, since looking up an entity checks them
+            await self.run(manager.root().child(dataType).getIds)
+        entities = getattr(self.accessor, dataType)
+
+        remaining = iter(ids)
+        pending = collections.deque()
+
+        def schedule():
+            for _id in itertools.islice(remaining, readAhead - len(pending)):
+                pending.append((_id, asyncio.ensure_future(self.getDataSourceInstance(dataSourceName, _id))))
+        try:
+            schedule()
+            while pending:
+                _id, load = pending.popleft()
+                await load
+                schedule()
+                yield entities[_id]
+        finally:
+            for _, load in pending:
+                load.cancel()
+
+    def close(self):
+        '''Shut down the thread pool once running queries finish.'''
+        self._executor.shutdown(wait=False)
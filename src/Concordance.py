@@ -0,0 +1,232 @@
+'''
+Contains the Concordance class, a keyword-in-context engine over the parsed
+transcripts. Lookups are answered from a positional index of every token in
+every utterance, stored per debate in the derived tokenPositions data source,
+so a query never rescans the transcripts' token lists. Only transcripts that
+contain a match are loaded, to read the context around each occurrence.
+Results stream back in debate date order.
+'''
+
+import argparse
+import collections
+import contextlib
+from datetime import datetime
+
+from ThesisDataAccessor import Accessor as data
+from TurnIndex import reactionAfter
+
+# One occurrence of a term: where it is, who said it, its context, and what followed
+ConcordanceLine = collections.namedtuple('ConcordanceLine',
+    ['debateId', 'date', 'eventIndex', 'tokenIndex', 'speaker', 'left', 'match', 'right', 'reaction'])
+
+
+def buildPositions(events):
+    '''
+    Return the positional index of a parsed transcript's events: a dictionary mapping
+    each lowercased token to a flat list [event, token, event, token, ...] of the
+    places it occurs, in order.
+    '''
+    positions = collections.defaultdict(list)
+    for e, event in enumerate(events):
+        if event['eventType'] == 'utterance':
+            for t, token in enumerate(event['tokens']):
+                positions[token.lower()].extend((e, t))
+    return dict(positions)
+
+
+def pairs(flat):
+    return zip(flat[0::2], flat[1::2])
+
+
+class Concordance:
+    '''
+    Answers keyword-in-context queries. The positional index of each debate is loaded
+    once per concordance (and rebuilt, and written back to tokenPositions, whenever the
+    debate's parsed transcript has changed since it was indexed). Transcripts that are
+    loaded to rebuild an index or to answer a query are released again afterwards,
+    unless they were already loaded.
+    '''
+
+    def __init__(self, contextSize=5):
+        self.contextSize = contextSize
+        self.manager = data.dataManager
+        # debateId -> (transcript version, positions)
+        self._positions = {}
+        self._order = None
+
+    ##############################################
+    ################## INDEXING ##################
+
+    def _transcriptVersion(self, debateId):
+        version = self.manager.version('transcripts', debateId)
+        # Stored as JSON, so compare as a list
+        return None if version is None else list(version)
+
+    def positions(self, debateId):
+        '''
+        Return the positional index of a debate, loading it from tokenPositions or
+        rebuilding it from the parsed transcript if it is missing or out of date.
+        '''
+        version = self._transcriptVersion(debateId)
+        cached = self._positions.get(debateId)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        record = None
+        if debateId in self.manager.getDataSourceIds('tokenPositions'):
+            record = self.manager.getDataSourceInstance('tokenPositions', debateId)
+            # Indexes are loaded once into this concordance, so don't keep a second copy loaded
+            self.manager.invalidate('tokenPositions', debateId)
+        if record is None or record['transcriptVersion'] != version:
+            with self.transcript(debateId) as transcript:
+                positions = buildPositions(transcript['events'])
+            self.manager.writeDataSourceInstance('tokenPositions', debateId,
+                {'id': debateId, 'transcriptVersion': version, 'positions': positions})
+            self.manager.invalidate('tokenPositions', debateId)
+        else:
+            positions = record['positions']
+        self._positions[debateId] = (version, positions)
+        return positions
+
+    @contextlib.contextmanager
+    def transcript(self, debateId):
+        '''
+        Return a context manager that yields a debate's parsed transcript and, if it was
+        not already loaded, releases it again on exit.
+        '''
+        loaded = self.manager.isInstanceLoaded('transcripts', debateId)
+        transcript = self.manager.getDataSourceInstance('transcripts', debateId)
+        try:
+            yield transcript
+        finally:
+            if not loaded:
+                self.manager.release('transcripts', debateId, transcript)
+
+    def build(self, debateIds=None):
+        '''
+        Bring the stored positional index of the given debates (by default, every parsed
+        transcript) up to date. Returns the number of debates indexed.
+        '''
+        debateIds = self.debatesByDate() if debateIds is None else debateIds
+        for debateId in debateIds:
+            self.positions(debateId)
+        return len(debateIds)
+
+    def debatesByDate(self):
+        '''
+        Return the ids of the debates with parsed transcripts, ordered by date.
+        '''
+        if self._order is None:
+            metadata = self.manager.getDataSource('debateMetadata')
+            self._order = sorted(data.entityIds('transcripts'),
+                key=lambda _id: (datetime.strptime(metadata[_id]['date'], "%Y/%m/%d"), _id))
+        return self._order
+
+    ##############################################
+    ################## QUERYING ##################
+
+    @staticmethod
+    def matches(positions, terms):
+        '''
+        Return the sorted (event, token) positions where the sequence of terms starts,
+        within a single utterance.
+        '''
+        if any(term not in positions for term in terms):
+            return []
+        # Intersect the positions of each term, shifted back to the start of the phrase
+        starts = set(pairs(positions[terms[0]]))
+        for k, term in enumerate(terms[1:], 1):
+            starts &= {(e, t - k) for e, t in pairs(positions[term])}
+            if not starts:
+                return []
+        return sorted(starts)
+
+    def context(self, events, turns, e, t, length):
+        '''
+        Return the tokens to the left and right of the match at token t of event e, up to
+        contextSize on each side. Context continues into the neighboring utterances of
+        the same speaker turn, but not past it.
+        '''
+        turn = turns.turnOf(e)
+        start, end = (e, e + 1) if turn is None else turns.turn(turn)[:2]
+        n = self.contextSize
+
+        left = events[e]['tokens'][:t]
+        i = e - 1
+        while len(left) < n and i >= start:
+            if events[i]['eventType'] == 'utterance':
+                left = events[i]['tokens'] + left
+            i -= 1
+
+        right = events[e]['tokens'][t + length:]
+        i = e + 1
+        while len(right) < n and i < end:
+            if events[i]['eventType'] == 'utterance':
+                right = right + events[i]['tokens']
+            i += 1
+        return left[max(0, len(left) - n):], right[:n]
+
+    def query(self, phrase, debateIds=None):
+        '''
+        Return a generator of a ConcordanceLine for every occurrence of the phrase (a string,
+        split on whitespace, or a list of tokens; matched case-insensitively) in the given
+        debates (by default, all of them), in date order.
+        Ex: for line in Concordance(contextSize=8).query("health care"): ...
+        '''
+        terms = [term.lower() for term in (phrase.split() if isinstance(phrase, str) else phrase)]
+        if not terms:
+            return
+        metadata = self.manager.getDataSource('debateMetadata')
+        order = self.debatesByDate()
+        if debateIds is not None:
+            wanted = set(debateIds)
+            order = [_id for _id in order if _id in wanted]
+
+        for debateId in order:
+            found = Concordance.matches(self.positions(debateId), terms)
+            if not found:
+                continue
+            with self.transcript(debateId) as transcript:
+                events = transcript['events']
+                turns = data.turnIndex(debateId)
+                for e, t in found:
+                    left, right = self.context(events, turns, e, t, len(terms))
+                    yield ConcordanceLine(debateId, metadata[debateId]['date'], e, t, events[e]['speaker'],
+                        left, events[e]['tokens'][t:t + len(terms)], right, reactionAfter(events, e))
+
+    def count(self, phrase):
+        '''
+        Return the number of occurrences of the phrase in each debate, from the positional
+        indexes alone. Transcripts are only loaded (and released again) to rebuild the
+        indexes that are out of date.
+        '''
+        terms = [term.lower() for term in (phrase.split() if isinstance(phrase, str) else phrase)]
+        return {_id: n for _id, n in ((_id, len(Concordance.matches(self.positions(_id), terms))) \
+            for _id in self.debatesByDate()) if n}
+
+
+def formatLine(line, width=50):
+    left = ' '.join(line.left)
+    return "{0} {1:>{width}} [{2}] {3}  ({4})".format(line.date, left[-width:], ' '.join(line.match),
+        ' '.join(line.right), line.reaction, width=width)
+
+
+def getArgs():
+    parser = argparse.ArgumentParser(description='''Print every occurrence of a term or phrase in the parsed transcripts,
+                                                  with its context, in debate date order.''')
+    parser.add_argument('phrase', nargs='?', default=None, help="The term or phrase to look up.")
+    parser.add_argument('--context', type=int, default=5, help="The number of tokens of context on each side.")
+    parser.add_argument('--limit', type=int, default=None, help="Stop after this many occurrences.")
+    parser.add_argument('--build', action='store_true', help="Bring the stored positional index up to date for every debate.")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = getArgs()
+    concordance = Concordance(args.context)
+    if args.build:
+        print("Indexed {0} debates.".format(concordance.build()))
+    if args.phrase is not None:
+        for i, line in enumerate(concordance.query(args.phrase)):
+            if args.limit is not None and i >= args.limit:
+                break
+            print(formatLine(line))
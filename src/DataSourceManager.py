@@ -1,15 +1,47 @@
+import collections
+import contextlib
 import os
-
-import jsonschema
+import threading
+import time
 
 import utils
+import SchemaValidator
+from MetadataStore import MetadataStore, applyOps
+from Prefetcher import Prefetcher
+from StorageBackend import DirectoryStorage, makeStorage
 from TypeNode import TypeNode
 
 
 class DataSourceManager():
-    def __init__(self, top, dataSourceLocationsFile):
+    '''
+    Lazily loads data sources and their instances. The manager is safe to share
+    between threads: each data source has its own lock, concurrent requests for an
+    instance that is being loaded wait for that single load, and reads of data that
+    is already loaded take no locks at all.
+    '''
+
+    def __init__(self, top, dataSourceLocationsFile, validationModes=None, useLoadCache=True, loadThreads=8):
         self.top = top
         self.locsFile = os.path.join(top, dataSourceLocationsFile)
+        # If true, single-file JSON data sources are loaded through a binary cache
+        self.useLoadCache = useLoadCache
+        # The number of threads that read multiple-file data source instances ahead of use
+        self.loadThreads = loadThreads
+        self._executor = None
+        # Guards the creation of per-data-source locks, stores, storages, and the executor
+        self._lock = threading.Lock()
+        # A reentrant lock for each data source, and the Future of each instance being loaded
+        self._sourceLocks = {}
+        self._inflight = {}
+        # Each thread's stack of dependency sets being recorded (see recordDependencies)
+        self._recording = threading.local()
+        # Overrides for the per-data-source validation modes set in the locs file
+        self.validationModes = {} if validationModes is None else validationModes
+        # The number of loads of, and seconds spent loading, each data source (see stats)
+        self._loadStats = collections.defaultdict(lambda: {'loads': 0, 'seconds': 0.0})
+        # Set while tracing memory (see traceMemory), with the memory traced for each loaded instance
+        self._traceLock = None
+        self._tracedMemory = {}
         self._loadTypes()
 
     ##############################################
@@ -23,14 +55,16 @@ class DataSourceManager():
         locsSchemaFile = os.path.join(self.top, locs['schemaDir'], locs['schema'])
         locsSchema = utils.getJSON(locsSchemaFile)
 
-        # Validate the schema and locs
-        #jsonschema.Draft4Validator.check_schema(locsSchema)
-        #jsonschema.Draft4Validator(locsSchema, format_checker=jsonschema.FormatChecker()).validate(locs)
-
-        # If no errors, then set the locs, along with the schemaDir and dataDir
+        # Validation of the locs file is available through validateLocs(); data source
+        # instances are validated in the background as they are loaded.
         self.schemaDir = locs['schemaDir']
         self.dataDir = locs['dataDir']
         self.locations = locs['dataSources']
+        self.locsSchema = locs['schema']
+        # The validator (with its compiled schemas and thread) is kept across resets
+        schemaDir = os.path.join(self.top, self.schemaDir)
+        if getattr(self, 'validator', None) is None or self.validator.schemaDir != schemaDir:
+            self.validator = SchemaValidator.SchemaValidator(schemaDir)
 
         # Create the data source type hierarchy and set id and data hooks where appropriate
         self._root = TypeNode(None, "rootType")
@@ -54,6 +88,14 @@ class DataSourceManager():
 
         # Create an empty dictionary which will store the actual data from the data sources
         self.data = {}
+        # The version of each loaded dependency (see version()), stamped when it was loaded
+        self._versions = {}
+        # The MetadataStores backing the single-file data sources, and the storage
+        # backends of the multiple-file data sources, created as needed
+        self._stores = {}
+        self._storages = {}
+        # The data source directories written to in place of read-only storages
+        self._writeStorages = {}
 
     def reset(self):
         self._loadTypes()
@@ -66,50 +108,206 @@ class DataSourceManager():
         Given a data source, load all of the ids for that data source.
         This should only be called if the data source is completely uninitialized.
         If it's a single data source, then load the entire data source.
-        Otherwise, just get the list of ids from the filenames in the directory.
+        Otherwise, just get the list of ids from the data source's storage backend
+        (by default, the filenames in the directory).
         '''
-        if self.isSingle(dataSourceType):
-            self.loadSingleDataSource(dataSourceType)
-        else:
-            directory = self.getDataSourceDirectory(dataSourceType)
-            self.data[dataSourceType] = \
-                    {utils.getBaseFilename(filename): None for filename in utils.getFilenames(directory, ext="json")}
+        with self._lockFor(dataSourceType):
+            if self.isSingle(dataSourceType):
+                self.loadSingleDataSource(dataSourceType)
+            else:
+                storage = self.getStorage(dataSourceType)
+                self._versions[(dataSourceType, None)] = storage.version()
+                # Build the dictionary before publishing it, so lock-free readers never see it half-filled
+                self.data[dataSourceType] = {_id: None for _id in storage.ids()}
 
     def loadSingleDataSource(self, dataSourceType):
         '''
         Load the file containing data for this data source into a dictionary and
-        place it in the top-level data variable.
+        place it in the top-level data variable. The file is loaded through the data
+        source's MetadataStore, so changes committed to its log are included. Unless
+        disabled, the file is read through a binary cache kept next to it (see
+        utils.getCachedJSON).
         '''
-        dataSourceLocation = self.locations[dataSourceType]
-        directory = self.getDataSourceDirectory(dataSourceType)
-
-        filename = utils.makeJSONFilename(directory, os.path.basename(directory))
-        self.data[dataSourceType] = utils.getJSON(filename)
+        store = self.getStore(dataSourceType)
+        with self._lockFor(dataSourceType):
+            # Stamp the version before loading, so a concurrent change looks newer, not older
+            self._versions[(dataSourceType, None)] = store.version()
+            start = time.perf_counter()
+            self.data[dataSourceType], traced = self._traced(store.load)
+            self._noteLoad(dataSourceType, None, time.perf_counter() - start, traced)
+        self.submitValidation(dataSourceType, self.data[dataSourceType], store.snapshotFile)
 
     def loadMulitpleDataSource(self, dataSourceType, _id=None):
         '''
         Load data from a multiple-file data source. If _id is None, then load
-        the entire data source. Otherwise, only load the specified _id.
+        the entire data source, reading instances in parallel. Otherwise, only
+        load the specified _id.
         '''
-        dataSourceLocation = self.locations[dataSourceType]
-        directory = self.getDataSourceDirectory(dataSourceType)
-
-        loader = utils.getJSON if dataSourceLocation['isJson'] else utils.getText
         if _id == None:
-            # Get all of the ids for this data source
-            ids = self.getDataSourceIds(dataSourceType)
+            # Get all of the ids for this data source that still need loading,
+            # and read them on the loader threads
+            source = self._getSource(dataSourceType)
+            ids = [i for i in list(source) if source.get(i) == None]
+            for _ in self.prefetch(dataSourceType, ids, readAhead=2 * self.loadThreads, maxBytes=None):
+                pass
+        else:
+            self._loadInstance(dataSourceType, _id)
+
+    def _loadInstance(self, dataSourceType, _id):
+        '''
+        Load a single instance of a multiple-file data source, unless it is already loaded,
+        and return an (instance, fresh) pair, where fresh is true if this call read it.
+        If another thread is already loading the instance, wait for that load instead of
+        reading the file again. The file is read without holding the data source's lock,
+        so different instances load in parallel.
+        '''
+        key = (dataSourceType, _id)
+        with self._lockFor(dataSourceType):
+            source = self._getSource(dataSourceType)
+            instance = source[_id]
+            if instance is not None:
+                return instance, False
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                # concurrent.futures (and tracemalloc, zipfile, and mmap) are imported on first
+                # use, so that importing the data accessor stays fast
+                from concurrent.futures import Future
+                future = self._inflight[key] = Future()
+        if not owner:
+            return future.result(), False
+
+        storage = self.getStorage(dataSourceType)
+        start = time.perf_counter()
+        try:
+            version = storage.version(_id)
+            instance, traced = self._traced(storage.read, _id)
+        except BaseException as err:
+            with self._lockFor(dataSourceType):
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+            future.set_exception(err)
+            raise
+        with self._lockFor(dataSourceType):
+            # Don't publish the instance if it was invalidated (or the manager reset) meanwhile
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+                if self.data.get(dataSourceType) is source:
+                    source[_id] = instance
+                    self._versions[key] = version
+                    self._noteLoad(dataSourceType, _id, time.perf_counter() - start, traced)
+        future.set_result(instance)
+        self.submitValidation(dataSourceType, instance, storage.location(_id))
+        return instance, True
+
+    def prefetch(self, dataSourceType, ids=None, readAhead=8, maxBytes=64 << 20, release=False):
+        '''
+        Return a generator of (id, instance) pairs for the given ids of a multiple-file
+        data source (by default, all of them), in order. While the caller works on one
+        instance, the next readAhead instances (up to maxBytes on disk, or unbounded if
+        maxBytes is None) are read on the loader threads. Instances are kept loaded as
+        usual, unless release is true, in which case instances loaded by the prefetch are
+        forgotten again once the caller moves on, so a scan runs in bounded memory.
+        Ex: for _id, transcript in manager.prefetch('transcripts'): ...
+        '''
+        storage = self.getStorage(dataSourceType)
+        ids = list(self.getDataSourceIds(dataSourceType)) if ids is None else ids
+
+        def size(_id):
+            # Instances that are already loaded are handed back without touching the disk
+            return 0 if self._getSource(dataSourceType).get(_id) is not None else storage.size(_id)
+
+        prefetcher = Prefetcher(ids, (lambda _id: self._loadInstance(dataSourceType, _id)), size,
+            self._getExecutor(), readAhead, maxBytes)
+        try:
+            for _id, (instance, fresh) in prefetcher:
+                yield _id, instance
+                if release and fresh:
+                    self.release(dataSourceType, _id, instance)
+        finally:
+            prefetcher.close()
+
+    def isInstanceLoaded(self, dataSourceType, _id):
+        '''Return whether the given instance of a multiple-file data source is loaded.'''
+        source = self.data.get(dataSourceType)
+        return source is not None and source.get(_id) is not None
+
+    def release(self, dataSourceType, _id, instance):
+        '''
+        Forget a loaded instance of a multiple-file data source, unless it has been replaced
+        since it was handed out, so that it can be freed. It is reloaded on next access.
+        '''
+        with self._lockFor(dataSourceType):
+            source = self.data.get(dataSourceType)
+            if source is not None and source.get(_id) is instance:
+                source[_id] = None
+                self._tracedMemory.pop((dataSourceType, _id), None)
+
+    def _getExecutor(self):
+        '''
+        Return the thread pool that multiple-file data source instances are read on.
+        '''
+        with self._lock:
+            if self._executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._executor = ThreadPoolExecutor(max_workers=self.loadThreads, thread_name_prefix="loader")
+            return self._executor
+
+    def _lockFor(self, dataSourceType):
+        '''
+        Return the reentrant lock that guards loading and changing the given data source.
+        '''
+        try:
+            return self._sourceLocks[dataSourceType]
+        except KeyError:
+            with self._lock:
+                return self._sourceLocks.setdefault(dataSourceType, threading.RLock())
+
+    def writeDataSourceInstance(self, dataSourceType, _id, instance, validation=None):
+        '''
+        Write the given instance of a JSON data source to disk and update the loaded
+        data, if the data source has been initialized. For a single-file data source,
+        the instance is committed to the data source's change log. Otherwise, it is written
+        through the data source's storage backend (see getWritableStorage). The instance
+        is then validated (see validateWritten); validation, if given, overrides the data
+        source's validation mode for this write.
+        '''
+        if self.isSingle(dataSourceType):
+            with self.transaction(dataSourceType, validation) as txn:
+                txn.put(_id, instance)
         else:
-            # Ask for the data source ids. If they are already loaded, then
-            # this will do nothing. If not, it will initialize the data source.
-            self.getDataSourceIds(dataSourceType)
-            # But we only need to actually load this particular instance
-            ids = [_id]
-
-        for _id in ids:
-            # Check to see if the instance has already been loaded
-            if self.data[dataSourceType][_id] == None:
-                # If not, then load it.
-                self.data[dataSourceType][_id] = loader(utils.makeJSONFilename(directory, _id))
+            storage = self.getWritableStorage(dataSourceType)
+            storage.write(_id, instance)
+            with self._lockFor(dataSourceType):
+                self._inflight.pop((dataSourceType, _id), None)
+                self._tracedMemory.pop((dataSourceType, _id), None)
+                if dataSourceType in self.data:
+                    self.data[dataSourceType][_id] = instance
+                    self._versions[(dataSourceType, _id)] = storage.version(_id)
+                    self._versions[(dataSourceType, None)] = storage.version()
+            self.validateWritten(dataSourceType, {_id: instance}, validation)
+
+    def invalidate(self, dataSourceType, _id=None):
+        '''
+        Forget loaded data so that it is reloaded on next access. For a multiple-file
+        data source with an _id, only that instance is forgotten (and the id is added
+        if it is new). Otherwise, the entire data source is forgotten, including its ids.
+        '''
+        with self._lockFor(dataSourceType):
+            if _id is None or self.isSingle(dataSourceType):
+                self.data.pop(dataSourceType, None)
+                for key in [key for key in self._inflight if key[0] == dataSourceType]:
+                    del self._inflight[key]
+                for key in [key for key in self._versions if key[0] == dataSourceType]:
+                    del self._versions[key]
+                for key in [key for key in self._tracedMemory if key[0] == dataSourceType]:
+                    del self._tracedMemory[key]
+            else:
+                self._inflight.pop((dataSourceType, _id), None)
+                self._versions.pop((dataSourceType, _id), None)
+                self._tracedMemory.pop((dataSourceType, _id), None)
+                if dataSourceType in self.data:
+                    self.data[dataSourceType][_id] = None
 
     def loadDataSourceInstance(self, dataSourceType, _id=None):
         '''
@@ -122,6 +320,158 @@ class DataSourceManager():
         else:
             self.loadMulitpleDataSource(dataSourceType, _id)
 
+    ##############################################
+    ########## METADATA STORES AND STORAGE #######
+
+    def getStore(self, dataSourceType):
+        '''
+        Return the MetadataStore backing the given single-file data source.
+        '''
+        if not self.isSingle(dataSourceType):
+            raise KeyError("{0} is not a single-file data source.".format(dataSourceType))
+        try:
+            return self._stores[dataSourceType]
+        except KeyError:
+            directory = self.getDataSourceDirectory(dataSourceType)
+            compression = utils.compressionExtension(self.locations[dataSourceType].get('compression'))
+            with self._lock:
+                return self._stores.setdefault(dataSourceType,
+                    MetadataStore(utils.makeJSONFilename(directory, os.path.basename(directory)) + compression,
+                        useLoadCache=self.useLoadCache))
+
+    def getStorage(self, dataSourceType):
+        '''
+        Return the storage backend of the given multiple-file data source.
+        '''
+        if self.isSingle(dataSourceType):
+            raise KeyError("{0} is not a multiple-file data source.".format(dataSourceType))
+        try:
+            return self._storages[dataSourceType]
+        except KeyError:
+            with self._lock:
+                if dataSourceType not in self._storages:
+                    self._storages[dataSourceType] = makeStorage(os.path.join(self.top, self.dataDir),
+                        self.locations[dataSourceType])
+                return self._storages[dataSourceType]
+
+    def getWritableStorage(self, dataSourceType):
+        '''
+        Return the storage that instances of the given multiple-file data source are written
+        to: its storage backend or, if that is read-only (like a shard), the data source's
+        directory, which is read again once the data source is repacked.
+        '''
+        storage = self.getStorage(dataSourceType)
+        if not storage.readOnly:
+            return storage
+        try:
+            return self._writeStorages[dataSourceType]
+        except KeyError:
+            with self._lock:
+                if dataSourceType not in self._writeStorages:
+                    location = self.locations[dataSourceType]
+                    print("{0} is read from {1}, which is read-only; writing to its directory instead.".format(
+                        dataSourceType, storage.filename))
+                    self._writeStorages[dataSourceType] = DirectoryStorage(os.path.join(self.top, self.dataDir,
+                        location['dir']), location['isJson'], compression=location.get('compression'))
+                return self._writeStorages[dataSourceType]
+
+    @contextlib.contextmanager
+    def transaction(self, dataSourceType, validation=None):
+        '''
+        Return a context manager that yields a MetadataStore Transaction for the given
+        single-file data source. On exit, the transaction is committed to the data
+        source's change log, the loaded data is brought up to date, and the records the
+        transaction wrote are validated (see validateWritten); validation, if given,
+        overrides the data source's validation mode for them.
+        Ex: with manager.transaction('debateMetadata') as txn:
+                txn.update(debateId, {'moderators': moderatorIds})
+        '''
+        with self.getStore(dataSourceType).transaction() as txn:
+            yield txn
+        self.refresh(dataSourceType)
+
+        written = {op[1] for op in txn.ops if op[0] != "delete"}
+        source = self.data.get(dataSourceType)
+        if source is None:
+            # Only records that were put whole can be validated without loading the data source
+            # (the rest are validated when it is loaded)
+            records = {}
+            applyOps(records, txn.ops)
+            written -= {op[1] for op in txn.ops if op[0] != "put"}
+        else:
+            records = source
+        self.validateWritten(dataSourceType, {_id: records[_id] for _id in written if _id in records}, validation)
+
+    def refresh(self, dataSourceType=None):
+        '''
+        Bring loaded single-file data sources (or just the given one) up to date with
+        changes committed to their change logs by this or any other process. The changes
+        are applied to a copy of the loaded data, which then replaces it, so threads
+        reading the data source never see it change under them.
+        '''
+        names = [dataSourceType] if dataSourceType is not None else list(self._stores)
+        for name in names:
+            with self._lockFor(name):
+                if name in self.data:
+                    store = self.getStore(name)
+                    version = store.version()
+                    if version != self._versions.get((name, None)):
+                        self._versions[(name, None)] = version
+                        self.data[name] = store.refresh(dict(self.data[name]))
+
+    def compact(self, dataSourceType):
+        '''
+        Fold the change log of the given single-file data source into its JSON file.
+        '''
+        self.getStore(dataSourceType).compact()
+
+    ##############################################
+    ################# VALIDATION #################
+
+    def getValidationMode(self, dataSourceType):
+        '''
+        Return the validation mode for this data source: an override passed to the
+        constructor, the 'validation' key in the locs file, or 'off'. Data sources
+        without a schema are never validated.
+        '''
+        if 'schema' not in self.locations[dataSourceType]:
+            return SchemaValidator.OFF
+        return self.validationModes.get(dataSourceType,
+            self.locations[dataSourceType].get('validation', SchemaValidator.OFF))
+
+    def submitValidation(self, dataSourceType, data, label, mode=None):
+        '''
+        Queue newly loaded (or newly written) data for this data source to be
+        validated on the background validation thread. Loaded single-file data sources
+        are never changed in place (see refresh), so they are validated as they are.
+        '''
+        mode = self.getValidationMode(dataSourceType) if mode is None else mode
+        if mode != SchemaValidator.OFF:
+            self.validator.submit(dataSourceType, self.locations[dataSourceType]['schema'],
+                data, self.isSingle(dataSourceType), mode, label)
+
+    def validateWritten(self, dataSourceType, instances, mode=None):
+        '''
+        Queue instances that were just written to a data source, given as a dictionary by
+        id, for validation (see submitValidation). Every write goes through here. The records
+        written to a single-file data source are validated together, as part of its file.
+        '''
+        if not instances:
+            return
+        if self.isSingle(dataSourceType):
+            self.submitValidation(dataSourceType, instances, self.getStore(dataSourceType).snapshotFile, mode)
+        else:
+            storage = self.getWritableStorage(dataSourceType)
+            for _id, instance in instances.items():
+                self.submitValidation(dataSourceType, instance, storage.location(_id), mode)
+
+    def validateLocs(self):
+        '''
+        Validate the locs file against its own schema and return the report.
+        '''
+        locs = utils.getJSON(self.locsFile)
+        return self.validator.validateInstance("locs", self.locsSchema, locs, self.locsFile)
+
     ##############################################
     ############### INTERNAL ACCESS ##############
 
@@ -142,14 +492,20 @@ class DataSourceManager():
         Return the direct reference to the data source dictionary in memory.
         If the data source has not been initialized, then load the ids and try again.
         '''
+        self._record(dataSourceName, None)
+        return self._getSource(dataSourceName)
+
+    def _getSource(self, dataSourceName):
         try:
             return self.data[dataSourceName]
         except KeyError:
-            try:
-                self.loadDataSourceIds(dataSourceName)
-                return self.getDataSource(dataSourceName)
-            except KeyError:
+            if dataSourceName not in self.locations:
                 raise KeyError("{0} is not a valid data source name.".format(dataSourceName))
+            # Only one thread loads the data source; the others wait for it
+            with self._lockFor(dataSourceName):
+                if dataSourceName not in self.data:
+                    self.loadDataSourceIds(dataSourceName)
+                return self.data[dataSourceName]
 
     ##############################################
     ############## EXTERNAL ACCESS ###############
@@ -165,18 +521,198 @@ class DataSourceManager():
         Get an iterable of ids for the given data source. If the data source 
         has not been initialized, then load the ids and try again.
         '''
-        try:
-            return self.data[dataSource].keys()
-        except KeyError:
-            self.loadDataSourceIds(dataSource)
-            return self.getDataSourceIds(dataSource)
+        self._record(dataSource, None)
+        return self._getSource(dataSource).keys()
+
+
+    def iterDataSourceItems(self, dataSourceName, _id, key):
+        '''
+        Return a generator over the items of the list stored under key in the given
+        instance of a multiple-file JSON data source. If the instance is already loaded,
+        iterate over it. Otherwise, stream the items from its file as it is read, without
+        loading (or caching) the whole instance, so stopping early stops the read.
+        '''
+        if self.isSingle(dataSourceName) or not self.locations[dataSourceName]['isJson']:
+            raise KeyError("{0} is not a multiple-file JSON data source.".format(dataSourceName))
+        self._record(dataSourceName, _id)
+        instance = self._getSource(dataSourceName)[_id]
+        if instance is not None:
+            return iter(instance[key])
+        return self._streamItems(dataSourceName, _id, key)
 
+    def _streamItems(self, dataSourceName, _id, key):
+        with self.getStorage(dataSourceName).open(_id) as file:
+            yield from utils.iterJSONArray(file, key)
 
     def getDataSourceInstance(self, dataSourceName, _id):
         '''
         Return the direct reference to the given data source instance.
         If it has not been loaded, then load it first.
         '''
-        if self.getDataSource(dataSourceName)[_id] == None:
-            self.loadDataSourceInstance(dataSourceName, _id)
-        return self.getDataSource(dataSourceName)[_id]
+        single = self.isSingle(dataSourceName)
+        self._record(dataSourceName, None if single else _id)
+        instance = self._getSource(dataSourceName)[_id]
+        if instance is None and not single:
+            instance = self._loadInstance(dataSourceName, _id)[0]
+        return instance
+
+    ##############################################
+    ########### VERSIONS AND DEPENDENCIES ########
+
+    def version(self, dataSourceName, _id=None):
+        '''
+        Return a stamp identifying the version of a dependency: an instance of a multiple-file
+        data source, the id list of a multiple-file data source (if _id is None), or a whole
+        single-file data source (_id is ignored). If the dependency is loaded, this is its
+        version when it was loaded, so the stamp changes exactly when the data is reloaded;
+        otherwise, it is the version currently on disk, which is what would be loaded.
+        Stamps are based on the files themselves, so they are comparable across processes.
+        '''
+        if self.isSingle(dataSourceName):
+            _id = None
+        try:
+            return self._versions[(dataSourceName, _id)]
+        except KeyError:
+            return self.diskVersion(dataSourceName, _id)
+
+    def diskVersion(self, dataSourceName, _id=None):
+        '''
+        Return the version of a dependency (see version) as it is currently on disk, whether
+        or not it is loaded. This stats the dependency's files.
+        '''
+        if self.isSingle(dataSourceName):
+            return self.getStore(dataSourceName).version()
+        return self.getStorage(dataSourceName).version(_id)
+
+    @contextlib.contextmanager
+    def recordDependencies(self):
+        '''
+        Return a context manager that yields a set, which collects the (data source, id)
+        dependencies read through this manager by the current thread until it exits (id is
+        None for a single-file data source or a multiple-file data source's id list).
+        Recordings nest: an inner recording's dependencies are added to the outer one.
+        '''
+        stack = self._recording.__dict__.setdefault('stack', [])
+        dependencies = set()
+        stack.append(dependencies)
+        try:
+            yield dependencies
+        finally:
+            stack.pop()
+            if stack:
+                stack[-1].update(dependencies)
+
+    def noteDependencies(self, dependencies):
+        '''
+        Add dependencies to the current thread's recording, if any, e.g. for a result that
+        was reused from a cache instead of being computed.
+        '''
+        stack = getattr(self._recording, 'stack', None)
+        if stack:
+            stack[-1].update(dependencies)
+
+    def _record(self, dataSourceName, _id):
+        stack = getattr(self._recording, 'stack', None)
+        if stack:
+            stack[-1].add((dataSourceName, _id))
+
+    ##############################################
+    ############### INSTRUMENTATION ##############
+
+    def _noteLoad(self, dataSourceType, _id, seconds, traced):
+        # Called with the data source's lock held
+        stats = self._loadStats[dataSourceType]
+        stats['loads'] += 1
+        stats['seconds'] += seconds
+        if traced is not None:
+            self._tracedMemory[(dataSourceType, _id)] = traced
+
+    def _traced(self, load, *args):
+        '''
+        Call load(*args) and return its result with the memory it left allocated, as traced
+        by tracemalloc, or None if memory is not being traced. Traced loads run one at a
+        time, so that each load's memory is attributed to it alone.
+        '''
+        traceLock = self._traceLock
+        if traceLock is None:
+            return load(*args), None
+        import tracemalloc
+        with traceLock:
+            before = tracemalloc.get_traced_memory()[0]
+            result = load(*args)
+            return result, tracemalloc.get_traced_memory()[0] - before
+
+    def traceMemory(self, enable=True):
+        '''
+        Start (or stop) attributing memory to the data source instances loaded from now on,
+        using tracemalloc, which is started if it is not already running (and stopped again
+        when tracing is disabled, if this manager started it). Tracing slows loading down
+        considerably and serializes it, so it is meant for diagnosis. See tracedInstances.
+        '''
+        import tracemalloc
+        with self._lock:
+            if enable and self._traceLock is None:
+                self._startedTracemalloc = not tracemalloc.is_tracing()
+                if self._startedTracemalloc:
+                    tracemalloc.start()
+                self._traceLock = threading.Lock()
+            elif not enable and self._traceLock is not None:
+                self._traceLock = None
+                self._tracedMemory.clear()
+                if self._startedTracemalloc:
+                    tracemalloc.stop()
+
+    def tracedInstances(self, dataSourceType=None, limit=None):
+        '''
+        Return a list of ((data source, id), bytes) pairs for the loaded instances whose
+        memory was traced (see traceMemory), largest first. The id is None for a single-file
+        data source. Only instances loaded while tracing are included.
+        '''
+        with self._lock:
+            traced = [(key, size) for key, size in self._tracedMemory.items()
+                if dataSourceType is None or key[0] == dataSourceType]
+        traced.sort(key=lambda item: item[1], reverse=True)
+        return traced if limit is None else traced[:limit]
+
+    def stats(self, sizes=True):
+        '''
+        Return a dictionary describing what the manager holds and has done:
+            dataSources maps each data source that has been touched to its number of ids
+                (entries, for a single-file data source), number of loaded instances, number
+                of loads and seconds spent loading, the estimated size in bytes of its loaded
+                data (if sizes is true; see utils.estimateSize), and the memory traced for its
+                instances (if memory is being traced; see traceMemory).
+            io maps each instrumented loader in utils to its calls and seconds (see utils.ioStats).
+            typeLookups maps each data type and data source to the number of times it was
+                found by TypeNode.getSubtype.
+            tracing is true if memory is being traced.
+        Estimating sizes walks all of the loaded data, so pass sizes=False to skip it.
+        '''
+        traced = collections.Counter()
+        for (dataSourceType, _), size in list(self._tracedMemory.items()):
+            traced[dataSourceType] += size
+        dataSources = {}
+        for dataSourceType in set(self.data) | set(self._loadStats):
+            source = self.data.get(dataSourceType, {})
+            instances = [instance for instance in list(source.values()) if instance is not None]
+            stats = {'ids': len(source), 'loaded': len(instances)}
+            stats.update(self._loadStats.get(dataSourceType, {'loads': 0, 'seconds': 0.0}))
+            if sizes:
+                stats['estimatedBytes'] = utils.estimateSize(instances)
+            if self._traceLock is not None:
+                stats['tracedBytes'] = traced[dataSourceType]
+            dataSources[dataSourceType] = stats
+        return {
+            'dataSources': dataSources,
+            'io': utils.ioStats(),
+            'typeLookups': {name: count for name, count in self._root.lookups().items() if count},
+            'tracing': self._traceLock is not None
+        }
+
+    def resetStats(self):
+        '''
+        Reset the load counts and times, the utils loader counts, and the type lookup counts.
+        '''
+        self._loadStats.clear()
+        utils.resetIOStats()
+        self._root.resetLookups()
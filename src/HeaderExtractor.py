@@ -0,0 +1,138 @@
+'''
+Contains the HeaderExtractor class, a shared extraction stage for raw
+transcripts. Each raw transcript is whitespace-normalized once, and its
+header is scanned once for the participants and moderators sections.
+The results are cached in the transcriptsNormalized data source, keyed
+by a hash of the raw transcript, so they are only recomputed when the
+raw transcript changes (which is only checked when the raw transcript's
+file stamp changes). The parser also stores the offset where each
+transcript's utterances begin in the same record, so it is forgotten
+(and found again by the next parse) whenever the raw transcript changes.
+'''
+
+import hashlib
+import re
+
+import utils
+from ThesisDataAccessor import Accessor as data
+
+
+class HeaderExtractor:
+    '''
+    Normalizes raw transcripts and extracts their header sections, caching both.
+    '''
+
+    # Header sections only appear near the start of a transcript, so only this
+    # many characters of the normalized text are scanned for them.
+    headerRegionLength = 32768
+
+    # Match the participants and the moderators sections of a header; 'names' holds the
+    # <br/>-separated names in the section. Each is searched for separately, since the
+    # sections can overlap.
+    sections = {
+        'participants': re.compile(r"<(?:b|i)> (?:PARTICIPANTS|Participants|Candidates): "
+                                   r"(?:<br/> )?</(?:b|i)> (?:<br/> )?(?P<names>.*?) </?p>"),
+        'moderators': re.compile(r"<(?:b|i)> (?:HOSTS?|Hosts?|MODERATORS?|Moderators?): "
+                                 r"(?:<br/> )?</(?:b|i)> (?:<br/> )?(?P<names>.*?) </?p>")
+    }
+
+    whitespace = re.compile(r"\s+")
+
+    def __init__(self, manager=None):
+        self.manager = data.dataManager if manager is None else manager
+
+    @classmethod
+    def normalize(cls, raw):
+        '''
+        Collapse every run of whitespace in a raw transcript to a single space.
+        '''
+        return cls.whitespace.sub(" ", raw)
+
+    @classmethod
+    def extractHeader(cls, normalized):
+        '''
+        Find the first participants section and the first moderators section in the header
+        region of a normalized transcript. Returns a dictionary with the names string of each
+        section (or None if it is missing) and headerLength, the offset just past the last
+        section found (or 0 if neither was found).
+        '''
+        header = {'participants': None, 'moderators': None, 'headerLength': 0}
+        for section, pattern in cls.sections.items():
+            match = pattern.search(normalized, 0, cls.headerRegionLength)
+            if match is not None:
+                header[section] = match.group('names')
+                header['headerLength'] = max(header['headerLength'], match.end())
+        return header
+
+    @staticmethod
+    def hashRaw(raw):
+        '''
+        Return the hash used to key the cache for a raw transcript.
+        '''
+        return hashlib.sha1(raw.encode('latin1', errors='replace')).hexdigest()
+
+    def get(self, _id):
+        '''
+        Return the cached transcriptsNormalized record for the given debate, rebuilding
+        it if it is missing or the raw transcript has changed since it was built. The raw
+        transcript is only read and hashed if its version (e.g. its file stamp) has changed
+        since it was last checked.
+        '''
+        rawVersion = self.manager.version('transcriptsRaw', _id)
+        rawVersion = None if rawVersion is None else list(rawVersion)
+
+        try:
+            record = self.manager.getDataSourceInstance('transcriptsNormalized', _id)
+        except KeyError:
+            record = None
+        if record is not None and rawVersion is not None and record.get('rawVersion') == rawVersion:
+            return record
+
+        raw = self.manager.getDataSourceInstance('transcriptsRaw', _id)
+        rawHash = HeaderExtractor.hashRaw(raw)
+        if record is None or record['rawHash'] != rawHash:
+            normalized = HeaderExtractor.normalize(raw)
+            record = {
+                'id': _id,
+                'rawHash': rawHash,
+                'text': normalized,
+                'header': HeaderExtractor.extractHeader(normalized)
+            }
+        if rawVersion is not None:
+            record = dict(record, rawVersion=rawVersion)
+        self.manager.writeDataSourceInstance('transcriptsNormalized', _id, record)
+        return record
+
+    @staticmethod
+    def utteranceOffset(record, utteranceIterator):
+        '''
+        Return the offset in the normalized text where utterances begin, as stored in a
+        transcriptsNormalized record by the parser, or None if it has not been stored for
+        the given header length (the parsing metadata's utteranceIterator).
+        '''
+        start = record.get('utteranceStart')
+        if start is None or start['utteranceIterator'] != utteranceIterator:
+            return None
+        return start['offset']
+
+    def setUtteranceOffset(self, record, utteranceIterator, offset):
+        '''
+        Store the offset where utterances begin, for the given header length, in a debate's
+        transcriptsNormalized record.
+        '''
+        record = dict(record, utteranceStart={'utteranceIterator': utteranceIterator, 'offset': offset})
+        self.manager.writeDataSourceInstance('transcriptsNormalized', record['id'], record)
+        return record
+
+    def normalizedText(self, _id):
+        '''
+        Return the whitespace-normalized raw transcript for the given debate.
+        '''
+        return self.get(_id)['text']
+
+    def header(self, _id):
+        '''
+        Return the extracted header (participants, moderators, and headerLength) for
+        the given debate.
+        '''
+        return self.get(_id)['header']
@@ -0,0 +1,257 @@
+'''
+Contains the MetadataStore class, which backs a single-file JSON data
+source with an append-only change log. Changes are committed as single
+lines appended to the log under an exclusive file lock, so a commit costs
+O(change) and is safe when several processes write at once. Readers load
+the JSON snapshot, replay the log on top of it, and afterwards only read
+the part of the log they have not seen yet. Every so often, the log is
+compacted into a new snapshot.
+'''
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+
+import utils
+
+
+class Transaction:
+    '''
+    A batch of changes to a MetadataStore that is committed as a single log record.
+    Use MetadataStore.transaction() (or DataSourceManager.transaction()) to get one.
+    '''
+
+    def __init__(self):
+        self.ops = []
+
+    def put(self, _id, record):
+        '''Add or replace the record with the given id.'''
+        self.ops.append(["put", _id, record])
+
+    def update(self, _id, fields):
+        '''Set the given fields of the record with the given id, leaving the rest alone.'''
+        self.ops.append(["update", _id, fields])
+
+    def delete(self, _id):
+        '''Remove the record with the given id, if it exists.'''
+        self.ops.append(["delete", _id])
+
+
+def applyOps(data, ops):
+    '''
+    Apply the operations from a log record to a data source dictionary in place. Records
+    are replaced rather than changed, so a shallow copy of data is a consistent snapshot,
+    and changes can be applied to a copy without affecting readers of the original.
+    '''
+    for op in ops:
+        if op[0] == "put":
+            data[op[1]] = op[2]
+        elif op[0] == "update":
+            data[op[1]] = dict(data.get(op[1], {}), **op[2])
+        elif op[0] == "delete":
+            data.pop(op[1], None)
+        else:
+            raise ValueError("Unknown metadata log operation: {0}".format(op[0]))
+
+
+class MetadataStore:
+    '''
+    A single-file JSON data source with an append-only change log. The log is stored
+    next to the snapshot with a .log extension, and is compacted into the snapshot
+    once it grows past compactThreshold bytes. The log's first line is a header with
+    its generation, which compaction increments, so readers can tell a new log from
+    the one they have been reading.
+    '''
+
+    # Where the lock files are kept, so locking never writes into the data tree
+    lockDirectory = None
+
+    def __init__(self, snapshotFile, compactThreshold=1 << 20, useLoadCache=True):
+        self.snapshotFile = snapshotFile
+        directory, basename = os.path.split(snapshotFile)
+        self.logFile = os.path.join(directory, basename.split('.')[0] + ".log")
+        self.compactThreshold = compactThreshold
+        self.loader = utils.getCachedJSON if useLoadCache else utils.getJSON
+        # The (generation, offset) of the log up to which changes have been read
+        self._position = None
+
+    @property
+    def lockFile(self):
+        '''
+        The lock file for this store, named after the snapshot's real path, in the
+        lockDirectory (by default, a directory in the system's temporary directory).
+        '''
+        directory = MetadataStore.lockDirectory
+        if directory is None:
+            import tempfile
+            directory = os.path.join(tempfile.gettempdir(), "three-cheers-locks")
+        name = hashlib.sha1(os.path.realpath(self.snapshotFile).encode('utf-8')).hexdigest()
+        return os.path.join(directory, name + ".lock")
+
+    def writable(self):
+        '''Return whether changes can be committed to this store.'''
+        directory = os.path.dirname(self.snapshotFile) or os.curdir
+        return os.access(directory, os.W_OK) or os.access(self.logFile, os.W_OK)
+
+    @contextlib.contextmanager
+    def _locked(self, exclusive):
+        '''
+        Hold a shared (for reading) or exclusive (for writing) lock on the store. Readers
+        of a store that cannot be written, or that cannot create the lock file, do not lock.
+        '''
+        if not exclusive and not self.writable():
+            yield
+            return
+        lockFile = self.lockFile
+        try:
+            os.makedirs(os.path.dirname(lockFile), exist_ok=True)
+            lock = open(lockFile, 'a')
+        except OSError:
+            if exclusive:
+                raise
+            lock = None
+        if lock is None:
+            yield
+            return
+        with lock:
+            fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _header(generation):
+        return (json.dumps({'generation': generation}) + '\n').encode('utf-8')
+
+    @staticmethod
+    def _readHeader(log):
+        '''
+        Return the generation of an open log and the offset of its first record. Logs
+        written before logs had headers are generation 0.
+        '''
+        line = log.readline()
+        if line.endswith(b'\n'):
+            header = json.loads(line.decode('utf-8'))
+            if isinstance(header, dict):
+                return header['generation'], len(line)
+        return 0, 0
+
+    def generation(self):
+        '''Return the generation of the log (0 if there is no log yet).'''
+        try:
+            with open(self.logFile, 'rb') as log:
+                return self._readHeader(log)[0]
+        except FileNotFoundError:
+            return 0
+
+    def _replay(self, data, position=None):
+        '''
+        Apply every complete log record after position (a (generation, offset) pair from
+        this log's generation) to data, or every record if position is None. A trailing
+        partial line (from a writer that crashed mid-append) is ignored. Returns the
+        position just past the last record applied.
+        '''
+        try:
+            log = open(self.logFile, 'rb')
+        except FileNotFoundError:
+            return (0, 0)
+        with log:
+            generation, offset = self._readHeader(log)
+            if position is not None:
+                offset = max(offset, position[1])
+            log.seek(offset)
+            for line in log:
+                if not line.endswith(b'\n'):
+                    break
+                applyOps(data, json.loads(line.decode('utf-8')))
+                offset += len(line)
+        return (generation, offset)
+
+    ##############################################
+    ################## READING ###################
+
+    def version(self):
+        '''
+        Return a stamp identifying the current version of the data source on disk,
+        which changes whenever a change is committed or the log is compacted.
+        '''
+        return (utils.getFileStamp(self.snapshotFile), utils.getFileStamp(self.logFile))
+
+    def load(self):
+        '''
+        Return the current state of the data source: the snapshot with the log replayed.
+        '''
+        with self._locked(False):
+            data = self.loader(self.snapshotFile)
+            self._position = self._replay(data)
+        return data
+
+    def refresh(self, data):
+        '''
+        Bring data (as returned by load) up to date with changes committed since it was
+        loaded or last refreshed. Usually, only the new part of the log is read and data
+        is updated in place. If the log has been compacted in the meantime, the data
+        source is loaded again. Returns the up-to-date data.
+        '''
+        with self._locked(False):
+            if self._position is None or self.generation() != self._position[0]:
+                data = self.loader(self.snapshotFile)
+                self._position = self._replay(data)
+            else:
+                self._position = self._replay(data, self._position)
+        return data
+
+    ##############################################
+    ################## WRITING ###################
+
+    def commit(self, transaction):
+        '''
+        Atomically append a transaction to the log as a single record, compacting the
+        log afterwards if it has grown too large.
+        '''
+        if not transaction.ops:
+            return
+        record = (json.dumps(transaction.ops) + '\n').encode('utf-8')
+        with self._locked(True):
+            fd = os.open(self.logFile, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size == 0:
+                    record = self._header(0) + record
+                os.write(fd, record)
+                os.fsync(fd)
+                size = os.fstat(fd).st_size
+            finally:
+                os.close(fd)
+            if size >= self.compactThreshold:
+                self._compact()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        '''
+        Return a context manager that yields a Transaction and commits it on exit,
+        unless an exception was raised.
+        '''
+        transaction = Transaction()
+        yield transaction
+        self.commit(transaction)
+
+    def compact(self):
+        '''
+        Fold the log into a new snapshot and start a new, empty log.
+        '''
+        with self._locked(True):
+            self._compact()
+
+    def _compact(self):
+        # Must be called with the exclusive lock held
+        data = utils.getJSON(self.snapshotFile)
+        generation, _ = self._replay(data)
+        utils.writeJSON(data, self.snapshotFile)
+        # Replace the log with an empty one of the next generation, so readers reload
+        tmp = self.logFile + ".tmp"
+        with open(tmp, 'wb') as log:
+            log.write(self._header(generation + 1))
+        os.replace(tmp, self.logFile)
@@ -0,0 +1,235 @@
+'''
+Contains the packed shard format for multiple-file data sources, the
+ShardStorage backend that reads it through mmap, and a command to pack
+an existing data source directory into a shard.
+
+A shard file is laid out as:
+    - the magic bytes b"TCSHARD1"
+    - the length of the header table, as a 4-byte big-endian integer
+    - the header table, as UTF-8 JSON: {"isJson": bool, "records": {id: [offset, length, crc32, codec]}}
+    - the records, concatenated
+Offsets are from the start of the file. Each record holds the bytes of the
+instance's original file, compressed with zlib if its codec is "zlib", and
+crc32 is the checksum of the stored (possibly compressed) bytes.
+'''
+
+import argparse
+import io
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import zlib
+
+import utils
+
+MAGIC = b"TCSHARD1"
+_lengthFormat = ">I"
+_prefixLength = len(MAGIC) + struct.calcsize(_lengthFormat)
+
+
+class ShardError(Exception):
+    '''Raised for malformed shards and records that fail their checksum.'''
+
+
+class ReadOnlyError(ShardError):
+    '''Raised when writing to a shard, which can only be repacked.'''
+
+
+def writeShard(filename, records, isJson, compress=False):
+    '''
+    Write a shard file from an iterable of (id, bytes) records, which is consumed as the
+    records are written. Since the header (which comes first) holds every record's
+    offset, the records are spooled to a temporary file and copied in after it. The shard
+    is written to a temporary file and moved into place, so readers never see a partial shard.
+    '''
+    directory = os.path.dirname(os.path.abspath(filename))
+    table = {}
+    offset = 0
+    with tempfile.TemporaryFile(dir=directory) as spool:
+        for _id, content in records:
+            stored = zlib.compress(content) if compress else content
+            table[_id] = [offset, len(stored), zlib.crc32(stored), "zlib" if compress else "none"]
+            spool.write(stored)
+            offset += len(stored)
+
+        # Offsets are relative to the end of the header until its size is known
+        def encodeHeader(base):
+            records = {_id: [entry[0] + base] + entry[1:] for _id, entry in table.items()}
+            return json.dumps({'isJson': isJson, 'records': records}, sort_keys=True).encode('utf-8')
+        header = encodeHeader(0)
+        # The header only grows as offsets grow, so iterate until its length is stable
+        while True:
+            base = _prefixLength + len(header)
+            newHeader = encodeHeader(base)
+            if len(newHeader) == len(header):
+                header = newHeader
+                break
+            header = newHeader
+
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as shard:
+                shard.write(MAGIC)
+                shard.write(struct.pack(_lengthFormat, len(header)))
+                shard.write(header)
+                spool.seek(0)
+                shutil.copyfileobj(spool, shard, 1 << 20)
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, filename)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+
+class ShardStorage:
+    '''
+    A read-only storage backend for a multiple-file data source packed into a single shard.
+    The shard is memory-mapped on first use, so reading an instance is a slice of the map
+    rather than an open/read/close of its own file, and mapped again whenever it is
+    repacked. Shards can be pickled (e.g. into pool workers); each process maps the file itself.
+    '''
+
+    readOnly = True
+
+    def __init__(self, filename, isJson, encoding='latin1', verify=True):
+        self.filename = filename
+        self.isJson = isJson
+        self.encoding = encoding
+        self.verify = verify
+        # The (file stamp, map, records by id) the shard was last mapped as
+        self._state = None
+        # The map replaced by the last repack, closed on the next one, once its readers are done
+        self._retired = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_state'] = None
+        state['_retired'] = None
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _open(self):
+        '''
+        Return the map of the shard and its records by id, mapping it again if the shard
+        has been repacked since it was last mapped.
+        '''
+        stamp = utils.getFileStamp(self.filename)
+        state = self._state
+        if state is not None and state[0] == stamp:
+            return state[1], state[2]
+        with self._lock:
+            if self._state is None or self._state[0] != stamp:
+                with open(self.filename, 'rb') as shard:
+                    mapped = mmap.mmap(shard.fileno(), 0, access=mmap.ACCESS_READ)
+                if mapped[:len(MAGIC)] != MAGIC:
+                    mapped.close()
+                    raise ShardError("{0} is not a shard file.".format(self.filename))
+                headerLength = struct.unpack(_lengthFormat, mapped[len(MAGIC):_prefixLength])[0]
+                header = json.loads(mapped[_prefixLength:_prefixLength + headerLength].decode('utf-8'))
+                if self._retired is not None:
+                    self._retired.close()
+                self._retired = None if self._state is None else self._state[1]
+                self._state = (stamp, mapped, header['records'])
+            return self._state[1], self._state[2]
+
+    def ids(self):
+        '''Return a list of the ids stored in the shard.'''
+        return list(self._open()[1].keys())
+
+    def location(self, _id):
+        '''Return a string describing where the instance is stored.'''
+        return "{0}#{1}".format(self.filename, _id)
+
+    def version(self, _id=None):
+        '''Return a stamp identifying the current version of the shard (and so of every instance).'''
+        return utils.getFileStamp(self.filename)
+
+    def size(self, _id):
+        '''Return the size of the given instance as stored in the shard, in bytes.'''
+        return self._open()[1][_id][1]
+
+    def readBytes(self, _id):
+        '''
+        Return the original file bytes of the given instance, checking its checksum.
+        '''
+        mapped, records = self._open()
+        offset, length, crc, codec = records[_id]
+        stored = mapped[offset:offset + length]
+        if self.verify and zlib.crc32(stored) != crc:
+            raise ShardError("Checksum mismatch for {0}".format(self.location(_id)))
+        return zlib.decompress(stored) if codec == "zlib" else stored
+
+    def read(self, _id):
+        '''Return the decoded instance (JSON or text) with the given id.'''
+        text = self.readBytes(_id).decode(self.encoding)
+        return json.loads(text) if self.isJson else text
+
+    def open(self, _id, mode='r'):
+        '''Return a file object (binary if mode has a b, text otherwise) over the given instance.'''
+        content = self.readBytes(_id)
+        return io.BytesIO(content) if 'b' in mode else io.StringIO(content.decode(self.encoding))
+
+    def write(self, _id, instance):
+        raise ReadOnlyError("{0} is a read-only shard. Write to the data source directory and repack it.".format(self.filename))
+
+    def close(self):
+        with self._lock:
+            for mapped in (self._retired, None if self._state is None else self._state[1]):
+                if mapped is not None:
+                    mapped.close()
+            self._state = None
+            self._retired = None
+
+
+def pack(dataSourceName, output=None, compress=False, archive=False):
+    '''
+    Pack every instance of a multiple-file data source, as currently stored in its data
+    source directory, into a shard (or, if archive is true, a zip archive; see
+    StorageBackend.ZipStorage). Returns the filename written.
+    '''
+    from StorageBackend import DirectoryStorage, ZipStorage
+    from ThesisDataAccessor import Accessor as data
+
+    manager = data.dataManager
+    location = manager.locations[dataSourceName]
+    if location['single']:
+        raise KeyError("{0} is a single-file data source.".format(dataSourceName))
+    source = DirectoryStorage(manager.getDataSourceDirectory(dataSourceName), location['isJson'])
+    if output is None:
+        output = os.path.normpath(source.directory) + (".zip" if archive else ".shard")
+
+    def records():
+        # Compressed files are decompressed, since each record has its own codec
+        for _id in sorted(source.ids()):
+            with source.open(_id, 'rb') as instanceFile:
+                yield _id, instanceFile.read()
+    if archive:
+        ZipStorage(output, location['isJson']).writeRecords(records())
+    else:
+        writeShard(output, records(), location['isJson'], compress)
+    return output
+
+
+def getArgs():
+    parser = argparse.ArgumentParser(description='''Pack a multiple-file data source directory into a single shard file.
+                                                  To read from the shard, set the data source's "storage" in locs.json to
+                                                  {"backend": "shard", "file": <shard path relative to the data directory>}.''')
+    parser.add_argument('dataSource', help="The name of the data source in locs.json, e.g. transcripts.")
+    parser.add_argument('--output', default=None, help="The shard file to write (defaults to the data source directory plus .shard).")
+    parser.add_argument('--compress', action='store_true', help="Compress each record with zlib.")
+    parser.add_argument('--zip', action='store_true', help="Pack into a zip archive instead, read with the zip storage backend.")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = getArgs()
+    filename = pack(args.dataSource, args.output, args.compress, args.zip)
+    print("Packed {0} into {1}.".format(args.dataSource, filename))
@@ -9,6 +9,10 @@ class PartialDataAccessor:
     '''
     __metaclass__ = abc.ABCMeta
 
+    # The number of PartialDataObjects created for this accessor (approximate if several
+    # threads share it). A class attribute, so reading it never falls through to __getattr__.
+    _pdoAllocations = 0
+
     @abc.abstractmethod
     def _getPdoAttr(self, pdo, name):
         '''Delegate method for PartialDataObject attribute access.'''
@@ -58,6 +62,7 @@ class PartialDataAccessor:
             '''
             obj = cls()
             obj._pda = partialDataAccessor
+            partialDataAccessor._pdoAllocations += 1
             obj._args = []
             obj._kwargs = {}
             return obj
@@ -0,0 +1,81 @@
+'''
+Contains the Prefetcher class, which reads the instances of a multiple-file
+data source ahead of the caller on a thread pool. Reads (disk I/O and JSON
+decoding) for the next few instances overlap with whatever the caller does
+with the current one, while the number and total on-disk size of instances
+read ahead are capped so that a corpus scan stays within bounded memory.
+'''
+
+import collections
+
+
+class Prefetcher:
+    '''
+    An iterator of (id, instance) pairs, in the order of the given ids. At most readAhead
+    instances, totaling at most maxBytes on disk, are read (or being read) ahead of the
+    caller at once (maxBytes may be None for no cap); a single instance larger than
+    maxBytes is still read, on its own.
+    read is a function of an id that returns the instance, and size a function of an id
+    that returns its size on disk. Call close() (or exhaust the iterator) to cancel any
+    reads still pending.
+    '''
+
+    def __init__(self, ids, read, size, executor, readAhead=8, maxBytes=64 << 20):
+        self._ids = iter(ids)
+        self._read = read
+        self._size = size
+        self._executor = executor
+        self.readAhead = max(1, readAhead)
+        self.maxBytes = maxBytes
+        # (id, size, future) for each read in flight, in order
+        self._pending = collections.deque()
+        self._pendingBytes = 0
+        # An id whose read was held back by the memory cap
+        self._next = None
+
+    def _fill(self):
+        '''
+        Submit reads until the read-ahead window or the memory cap is full.
+        '''
+        while len(self._pending) < self.readAhead:
+            if self._next is None:
+                try:
+                    _id = next(self._ids)
+                except StopIteration:
+                    return
+                self._next = (_id, self._size(_id))
+            _id, size = self._next
+            if self._pending and self.maxBytes is not None and self._pendingBytes + size > self.maxBytes:
+                return
+            self._next = None
+            self._pending.append((_id, size, self._executor.submit(self._read, _id)))
+            self._pendingBytes += size
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self._fill()
+        if not self._pending:
+            raise StopIteration
+        _id, size, future = self._pending.popleft()
+        self._pendingBytes -= size
+        try:
+            instance = future.result()
+        except BaseException:
+            self.close()
+            raise
+        # Start the next read before handing this instance to the caller
+        self._fill()
+        return _id, instance
+
+    def close(self):
+        '''
+        Cancel the reads that have not started yet.
+        '''
+        for _, _, future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._pendingBytes = 0
+        self._ids = iter(())
+        self._next = None
@@ -0,0 +1,188 @@
+'''
+Contains the QueryCache class, which memoizes user-registered derived queries
+over the data accessor (e.g. applause counts per debate). While a query runs,
+the data manager records every data source instance it reads; the result is
+stored with the version of each of those dependencies and is reused only
+while every dependency still has the same version. Results are kept in an
+in-memory LRU, and optionally in a directory on disk so that they survive
+between sessions.
+'''
+
+import collections
+import functools
+import hashlib
+import marshal
+import os
+import pickle
+import threading
+
+
+class QueryCache:
+    '''
+    Memoizes registered queries by name, arguments, and the versions of the data they
+    read. Query arguments must have a stable repr, and results must be picklable to be
+    cached on disk. Set cacheDir to a directory to enable the disk tier.
+    '''
+
+    def __init__(self, manager, maxEntries=256, cacheDir=None):
+        self.manager = manager
+        self.maxEntries = maxEntries
+        self.cacheDir = cacheDir
+        self._queries = {}
+        # key -> (dependency versions, result), least recently used first
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.resetStats()
+
+    ##############################################
+    ################ REGISTRATION ################
+
+    def registrations(self):
+        '''Return a dictionary of the registered query functions by name.'''
+        return {name: f for name, (f, _) in self._queries.items()}
+
+    def register(self, f, name=None):
+        '''
+        Register a query function under the given name (by default, its own name) and
+        return a wrapper that calls it through the cache. Can be used as a decorator.
+        Re-registering a name replaces the query; results cached on disk by a previous
+        definition are not reused, since the function's code is part of their key.
+        '''
+        name = f.__name__ if name is None else name
+        self._queries[name] = (f, hashlib.sha1(marshal.dumps(f.__code__)).hexdigest())
+
+        @functools.wraps(f)
+        def cached(*args, **kwargs):
+            return self.query(name, *args, **kwargs)
+        return cached
+
+    def _key(self, name, args, kwargs):
+        f, codeHash = self._queries[name]
+        return "{0}:{1}:{2!r}:{3!r}".format(name, codeHash, args, sorted(kwargs.items()))
+
+    ##############################################
+    ################## QUERYING ##################
+
+    def query(self, name, *args, **kwargs):
+        '''
+        Return the result of the named query for the given arguments, from the cache if
+        none of the data it depends on has changed since it was computed, whether it was
+        changed through the manager or on disk.
+        '''
+        try:
+            f = self._queries[name][0]
+        except KeyError:
+            raise KeyError("No query named {0} has been registered.".format(name))
+        key = self._key(name, args, kwargs)
+
+        entry = self._lookupMemory(key)
+        if entry is None:
+            entry = self._lookupDisk(key)
+            if entry is not None:
+                self._stats['diskHits'] += 1
+                self._store(key, entry, toDisk=False)
+        else:
+            self._stats['hits'] += 1
+        if entry is not None:
+            # The cached result counts as a read of its dependencies by any enclosing query
+            self.manager.noteDependencies(entry[0])
+            return entry[1]
+
+        self._stats['misses'] += 1
+        with self.manager.recordDependencies() as dependencies:
+            result = f(*args, **kwargs)
+        entry = ({dep: self.manager.version(*dep) for dep in dependencies}, result)
+        self._store(key, entry, toDisk=True)
+        return result
+
+    def _isFresh(self, entry):
+        '''
+        Return whether none of an entry's dependencies has changed on disk since it was
+        computed. Changed dependencies that are loaded are forgotten by the manager, so
+        that recomputing the entry reads them again.
+        '''
+        fresh = True
+        for dep, version in entry[0].items():
+            current = self.manager.diskVersion(*dep)
+            if current != version:
+                fresh = False
+                if self.manager.version(*dep) != current:
+                    self.manager.invalidate(*dep)
+        return fresh
+
+    def _lookupMemory(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is not None and not self._isFresh(entry):
+            with self._lock:
+                self._entries.pop(key, None)
+            self._stats['stale'] += 1
+            return None
+        return entry
+
+    def _store(self, key, entry, toDisk):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxEntries:
+                self._entries.popitem(last=False)
+        if toDisk and self.cacheDir is not None:
+            self._writeDisk(key, entry)
+
+    ##############################################
+    ################# DISK TIER ##################
+
+    def _diskFilename(self, key):
+        return os.path.join(self.cacheDir, hashlib.sha1(key.encode('utf-8')).hexdigest() + ".query")
+
+    def _lookupDisk(self, key):
+        if self.cacheDir is None:
+            return None
+        try:
+            with open(self._diskFilename(key), 'rb') as cacheFile:
+                storedKey, entry = pickle.load(cacheFile)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            return None
+        if storedKey != key or not self._isFresh(entry):
+            return None
+        return entry
+
+    def _writeDisk(self, key, entry):
+        '''Atomically write an entry to the disk tier. Failing to write is not an error.'''
+        try:
+            os.makedirs(self.cacheDir, exist_ok=True)
+            import tempfile
+            fd, tmp = tempfile.mkstemp(dir=self.cacheDir, suffix=".tmp")
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, 'wb') as cacheFile:
+                pickle.dump((key, entry), cacheFile, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._diskFilename(key))
+        except (OSError, pickle.PicklingError, TypeError, AttributeError):
+            os.remove(tmp)
+
+    ##############################################
+    ############### MAINTENANCE ##################
+
+    def clear(self, disk=False):
+        '''
+        Forget every cached result (and, if disk is true, delete the disk tier's files).
+        '''
+        with self._lock:
+            self._entries.clear()
+        if disk and self.cacheDir is not None and os.path.isdir(self.cacheDir):
+            for filename in os.listdir(self.cacheDir):
+                if filename.endswith(".query"):
+                    os.remove(os.path.join(self.cacheDir, filename))
+
+    def resetStats(self):
+        self._stats = collections.Counter()
+
+    def stats(self):
+        '''
+        Return the number of memory hits, disk hits, misses, and stale entries dropped.
+        '''
+        return {k: self._stats[k] for k in ('hits', 'diskHits', 'misses', 'stale')}
@@ -0,0 +1,171 @@
+'''
+Contains the SchemaValidator class, which validates data source instances
+against the JSON schemas referenced in locs.json. Each schema is compiled
+into a validator only once, and validation can be pushed onto a background
+thread so that it stays off the loading path.
+'''
+
+import collections
+import itertools
+import math
+import os
+import queue
+import random
+import threading
+
+import utils
+
+# Validation modes. 'full' validates every instance, 'sampled' validates a
+# random subset, and 'off' skips validation altogether.
+FULL = "full"
+SAMPLED = "sampled"
+OFF = "off"
+MODES = (FULL, SAMPLED, OFF)
+
+ValidationReport = collections.namedtuple('ValidationReport', ['dataSource', 'label', 'errors', 'truncated'])
+
+
+def printReport(report):
+    '''
+    The default reporter. Print each of the violations in the report.
+    '''
+    print("Schema violations in {0} ({1}):".format(report.label, report.dataSource))
+    for path, message in report.errors:
+        print("    {0}: {1}".format(path, message))
+    if report.truncated:
+        print("    ...")
+
+
+def errorPath(prefix, error):
+    '''
+    Return the path of a violation within its file, as a string: the path within the
+    instance, after the instance's prefix (if any).
+    '''
+    path = [str(p) for p in error.absolute_path]
+    return "/".join([prefix] + path if prefix else path) or "/"
+
+
+class SchemaValidator:
+    '''
+    Validates data against the schemas in a schema directory. Compiled validators
+    are cached by schema file. Only the first maxErrors violations are collected
+    for each validated file (for a single-file data source, across all of its records); reports with violations are passed to reporter
+    and kept in the reports list.
+    '''
+
+    def __init__(self, schemaDir, maxErrors=10, sampleRate=0.1, reporter=printReport):
+        self.schemaDir = schemaDir
+        self.maxErrors = maxErrors
+        self.sampleRate = sampleRate
+        self.reporter = reporter
+        self.reports = []
+        self._validators = {}
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+
+    ##############################################
+    ############# COMPILED VALIDATORS ############
+
+    def getValidator(self, schemaFile):
+        '''
+        Return the compiled validator for the given schema file (relative to the
+        schema directory), compiling and caching it on first use.
+        '''
+        with self._lock:
+            try:
+                return self._validators[schemaFile]
+            except KeyError:
+                # Deferred so that jsonschema is only imported if validation is actually used
+                import jsonschema
+                schema = utils.getJSON(os.path.join(self.schemaDir, schemaFile))
+                jsonschema.Draft4Validator.check_schema(schema)
+                validator = jsonschema.Draft4Validator(schema, format_checker=jsonschema.FormatChecker())
+                self._validators[schemaFile] = validator
+                return validator
+
+    ##############################################
+    ################# VALIDATION #################
+
+    def validateInstance(self, dataSource, schemaFile, instance, label):
+        '''
+        Validate a single instance and return a ValidationReport with (at most)
+        the first maxErrors violations.
+        '''
+        return self.validateFile(dataSource, schemaFile, [("", instance)], label)
+
+    def validateFile(self, dataSource, schemaFile, instances, label):
+        '''
+        Validate the instances stored in one file, given as (path prefix, instance) pairs
+        (e.g. the records of a single-file data source, prefixed by id), and return one
+        ValidationReport with (at most) the first maxErrors violations among all of them.
+        Validation stops once the cap has been passed.
+        '''
+        validator = self.getValidator(schemaFile)
+        errors = ((prefix, error) for prefix, instance in instances for error in validator.iter_errors(instance))
+        first = [(errorPath(prefix, error), error.message) for prefix, error in \
+            itertools.islice(errors, self.maxErrors + 1)]
+        report = ValidationReport(dataSource, label, first[:self.maxErrors], len(first) > self.maxErrors)
+        if report.errors:
+            with self._lock:
+                self.reports.append(report)
+            if self.reporter is not None:
+                self.reporter(report)
+        return report
+
+    def validateDataSource(self, dataSource, schemaFile, data, single, mode, label):
+        '''
+        Validate newly loaded data for a data source according to the given mode.
+        For a single-file data source, data is a dictionary of instances by id (from one
+        file), and the sampled mode checks a random subset of them. For a multiple-file
+        data source, data is one instance, and the sampled mode checks it with probability
+        sampleRate. Returns a list of reports, with at most one for the file.
+        '''
+        if mode == OFF:
+            return []
+        if mode not in MODES:
+            raise ValueError("{0} is not a valid validation mode for {1}.".format(mode, dataSource))
+
+        if single:
+            ids = list(data.keys())
+            if mode == SAMPLED:
+                ids = random.sample(ids, min(len(ids), math.ceil(len(ids) * self.sampleRate)))
+            return [self.validateFile(dataSource, schemaFile, ((_id, data[_id]) for _id in ids), label)]
+        elif mode == FULL or random.random() < self.sampleRate:
+            return [self.validateInstance(dataSource, schemaFile, data, label)]
+        else:
+            return []
+
+    ##############################################
+    ############# BACKGROUND VALIDATION ##########
+
+    def submit(self, dataSource, schemaFile, data, single, mode, label):
+        '''
+        Queue validateDataSource to run on the background validation thread,
+        starting the thread if necessary.
+        '''
+        if mode == OFF:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._work, name="SchemaValidator", daemon=True)
+                self._thread.start()
+        self._queue.put((dataSource, schemaFile, data, single, mode, label))
+
+    def _work(self):
+        while True:
+            args = self._queue.get()
+            try:
+                self.validateDataSource(*args)
+            except Exception as err:
+                print("Error while validating {0}: {1}".format(args[-1], err))
+            finally:
+                self._queue.task_done()
+
+    def join(self):
+        '''
+        Block until everything submitted so far has been validated.
+        '''
+        if self._queue is not None:
+            self._queue.join()
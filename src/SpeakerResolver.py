@@ -0,0 +1,138 @@
+'''
+Contains the SpeakerResolver class, which maps the speaker strings in raw
+transcripts to person ids. A normalized last-name index is built from the
+people metadata once per process, and each debate memoizes the speakers it
+has already resolved, since a debate only has a handful of distinct speaker
+strings. Hit rates and unresolved speaker strings are recorded so that
+missing people are easy to find.
+'''
+
+import collections
+import threading
+
+
+def newStats():
+    return {'hits': 0, 'misses': 0, 'unresolved': collections.defaultdict(set)}
+
+
+class DebateSpeakers:
+    '''
+    Resolves the speaker strings of a single debate, memoizing each result.
+    identify is a function of a speaker string that returns an id or None.
+    '''
+
+    def __init__(self, debateId, lastNames, identify, stats=None):
+        self.debateId = debateId
+        self.lastNames = lastNames
+        self.identify = identify
+        self._stats = newStats() if stats is None else stats
+        self._memo = {}
+
+    def resolve(self, speakerString):
+        '''
+        Return the id of the person identified by the speaker string, or None.
+        '''
+        try:
+            speaker = self._memo[speakerString]
+            self._stats['hits'] += 1
+            return speaker
+        except KeyError:
+            speaker = self._memo[speakerString] = self.identify(speakerString)
+            self._stats['misses'] += 1
+            if speaker is None:
+                self._stats['unresolved'][self.debateId].add(speakerString)
+            return speaker
+
+
+class SpeakerResolver:
+    '''
+    Holds the normalized last-name index for every person in the people metadata,
+    and the resolution statistics for every debate resolved in this process.
+    Use SpeakerResolver.forPeople() to share one resolver per process.
+    '''
+
+    _shared = None
+    _sharedLock = threading.Lock()
+
+    def __init__(self, peopleMetadata, version=None):
+        self.people = peopleMetadata
+        # The version of the people metadata the index was built from
+        self.version = version
+        self.lastNameIndex = {_id: person['lastName'].lower() for _id, person in peopleMetadata.items()}
+        self.resetStats()
+
+    @classmethod
+    def forPeople(cls, peopleMetadata, version=None):
+        '''
+        Return the process-wide resolver for the given people metadata, building
+        it if there is none yet or the people metadata has changed: its version
+        (e.g. DataSourceManager.version('peopleMetadata')) differs from the one the
+        index was built from or, if no version is given, it is a different dictionary.
+        The statistics are kept when the index is rebuilt.
+        '''
+        with cls._sharedLock:
+            shared = cls._shared
+            if shared is None or shared.version != version or \
+                    (version is None and shared.people is not peopleMetadata):
+                cls._shared = cls(peopleMetadata, version)
+                if shared is not None:
+                    cls._shared._stats = shared._stats
+            return cls._shared
+
+    @classmethod
+    def forManager(cls, manager):
+        '''
+        Return the process-wide resolver for a DataSourceManager's people metadata,
+        keyed on its version, so changes committed to it are picked up.
+        '''
+        # Take the version first, so a change made in between looks newer, not older
+        version = manager.version('peopleMetadata')
+        return cls.forPeople(manager.getDataSource('peopleMetadata'), version)
+
+    def lastNames(self, personIds):
+        '''
+        Return a dictionary of lowercased last names to ids for the given people.
+        If two people share a last name, the later one wins.
+        '''
+        return {self.lastNameIndex[_id]: _id for _id in personIds}
+
+    def forDebate(self, debateId, personIds, identify):
+        '''
+        Return a memoizing DebateSpeakers for a debate with the given people. identify
+        is called with a speaker string on each memoization miss.
+        '''
+        return self.speakers(debateId, self.lastNames(personIds), identify)
+
+    def speakers(self, debateId, lastNames, identify):
+        '''
+        Return a memoizing DebateSpeakers for a debate with a prebuilt last names map.
+        '''
+        return DebateSpeakers(debateId, lastNames, identify, self._stats)
+
+    ##############################################
+    ################# STATISTICS #################
+
+    def resetStats(self):
+        self._stats = newStats()
+
+    def stats(self):
+        '''
+        Return the number of memoized hits and misses, the hit rate, and the
+        unresolved speaker strings by debate id.
+        '''
+        hits, misses = self._stats['hits'], self._stats['misses']
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hitRate': hits / (hits + misses) if hits + misses else 0.0,
+            'unresolved': {_id: sorted(strings) for _id, strings in self._stats['unresolved'].items() if strings}
+        }
+
+    def printUnresolved(self):
+        '''
+        Print the hit rate and every unresolved speaker string, by debate.
+        '''
+        stats = self.stats()
+        print("Speaker resolution: {0} lookups, {1:.1%} memoized.".format(stats['hits'] + stats['misses'], stats['hitRate']))
+        for _id in sorted(stats['unresolved']):
+            print("    Unresolved in {0}: {1}".format(_id, ", ".join(repr(s) for s in stats['unresolved'][_id])))
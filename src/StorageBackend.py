@@ -0,0 +1,308 @@
+'''
+Contains the storage backends that DataSourceManager reads the instances
+of multiple-file data sources from. A data source's backend is chosen by
+the optional "storage" key of its entry in locs.json; by default, each
+instance is a (possibly compressed) file in the data source's directory.
+Instances can also be read from a packed shard (see PackedShard) or from
+the members of a zip archive.
+'''
+
+import io
+import json
+import os
+import threading
+
+import utils
+
+
+class DirectoryStorage:
+    '''
+    The default storage backend: each instance is a file in a directory, named by its id.
+    Files may be compressed (e.g. 123.json.gz); compressed and uncompressed files are
+    both found when listing ids, and new files are written with the given compression.
+    '''
+
+    readOnly = False
+
+    def __init__(self, directory, isJson, ext="json", compression=None):
+        self.directory = directory
+        self.isJson = isJson
+        self.ext = ext
+        self.compressedExt = ext + utils.compressionExtension(compression)
+        # The filenames found by the last call to ids(), by id
+        self._filenames = {}
+
+    def ids(self):
+        '''Return a list of the ids of the instances in the directory, compressed or not.'''
+        filenames = utils.getFilenames(self.directory, ext=self.ext) + \
+            [f for f in utils.getFilenames(self.directory, ext=self.ext + ".*") if utils.isCompressed(f)]
+        self._filenames = {utils.getBaseFilename(filename): filename for filename in filenames}
+        return list(self._filenames.keys())
+
+    def location(self, _id):
+        '''Return the filename of the given instance.'''
+        try:
+            return self._filenames[_id]
+        except KeyError:
+            return utils.makeFilename(self.directory, _id, self.compressedExt)
+
+    def version(self, _id=None):
+        '''
+        Return a stamp identifying the current version of the given instance's file or,
+        if _id is None, of the directory's list of files.
+        '''
+        return utils.getFileStamp(self.directory if _id is None else self.location(_id))
+
+    def size(self, _id):
+        '''Return the size of the given instance's file on disk, in bytes.'''
+        return os.path.getsize(self.location(_id))
+
+    def read(self, _id):
+        '''Return the decoded instance (JSON or text) with the given id.'''
+        return (utils.getJSON if self.isJson else utils.getText)(self.location(_id))
+
+    def open(self, _id, mode='r'):
+        '''Return a (decompressing) file object over the given instance.'''
+        return utils.openFile(self.location(_id), mode)
+
+    def write(self, _id, instance):
+        '''Write the given instance to its file, replacing any file it was previously read from.'''
+        os.makedirs(self.directory, exist_ok=True)
+        previous = self._filenames.pop(_id, None)
+        filename = utils.makeFilename(self.directory, _id, self.compressedExt)
+        if self.isJson:
+            utils.writeJSON(instance, filename)
+        else:
+            with utils.openFile(filename, 'w') as file:
+                file.write(instance)
+        if previous is not None and previous != filename:
+            os.remove(previous)
+        self._filenames[_id] = filename
+
+    def writeMany(self, items):
+        '''Write each instance of an iterable of (id, instance) pairs. Returns the number written.'''
+        count = 0
+        for _id, instance in items:
+            self.write(_id, instance)
+            count += 1
+        return count
+
+
+class ZipStorage:
+    '''
+    A storage backend for a multiple-file data source kept in a single zip archive, with
+    one member per instance, named by its id (with a .json or .html extension). Ids come
+    from the archive's central directory, and instances are random-access reads of their
+    members. Writing copies the archive into a temporary file, appends the new members,
+    and moves it into place, so write instances in batches with writeMany. The archive is reopened whenever it
+    changes on disk. Like shards, zip storages can be pickled.
+    '''
+
+    readOnly = False
+
+    def __init__(self, filename, isJson, encoding='latin1', compression=None):
+        self.filename = filename
+        self.isJson = isJson
+        self.encoding = encoding
+        # A zipfile compression method, or None for ZIP_DEFLATED
+        self.compression = compression
+        self.ext = "json" if isJson else "html"
+        # The (file stamp, open archive, members by id) the archive was last read as
+        self._state = None
+        # The archive replaced by the last reopen, closed on the next one
+        self._retired = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_state'] = None
+        state['_retired'] = None
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _open(self):
+        '''
+        Return the archive and its members by id, reopening it if it has changed on disk
+        (or (None, {}) if it doesn't exist yet).
+        '''
+        stamp = utils.getFileStamp(self.filename)
+        state = self._state
+        if state is not None and state[0] == stamp:
+            return state[1], state[2]
+        with self._lock:
+            if self._state is None or self._state[0] != stamp:
+                archive, members = None, {}
+                if stamp is not None:
+                    # zipfile is only imported once an archive is actually read
+                    import zipfile
+                    archive = zipfile.ZipFile(self.filename)
+                    # A replaced member is appended again, so the last one of each name is current
+                    members = {info.filename.rsplit('.', 1)[0]: info for info in archive.infolist() if not info.is_dir()}
+                # Readers of the previous archive may still be using it, so it is closed on the next reopen
+                if self._retired is not None:
+                    self._retired.close()
+                self._retired = None if self._state is None else self._state[1]
+                self._state = (stamp, archive, members)
+            return self._state[1], self._state[2]
+
+    def close(self):
+        with self._lock:
+            for archive in (self._retired, None if self._state is None else self._state[1]):
+                if archive is not None:
+                    archive.close()
+            self._state = None
+            self._retired = None
+
+    def _member(self, _id):
+        archive, members = self._open()
+        try:
+            return archive, members[_id]
+        except KeyError:
+            raise KeyError("{0} is not in {1}.".format(_id, self.filename))
+
+    def ids(self):
+        '''Return a list of the ids of the instances in the archive.'''
+        return list(self._open()[1].keys())
+
+    def memberName(self, _id):
+        return "{0}.{1}".format(_id, self.ext)
+
+    def location(self, _id):
+        '''Return a string describing where the instance is stored.'''
+        return "{0}#{1}".format(self.filename, self.memberName(_id))
+
+    def version(self, _id=None):
+        '''
+        Return a stamp identifying the current version of the given instance's member (its
+        checksum and sizes) or, if _id is None, of the archive.
+        '''
+        if _id is None:
+            return utils.getFileStamp(self.filename)
+        info = self._open()[1].get(_id)
+        return None if info is None else (info.CRC, info.file_size, info.compress_size)
+
+    def size(self, _id):
+        '''Return the size of the given instance as stored in the archive, in bytes.'''
+        return self._member(_id)[1].compress_size
+
+    def readBytes(self, _id):
+        '''Return the original bytes of the given instance.'''
+        archive, info = self._member(_id)
+        return archive.read(info)
+
+    def read(self, _id):
+        '''Return the decoded instance (JSON or text) with the given id.'''
+        text = self.readBytes(_id).decode(self.encoding)
+        return json.loads(text) if self.isJson else text
+
+    def open(self, _id, mode='r'):
+        '''Return a (decompressing) file object over the given instance.'''
+        archive, info = self._member(_id)
+        member = archive.open(info)
+        return member if 'b' in mode else io.TextIOWrapper(member, encoding=self.encoding)
+
+    def encode(self, instance):
+        '''Return the bytes stored for an instance, formatted as DirectoryStorage writes it.'''
+        return (json.dumps(instance, indent=4) if self.isJson else instance).encode(self.encoding)
+
+    def write(self, _id, instance):
+        '''Add or replace a single instance. This copies the whole archive.'''
+        self.writeMany([(_id, instance)])
+
+    def writeMany(self, items):
+        '''
+        Add or replace each instance of an iterable of (id, instance) pairs, rewriting the
+        archive once. Returns the number written.
+        '''
+        return self.writeRecords((_id, self.encode(instance)) for _id, instance in items)
+
+    def writeRecords(self, records):
+        '''
+        Add or replace instances given an iterable of (id, bytes) records, which is consumed
+        as they are written. The archive is copied as is and the records are appended to the
+        copy, so the members that are not replaced are never recompressed; replaced members
+        are left behind in the archive until they take up more space than the current ones,
+        when the archive is compacted. If anything fails, the archive is left as it was.
+        '''
+        import shutil
+        import tempfile
+        import warnings
+        import zipfile
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        os.makedirs(directory, exist_ok=True)
+        archive, members = self._open()
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            written = set()
+            with os.fdopen(fd, 'wb') as raw:
+                if archive is not None:
+                    with open(self.filename, 'rb') as current:
+                        shutil.copyfileobj(current, raw, 1 << 20)
+            with zipfile.ZipFile(tmp, 'a' if archive is not None else 'w', self._compression()) as output, \
+                    warnings.catch_warnings():
+                warnings.filterwarnings('ignore', "Duplicate name", UserWarning)
+                for _id, content in records:
+                    if _id not in written:
+                        output.writestr(self.memberName(_id), content)
+                    written.add(_id)
+                infos = output.infolist()
+            if sum(info.compress_size for info in infos) > 2 * sum(info.compress_size for info in
+                    {info.filename: info for info in infos}.values()):
+                self._compact(tmp)
+            os.chmod(tmp, os.stat(self.filename).st_mode if os.path.exists(self.filename) else 0o644)
+            os.replace(tmp, self.filename)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        return len(written)
+
+    def _compression(self):
+        import zipfile
+        return zipfile.ZIP_DEFLATED if self.compression is None else self.compression
+
+    def _compact(self, filename):
+        '''Rewrite an archive in place, dropping the members that have been replaced.'''
+        import tempfile
+        import zipfile
+        directory = os.path.dirname(os.path.abspath(filename))
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with zipfile.ZipFile(filename) as archive, os.fdopen(fd, 'wb') as raw, \
+                    zipfile.ZipFile(raw, 'w', self._compression()) as output:
+                for info in {info.filename: info for info in archive.infolist()}.values():
+                    output.writestr(info, archive.read(info))
+            os.replace(tmp, filename)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+
+def _shardStorage(dataDir, location, storage):
+    # Deferred so that PackedShard (and mmap) are only imported if a shard is configured
+    import PackedShard
+    return PackedShard.ShardStorage(os.path.join(dataDir, storage['file']), location['isJson'])
+
+# Constructors for each backend, given the data directory, the data source's entry in
+# the locs file, and the data source's "storage" settings.
+backends = {
+    'directory': (lambda dataDir, location, storage: \
+        DirectoryStorage(os.path.join(dataDir, location['dir']), location['isJson'], compression=location.get('compression'))),
+    'shard': _shardStorage,
+    'zip': (lambda dataDir, location, storage: \
+        ZipStorage(os.path.join(dataDir, storage['file']), location['isJson']))
+}
+
+def makeStorage(dataDir, location):
+    '''
+    Return the storage backend for a multiple-file data source, given the data directory
+    and the data source's entry in the locs file.
+    '''
+    storage = location.get('storage', {'backend': 'directory'})
+    try:
+        return backends[storage['backend']](dataDir, location, storage)
+    except KeyError:
+        raise KeyError("Unknown storage backend for {0}: {1}".format(location['dir'], storage))
@@ -1,9 +1,13 @@
 from PartialDataAccessor import PartialDataAccessor
 from DataSourceManager import DataSourceManager
+from QueryCache import QueryCache
+from TurnIndex import TurnIndex
 import utils
 import collections
+import collections.abc
+import functools
 import os
-import jsonschema
+import threading
 
 
 
@@ -16,6 +20,15 @@ class ThesisDataAccessor(PartialDataAccessor):
     def __init__(self, top, dataSourceLocationsFile):
         
         self.dataManager = DataSourceManager(top, dataSourceLocationsFile)
+        # Memoizes registered derived queries; set queryCache.cacheDir to also cache on disk
+        self.queryCache = QueryCache(self.dataManager)
+        # The TurnIndex of recently used debates, with the transcript version each was
+        # built from, least recently used first
+        self._turnIndexes = collections.OrderedDict()
+        self._turnIndexLock = threading.Lock()
+        self.maxTurnIndexes = 256
+        # The number of attribute, item, and iteration transitions taken from each PDO state
+        self._transitions = collections.Counter()
 
         # Set the transition behavior that governs attribute and item
         # access for a given PartialDataObject
@@ -130,7 +143,7 @@ class ThesisDataAccessor(PartialDataAccessor):
         are possible. If so, return the value in the PDO's data attribute.\
         Acts a wrapper around _updateState, since some states of the PDO access FSA have empty transitions.
         '''
-        if isinstance(pdo.getKwarg('data'), str) or not isinstance(pdo.getKwarg('data'), collections.Container):
+        if isinstance(pdo.getKwarg('data'), str) or not isinstance(pdo.getKwarg('data'), collections.abc.Container):
             # If we've reached the end, return a value
             return pdo.getKwarg('data')
         else:
@@ -155,8 +168,10 @@ class ThesisDataAccessor(PartialDataAccessor):
         '''
         Call the appropriate attribute transition function or, if none exists, raise an AttributeError.
         '''
+        state = pdo.getKwarg('state')
+        self._transitions[('attr', state)] += 1
         try:
-            return self._attrTransitionFunctions[pdo.getKwarg('state')](pdo, name)
+            return self._attrTransitionFunctions[state](pdo, name)
         except TypeError: # Raised by attempting to call None as a function
             raise AttributeError("{0} is not a valid attribute for {1}".format(name, pdo))
 
@@ -164,8 +179,10 @@ class ThesisDataAccessor(PartialDataAccessor):
         '''
         Call the appropriate item transition function or, if none exists, raise a KeyError.
         '''
+        state = pdo.getKwarg('state')
+        self._transitions[('item', state)] += 1
         try:
-            return self._itemTransitionFunctions[pdo.getKwarg('state')](pdo, key)
+            return self._itemTransitionFunctions[state](pdo, key)
         except TypeError: # Raised by attempting to call None as a function
             raise KeyError("{0} is not a valid id for {1}".format(key, pdo))
 
@@ -175,15 +192,23 @@ class ThesisDataAccessor(PartialDataAccessor):
         a generator over the ids for the PDO's current type.
         Or, if the current data type is a list, iterate over the items in the list
         '''
-        try:
+        state = pdo.getKwarg('state')
+        transition = self._iterTransitionFunctions[state]
+        if transition is not None:
             for _id in pdo.getKwarg('type').getIds():
-                yield self._iterTransitionFunctions[pdo.getKwarg('state')](pdo, _id)
-        except TypeError: # Raised by attempting to call None as a function
-            if isinstance(pdo.getKwarg('data'), collections.Sequence): # If data is pointing to a list, then iterate over it
+                self._transitions[('iter', state)] += 1
+                yield transition(pdo, _id)
+        else:
+            # Check the transition first, so iterating over a list doesn't load the type's ids
+            if isinstance(pdo.getKwarg('data'), collections.abc.Sequence): # If data is pointing to a list, then iterate over it
                 # This is hacky, but it will do. Really, the whole _iterPdo function should be redesigned to
-                # handle this better.
-                for i in range(len(pdo.getKwarg('data'))):
-                    yield self._attrTransitionFunctions[4](pdo, i)
+                # handle this better. Leaf values are yielded directly rather than through a new PDO.
+                for i, item in enumerate(pdo.getKwarg('data')):
+                    if isinstance(item, str) or not isinstance(item, collections.abc.Container):
+                        yield item
+                    else:
+                        self._transitions[('iter', state)] += 1
+                        yield self._attrTransitionFunctions[4](pdo, i)
             else:
                 raise KeyError("Cannot iterate over {0}".format(pdo))
 
@@ -199,10 +224,218 @@ class ThesisDataAccessor(PartialDataAccessor):
         '''
         return pdo.filled(**{'type':self.dataManager.root(), 'id': None, 'data': None, 'state': 0})
 
+    def stream(self, dataSourceName, _id, key):
+        '''
+        Return a generator over the list stored under key in the given instance of a
+        multiple-file JSON data source. Items are plain values (e.g. dictionaries, not
+        PDOs), decoded as the instance's file is read, so breaking out of the loop early
+        means the rest of the file is never read.
+        This is the only streaming path: accessing the list through PDOs (for example,
+        data.debates[_id].transcripts.events) still loads and decodes the whole instance.
+        '''
+        return self.dataManager.iterDataSourceItems(dataSourceName, _id, key)
+
+    def iterEvents(self, debateId):
+        '''
+        Stream the events of a debate's parsed transcript as dictionaries.
+        Ex: for event in data.iterEvents('75950'): ...
+        '''
+        return self.stream('transcripts', debateId, 'events')
+
+    def prefetch(self, dataSourceName, ids=None, readAhead=8, maxBytes=64 << 20, release=False):
+        '''
+        Iterate over the entities of a multiple-file data source's data type (by default,
+        every entity with an instance in the data source) while their instances are read
+        ahead on background threads. See DataSourceManager.prefetch.
+        Ex: for debate in data.prefetch('transcripts', release=True):
+                debate.transcripts.events ...
+        '''
+        entities = getattr(self, self.dataManager.locations[dataSourceName]['dataType'])
+        ids = self.entityIds(dataSourceName) if ids is None else ids
+        for _id, _ in self.dataManager.prefetch(dataSourceName, ids, readAhead, maxBytes, release):
+            yield entities[_id]
+
+    def entityIds(self, dataSourceName):
+        '''
+        Return the ids of the entities of a data source's data type (e.g. debates) that
+        have an instance in the data source, in the data type's order.
+        '''
+        dataType = self.dataManager.locations[dataSourceName]['dataType']
+        available = self.dataManager.getDataSourceIds(dataSourceName)
+        return [_id for _id in self.dataManager.root().child(dataType).getIds() if _id in available]
+
+    def turnIndex(self, debateId):
+        '''
+        Return the TurnIndex of a debate's parsed transcript, built once per version of the
+        transcript. The maxTurnIndexes most recently used indexes are kept, without their
+        transcripts, so a cached index is returned without loading the transcript.
+        Ex: turns = data.turnIndex('75950')
+            start, end, speaker = turns.turn(turns.turnOf(eventIndex))
+        '''
+        version = self.dataManager.version('transcripts', debateId)
+        with self._turnIndexLock:
+            cached = self._turnIndexes.get(debateId)
+            if cached is not None and cached[0] == version:
+                self._turnIndexes.move_to_end(debateId)
+                return cached[1]
+        transcript = self.dataManager.getDataSourceInstance('transcripts', debateId)
+        version = self.dataManager.version('transcripts', debateId)
+        turns = TurnIndex.fromTranscript(transcript)
+        with self._turnIndexLock:
+            self._turnIndexes[debateId] = (version, turns)
+            self._turnIndexes.move_to_end(debateId)
+            while len(self._turnIndexes) > self.maxTurnIndexes:
+                self._turnIndexes.popitem(last=False)
+        return turns
+
+    def iterTurns(self, debateId):
+        '''
+        Iterate over the turns of a debate as (speaker, events) pairs, where events is the
+        list of the turn's events as dictionaries.
+        '''
+        events = self.dataManager.getDataSourceInstance('transcripts', debateId)['events']
+        for start, end, speaker in self.turnIndex(debateId):
+            yield speaker, events[start:end]
+
+    def registerQuery(self, f, name=None):
+        '''
+        Register a derived query whose results are cached until the data it read changes,
+        and return a function that calls it through the cache. Can be used as a decorator.
+        Ex: @data.registerQuery
+            def applauseCount(debateId):
+                return sum(1 for e in data.debates[debateId].transcripts.events if e.eventType == 'applause')
+        '''
+        return self.queryCache.register(f, name)
+
+    def query(self, name, *args, **kwargs):
+        '''
+        Return the (possibly cached) result of a registered query.
+        Ex: data.query('applauseCount', '75950')
+        '''
+        return self.queryCache.query(name, *args, **kwargs)
+
+    def stats(self, sizes=True):
+        '''
+        Return a dictionary describing what the accessor holds and has done: the data
+        manager's stats (see DataSourceManager.stats) plus
+            pdos, with the number of PartialDataObjects allocated and the number of
+                attribute, item, and iteration transitions taken from each FSA state
+                (see _loadStateTransitions),
+            turnIndexes, the number of TurnIndexes kept, and
+            queries, the query cache's hit and miss counts.
+        Counts are approximate if several threads use the accessor at once.
+        Ex: data.stats()['dataSources']['transcripts']['estimatedBytes']
+        '''
+        stats = self.dataManager.stats(sizes)
+        transitions = {kind: {} for kind in ('attr', 'item', 'iter')}
+        for (kind, state), count in list(self._transitions.items()):
+            transitions[kind][state] = count
+        stats['pdos'] = {'allocations': self._pdoAllocations, 'transitions': transitions}
+        stats['turnIndexes'] = len(self._turnIndexes)
+        stats['queries'] = self.queryCache.stats()
+        return stats
+
+    def resetStats(self):
+        '''Reset the counts reported by stats.'''
+        self.dataManager.resetStats()
+        self._pdoAllocations = 0
+        self._transitions.clear()
+        self.queryCache.resetStats()
+
+    def traceMemory(self, enable=True):
+        '''
+        Attribute memory to the data source instances loaded from now on (see
+        DataSourceManager.traceMemory and tracedInstances).
+        '''
+        self.dataManager.traceMemory(enable)
+
     def reset(self):
         print("Resetting...",end="")
         self.dataManager.reset()
         print("Done.")
 
+class LazyAccessor:
+    '''
+    Stands in for the global ThesisDataAccessor, which is only constructed
+    the first time it is actually used. The data root defaults to the
+    THREE_CHEERS_ROOT environment variable or, if that is not set, to the
+    repository containing this file, so it does not depend on the current
+    working directory. Call setDataRoot() before first use to change it.
+    '''
+
+    rootVariable = "THREE_CHEERS_ROOT"
+    defaultLocationsFile = "schema/locs.json"
+
+    def __init__(self):
+        self._accessor = None
+        self._lock = threading.Lock()
+        self._top = os.environ.get(LazyAccessor.rootVariable,
+            os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)))
+        self._locationsFile = LazyAccessor.defaultLocationsFile
+        # The queries registered through this accessor, registered again whenever it is rebuilt
+        self._registrations = {}
+
+    def setDataRoot(self, top, dataSourceLocationsFile=None):
+        '''
+        Set the top-level directory (and, optionally, the locations file relative
+        to it) that the accessor reads from. If the accessor has already been
+        constructed, it will be rebuilt against the new root on next use, with the
+        same registered queries (but none of their cached results).
+        '''
+        with self._lock:
+            self._top = top
+            if dataSourceLocationsFile is not None:
+                self._locationsFile = dataSourceLocationsFile
+            self._accessor = None
+
+    def dataRoot(self):
+        '''Return the top-level directory the accessor reads from.'''
+        return self._top
+
+    def get(self):
+        '''
+        Return the underlying ThesisDataAccessor, constructing it if necessary.
+        '''
+        accessor = self._accessor
+        if accessor is None:
+            with self._lock:
+                if self._accessor is None:
+                    accessor = ThesisDataAccessor(self._top, self._locationsFile)
+                    for name, f in self._registrations.items():
+                        accessor.registerQuery(f, name)
+                    self._accessor = accessor
+                accessor = self._accessor
+        return accessor
+
+    def registerQuery(self, f, name=None):
+        '''
+        Register a derived query (see ThesisDataAccessor.registerQuery) with the accessor,
+        and with every accessor it is rebuilt as by setDataRoot. The returned function
+        always queries the current accessor.
+        '''
+        name = f.__name__ if name is None else name
+        with self._lock:
+            self._registrations[name] = f
+            accessor = self._accessor
+        if accessor is not None:
+            accessor.registerQuery(f, name)
+
+        @functools.wraps(f)
+        def cached(*args, **kwargs):
+            return self.get().query(name, *args, **kwargs)
+        return cached
+
+    def __getattr__(self, name):
+        # Don't build the accessor for special method lookups (e.g. from pickle or copy)
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+    def __getitem__(self, key):
+        return self.get()[key]
+
+    def __str__(self):
+        return str(self.get())
+
 # Usage: from ThesisDataAccessor import Accessor as data
-Accessor = ThesisDataAccessor("../", "schema/locs.json")
\ No newline at end of file
+Accessor = LazyAccessor()
\ No newline at end of file
@@ -1,28 +1,63 @@
 '''
 Contains one method, fetch_transcripts(), to
 retrieve raw debate transcripts from their APP urls,
-then output them to the raw transcripts folder.
+then output them to the raw transcripts data source
+(a folder of files, or a zip archive; see StorageBackend).
 '''
 
+import argparse
+
 import requests
 from bs4 import BeautifulSoup
 
+from StorageBackend import ZipStorage
 from ThesisDataAccessor import Accessor as data
 
-def fetch_transcripts():
+def fetch(debate):
+    '''
+    Retrieve a single debate's raw transcript from its APP url and return it as text.
+    '''
+    print("Fetching debate {}.".format(debate.get('id')))
+    url = debate.transcriptUrl # Get the transcript's url
+    req = requests.get(url) # Fetch the HTML
+    soup = BeautifulSoup(req.text) # Parse it using BeautifulSoup
+    transcript = soup.find("span", class_="displaytext") # Get the transcript element
+    # Characters outside latin1 become character references, as they always have
+    return transcript.prettify('latin1').decode('latin1')
+
+def fetch_transcripts(archive=None):
     '''
     Retrieve the raw debate transcripts from their APP urls,
-    then output them to the raw transcripts folder.
+    then output them through the raw transcripts' storage backend,
+    or to the given zip archive. An archive is written once, after
+    every transcript has been fetched. A debate that fails to be
+    fetched is reported and skipped, and the list of the ids of those
+    debates is returned.
     '''
-    for debate in data.debates.debateMetadata:
-        print("Fetching debate {}.".format(debate.get('id')))
-        url = debate.transcriptUrl # Get the transcript's url
-        req = requests.get(url) # Fetch the HTML
-        soup = BeautifulSoup(req.text) # Parse it using BeautifulSoup
-        transcript = soup.find("span", class_="displaytext") # Get the transcript element
-        transcript_file_path = '../data/debates/rawTranscripts/{}.json'.format(debate.get('id'))
-        with open(transcript_file_path, 'wb') as transcript_file:
-            transcript_file.write(transcript.prettify('latin1')) # Write the transcript to a file
+    if archive is None:
+        storage = data.dataManager.getWritableStorage('transcriptsRaw')
+    else:
+        storage = ZipStorage(archive, isJson=False)
+    failed = []
+    def fetched():
+        for debate in data.debates.debateMetadata:
+            try:
+                yield debate.get('id'), fetch(debate)
+            except Exception as e:
+                print("Failed to fetch debate {0}: {1!r}".format(debate.get('id'), e))
+                failed.append(debate.get('id'))
+    storage.writeMany(fetched())
+    data.dataManager.invalidate('transcriptsRaw')
+    if failed:
+        print("Failed to fetch {0} debates: {1}".format(len(failed), ", ".join(failed)))
+    return failed
+
+def getArgs():
+    parser = argparse.ArgumentParser(description='''Fetch the raw debate transcripts into the transcriptsRaw data source.''')
+    parser.add_argument('--archive', default=None, help='''Write the transcripts to this zip archive instead. To read from it, set
+                                                        the "storage" of transcriptsRaw in locs.json to {"backend": "zip", "file": ...}.''')
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    fetch_transcripts()
+    args = getArgs()
+    fetch_transcripts(args.archive)
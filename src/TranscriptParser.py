@@ -1,25 +1,46 @@
 '''
-This module contains the TranscriptParser class, a
+This module contains the RawTranscriptParser class, a
 class for parsing raw transcripts into generators of
-utterance and non-utterance events.
+utterance and non-utterance events, and TranscriptParser,
+which parses debates from the data accessor.
 '''
 
+import argparse
 import re
 from itertools import chain
 
-from bs4 import BeautifulSoup, NavigableString
-from nltk.tokenize import sent_tokenize, word_tokenize
-
 import utils
+import SchemaValidator
+from HeaderExtractor import HeaderExtractor
+from SpeakerResolver import SpeakerResolver, DebateSpeakers
 from ThesisDataAccessor import Accessor as data
+from transcriptStats import computeStats
 
+# BeautifulSoup and NLTK are slow to import, so they are only imported by
+# loadParsingLibraries() once parsing actually begins. Scripts that import
+# this module for its constants or only need metadata never pay for them.
+BeautifulSoup = NavigableString = sent_tokenize = word_tokenize = None
 
-class TranscriptParser:
+def loadParsingLibraries():
+    '''
+    Import the BeautifulSoup and NLTK names used by the parser, if they
+    have not been imported already.
+    '''
+    global BeautifulSoup, NavigableString, sent_tokenize, word_tokenize
+    if BeautifulSoup is None:
+        from bs4 import BeautifulSoup, NavigableString
+        from nltk.tokenize import sent_tokenize, word_tokenize
+
+
+class RawTranscriptParser:
     '''
     A class for parsing raw transcripts into generators of utterance and non-utterance events.
     This class uses a debate's parsing metadata, which identifies patterns in transcript formats
     (viz. length of the transcript header, format of non-utterance events, and format of speaker
     names). Some debate-specific idiosynchracies are also hardcoded.
+    It depends only on plain data (the raw transcript, the parsing metadata, and a map of last
+    names to ids), so it is cheap to construct, picklable, and independent of the data accessor.
+    See TranscriptParser for the accessor-based entry point.
     '''
 
     ###############################################################
@@ -149,7 +170,7 @@ class TranscriptParser:
         (lambda parserObject, speakerString: \
             parserObject.lastNames.get(speakerString.strip(":").split()[-1].lower(), None) \
             if speakerString.strip() != "MODERATOR:" else \
-            list(iter(parserObject.debate.debateMetadata.moderators))[0]
+            parserObject.moderators[0]
         ),
 
         # When speakers are identified by first utterance, the last name is right
@@ -198,7 +219,7 @@ class TranscriptParser:
             # into two separate applause and laughter events.
             eventStringLower = eventString.lower()
             eventStrings = [s.strip() for s in \
-                re.split(TranscriptParser.eventSplitter, eventStringLower)]
+                re.split(RawTranscriptParser.eventSplitter, eventStringLower)]
 
             for e in eventStrings:
                 yield {
@@ -215,8 +236,8 @@ class TranscriptParser:
         things like '(inaudible)'.
         '''
         eventString = cls.eventGetter(eventMatch)
-        return any(ex in eventString for ex in TranscriptParser.keepInTranscriptContains) or \
-            any(ex == eventString.strip() for ex in TranscriptParser.keepInTranscriptExact)
+        return any(ex in eventString for ex in RawTranscriptParser.keepInTranscriptContains) or \
+            any(ex == eventString.strip() for ex in RawTranscriptParser.keepInTranscriptExact)
 
     @classmethod
     def filteredEventMatches(cls, extentString):
@@ -240,33 +261,60 @@ class TranscriptParser:
             any(ex == eventString.strip() for ex in cls.excludeExact) or \
             re.search(r"\?\s*[\)\]]", eventMatch.group())
 
-    def __init__(self, debateToParse):
-        self.debate = debateToParse
-        self.soup = BeautifulSoup(
-            re.sub(r"\s+", " ", debateToParse.transcriptsRaw), "html.parser"
-        )
-        self.lastNames = {data.people.peopleMetadata[_id].lastName.lower(): _id for _id in chain(
-            debateToParse.debateMetadata.participants, debateToParse.debateMetadata.moderators)}
-        self.isSpeakerTag = TranscriptParser.speakerDetectors[
-            debateToParse.parsingMetadata.speakerDetector]
-        self.speakerIdentifier = TranscriptParser.speakerIdentifiers[
-            debateToParse.parsingMetadata.speakerIdentifier]
+    def __init__(self, raw, parsingMetadata, lastNames, debateId=None, moderators=(), normalized=False, utteranceOffset=None):
+        '''
+        raw is the raw transcript HTML (already whitespace-normalized if normalized is true),
+        parsingMetadata is the debate's parsing metadata dictionary, and lastNames maps
+        lowercased last names to person ids. debateId selects any special fixes, and
+        moderators is the list of moderator ids, used by some speaker identifiers.
+        utteranceOffset, if known, is the offset in the normalized transcript where the
+        header ends (see skipHeader); parsing then starts there instead of walking the header.
+        Nothing expensive happens until parse() is called.
+        '''
+        self.raw = raw
+        self.parsingMetadata = parsingMetadata
+        self.lastNames = lastNames
+        self.debateId = debateId
+        self.moderators = list(moderators)
+        self.normalized = normalized
+        self.utteranceOffset = utteranceOffset
+
+    def makeSpeakers(self):
+        '''
+        Return the memoizing DebateSpeakers used to resolve speaker strings during parsing.
+        '''
+        return DebateSpeakers(self.debateId, self.lastNames, self.identifySpeaker)
 
-    def applySpecialFixes(self):
+    def identifySpeaker(self, speakerString):
         '''
-        If this raw transcript has any special fixes defined, apply them.
+        Identify a speaker string with the debate's speaker identifier.
         '''
-        if self.debate.get('id') in TranscriptParser.specialFixes:
-            TranscriptParser.specialFixes[self.debate.get('id')](self.soup)
+        return RawTranscriptParser.speakerIdentifiers[self.parsingMetadata['speakerIdentifier']](self, speakerString)
+
+    def isSpeakerTag(self, tag):
+        '''
+        Return true if the given element is a speaker tag, according to the debate's
+        speaker detector.
+        '''
+        return RawTranscriptParser.speakerDetectors[self.parsingMetadata['speakerDetector']](tag)
+
+    def applySpecialFixes(self, soup):
+        '''
+        If this raw transcript has any special fixes defined, apply them to its soup.
+        '''
+        if self.debateId in RawTranscriptParser.specialFixes:
+            RawTranscriptParser.specialFixes[self.debateId](soup)
 
     def skipHeader(self, descendants):
         '''
         Skip the raw transcript header by iterating past the appropriate
-        numer of outer <p> tags.
+        numer of outer <p> tags. The offset in the normalized transcript of
+        the <p> tag where the header ends is recorded in self.utteranceOffset
+        (None if the parser can't tell), so later parses can start there.
         '''
         pCount = 0
 
-        skip = self.debate.parsingMetadata.utteranceIterator
+        skip = self.parsingMetadata['utteranceIterator']
 
         # Skip the header that most debates have.
         while True:
@@ -276,30 +324,65 @@ class TranscriptParser:
                     break
                 pCount += 1
 
+        # Normalized transcripts are a single line, so the tag's column is its offset
+        self.utteranceOffset = e.sourcepos if e.sourceline == 1 else None
+
+    def startsAtOffset(self):
+        '''
+        Return true if parsing can start directly at the known utterance offset. Special
+        fixes may need the whole transcript, so debates with fixes are always walked.
+        '''
+        return self.utteranceOffset is not None and self.debateId not in RawTranscriptParser.specialFixes
+
     def eventsFromExtent(self, speakerString, extentString):
         '''
         Given a speaker string and an extent string, attempt to identify the speaker
         and parse the extent into utterance and non-utterance events.
         '''
+        return self.eventsFromSpeakerExtent(self.speakers.resolve(speakerString.strip()), extentString)
 
-        # Identify the speaker
-        speaker = self.speakerIdentifier(self, speakerString.strip())
-
+    def eventsFromSpeakerExtent(self, speaker, extentString):
+        '''
+        Parse an extent spoken by an already identified speaker (an id or None) into
+        utterance and non-utterance events.
+        '''
         # Find all of the matches for potential non-utterance events.
         # Iterate through the matches, yielding utterances in the space between
         # each match and non-utterances within each match.
         lastEnd = 0
-        for match in TranscriptParser.filteredEventMatches(extentString):
-            yield from TranscriptParser.makeUtterances(speaker, extentString[lastEnd:match.start()])
-            yield from TranscriptParser.makeNonUtterances(match)
+        for match in RawTranscriptParser.filteredEventMatches(extentString):
+            yield from RawTranscriptParser.makeUtterances(speaker, extentString[lastEnd:match.start()])
+            yield from RawTranscriptParser.makeNonUtterances(match)
             lastEnd = match.end()
         rest = extentString[lastEnd:]
         if rest:
-            yield from TranscriptParser.makeUtterances(speaker, rest)
+            yield from RawTranscriptParser.makeUtterances(speaker, rest)
+
+    def turn(self, speakerString, extentString, continued=False):
+        '''
+        Yield the events of one speaker extent, recording it in self.turns as a
+        [start, end, speaker] list of event indices (end exclusive). An extent continues
+        the previous turn if continued is true (its speaker tag was empty) or if it has the
+        same identified speaker, so a turn is a single uninterrupted stretch of speech.
+        '''
+        speaker = self.speakers.resolve(speakerString.strip())
+        start = self.eventCount
+        for event in self.eventsFromSpeakerExtent(speaker, extentString):
+            self.eventCount += 1
+            yield event
+        if self.eventCount == start:
+            return
+        last = self.turns[-1] if self.turns else None
+        if last is not None and last[1] == start and (continued or (speaker is not None and last[2] == speaker)):
+            last[1] = self.eventCount
+        else:
+            self.turns.append([start, self.eventCount, speaker])
 
     def parse(self):
         '''
         Parse the given raw transcript into a list of utterance and non-utterance events.
+        As events are generated, the speaker turns they make up are recorded in self.turns.
+        The soup is only held while parsing, so the parser can still be pickled afterwards.
         '''
 
         # The parser keeps track of speaker strings and extents.
@@ -307,15 +390,34 @@ class TranscriptParser:
         # the last speaker tag.
         curSpeaker = ""
         curExtent = ""
+        continued = False
+        self.turns = []
+        self.eventCount = 0
+
+        # Build the soup and speaker resolution only now, so that constructing
+        # (and pickling) a parser stays cheap.
+        loadParsingLibraries()
+        text = self.raw if self.normalized else HeaderExtractor.normalize(self.raw)
+        startsAtOffset = self.startsAtOffset()
+        if startsAtOffset:
+            # Don't build (or walk) the header at all. The text now starts with the <p> tag
+            # that skipHeader would have stopped at.
+            text = text[self.utteranceOffset:]
+        soup = BeautifulSoup(text, "html.parser")
+        self.speakers = self.makeSpeakers()
 
         # Some raw transcripts have odd issues. They get their own special fixes.
-        self.applySpecialFixes()
+        self.applySpecialFixes(soup)
 
-        descendants = self.soup.descendants
+        descendants = soup.descendants
+        del soup, text
 
         # Most transcripts have a header which is one, two, or three <p> tags.
-        # Skip the header.
-        self.skipHeader(descendants)
+        # Skip the header, unless the text already starts after it.
+        if startsAtOffset:
+            next(descendants)
+        else:
+            self.skipHeader(descendants)
 
         # Get to the first utterance and identify the speaker.
         while True:
@@ -332,12 +434,13 @@ class TranscriptParser:
                 # extent. This involves identifying the speaker, parsing
                 # the entire extent into utterances and other events, and
                 # yielding all of those events.
-                yield from self.eventsFromExtent(curSpeaker, curExtent)
+                yield from self.turn(curSpeaker, curExtent, continued)
 
                 # Sometimes the speaker tag is empty. If it is, assume the
                 # previously identified speaker is still talking
                 # Otherwise, set the new speaker string.
-                if e.string.strip():
+                continued = not e.string.strip()
+                if not continued:
                     curSpeaker = e.string
 
                 # Reset the current extent
@@ -351,7 +454,92 @@ class TranscriptParser:
                 curExtent += e
             
         if curExtent:
-            yield from self.eventsFromExtent(curSpeaker, curExtent)
+            yield from self.turn(curSpeaker, curExtent, continued)
+
+class TranscriptParser(RawTranscriptParser):
+    '''
+    Parses a debate from the global data accessor. A thin wrapper around RawTranscriptParser
+    that gathers its inputs from the data sources and resolves speakers through the
+    process-wide SpeakerResolver.
+    '''
+
+    def __init__(self, debateToParse):
+        self.debate = debateToParse
+        _id = debateToParse.get('id')
+        debateMetadata = data.dataManager.getDataSourceInstance('debateMetadata', _id)
+        self.resolver = SpeakerResolver.forManager(data.dataManager)
+        self.extractor = HeaderExtractor()
+        self.record = self.extractor.get(_id)
+        parsingMetadata = data.dataManager.getDataSourceInstance('parsingMetadata', _id)
+        super().__init__(
+            self.record['text'],
+            parsingMetadata,
+            self.resolver.lastNames(chain(debateMetadata['participants'], debateMetadata['moderators'])),
+            debateId=_id,
+            moderators=debateMetadata['moderators'],
+            normalized=True,
+            utteranceOffset=HeaderExtractor.utteranceOffset(self.record, parsingMetadata['utteranceIterator']))
+
+    def makeSpeakers(self):
+        '''
+        Resolve speakers through the process-wide SpeakerResolver, so that its statistics
+        cover every debate parsed in this process.
+        '''
+        return self.resolver.speakers(self.debateId, self.lastNames, self.identifySpeaker)
+
+    def saveUtteranceOffset(self):
+        '''
+        After parsing, store the utterance offset found by skipHeader with the debate's
+        normalized transcript, if it wasn't stored already.
+        '''
+        iterator = self.parsingMetadata['utteranceIterator']
+        if self.startsAtOffset() and \
+                HeaderExtractor.utteranceOffset(self.record, iterator) != self.utteranceOffset:
+            self.extractor.setUtteranceOffset(self.record, iterator, self.utteranceOffset)
+
+
+def parseTranscript(raw, parsingMetadata, lastNames, debateId=None, moderators=(), normalized=False, utteranceOffset=None):
+    '''
+    Parse a raw transcript HTML string into a generator of events, without touching the
+    data accessor. See RawTranscriptParser for the arguments.
+    '''
+    return RawTranscriptParser(raw, parsingMetadata, lastNames, debateId, moderators,
+                               normalized=normalized, utteranceOffset=utteranceOffset).parse()
+
+def writeParsedTranscript(debate, validate=None):
+    '''
+    Parse the given debate, write the parsed transcript to the transcripts data
+    source, update the debate's entry in transcriptStats, and return the parsed
+    transcript. Newly written transcripts are validated in full on the
+    background validation thread, unless validation is turned off for parsed
+    transcripts (or validate is False). The statistics are validated according
+    to their data source's validation mode.
+    '''
+    manager = data.dataManager
+    if validate is None:
+        validate = manager.getValidationMode('transcripts') != SchemaValidator.OFF
+
+    parser = TranscriptParser(debate)
+    parsed = {
+        'id': debate.get('id'),
+        'events': list(parser.parse()),
+        'turns': parser.turns
+    }
+    parser.saveUtteranceOffset()
+    manager.writeDataSourceInstance('transcripts', debate.get('id'), parsed,
+        validation=SchemaValidator.FULL if validate else SchemaValidator.OFF)
+    manager.invalidate('transcripts', debate.get('id'))
+    manager.writeDataSourceInstance('transcriptStats', debate.get('id'), computeStats(debate.get('id'), parsed['events']))
+    return parsed
+
+def getArgs():
+    parser = argparse.ArgumentParser(description='''Parse the raw transcripts into sequences of utterance and non-utterance events.''')
+    parser.add_argument('--ids', nargs='*', default=None, help="Only parse these debates.")
+    parser.add_argument('--watch', action='store_true', help='''After parsing, keep running and reparse debates whenever their raw
+                                                            transcripts, parsing metadata, or people metadata change.''')
+    parser.add_argument('--no-initial', action='store_true', help="With --watch, skip the initial full parse.")
+    parser.add_argument('--interval', type=float, default=0.5, help="With --watch, the polling interval in seconds.")
+    return parser.parse_args()
 
 if __name__ == '__main__':
 
@@ -369,15 +557,22 @@ if __name__ == '__main__':
         else:
             return ''.join([event['eventType'], ': ', '\'', event['text'], '\''])
 
-    for debate in data.debates:
-        print("Parsing debate with id {0}...".format(debate.get('id')), end="")
-        try:
-            filename = "../data/debates/parsedTranscripts/{0}.json".format(debate.get('id'))
-            utils.writeJSON({
-                'id': debate.get('id'),
-                'events':list(TranscriptParser(debate).parse())
-            }, filename)
-            print("Done!")
-        except Exception as err:
-            print("Error while parsing debate with id {0}".format(debate.get('id')))
-            raise err
+    args = getArgs()
+    debates = data.debates if args.ids is None else [data.debates[_id] for _id in args.ids]
+
+    if not (args.watch and args.no_initial):
+        for debate in debates:
+            print("Parsing debate with id {0}...".format(debate.get('id')), end="")
+            try:
+                writeParsedTranscript(debate)
+                print("Done!")
+            except Exception as err:
+                print("Error while parsing debate with id {0}".format(debate.get('id')))
+                raise err
+
+        data.dataManager.validator.join()
+        SpeakerResolver.forManager(data.dataManager).printUnresolved()
+
+    if args.watch:
+        from TranscriptWatcher import TranscriptWatcher
+        TranscriptWatcher(interval=args.interval).run()
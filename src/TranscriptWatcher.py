@@ -0,0 +1,203 @@
+'''
+Contains the TranscriptWatcher class, which keeps the parser, its NLTK
+models, and the data accessor warm in memory and reparses debates as soon
+as any of their inputs change. Run it with `python TranscriptParser.py --watch`.
+'''
+
+import collections
+import importlib
+import time
+import traceback
+import types
+
+import utils
+from ThesisDataAccessor import Accessor as data
+
+
+def _codeKey(code):
+    '''
+    Return a hashable fingerprint of a code object (including any nested lambdas)
+    that is stable across module reloads. The names and variable names are part of
+    it, since the bytecode only refers to them by index.
+    '''
+    return (code.co_code, tuple(_codeKey(c) if isinstance(c, types.CodeType) else c for c in code.co_consts),
+            code.co_names, code.co_varnames)
+
+
+def _fixesKeys(parserClass):
+    '''
+    Return a fingerprint of each of the parser's special fixes, by debate id.
+    '''
+    return {_id: _codeKey(fix.__code__) for _id, fix in parserClass.specialFixes.items()}
+
+
+class TranscriptWatcher:
+    '''
+    Polls the raw transcripts, the single-file metadata sources that the parser reads,
+    and the parser's own source file. When something changes, only the debates it
+    affects are reparsed, and a per-debate diff of event counts is printed.
+    Changes to the parser source only trigger reparses for debates whose special
+    fixes changed; rerun the full parser after changing anything else in it.
+    '''
+
+    # Single-file data sources whose changes affect parsing
+    watchedSources = ['parsingMetadata', 'debateMetadata', 'peopleMetadata']
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.manager = data.dataManager
+        # A module reference of our own, so that the parser can be reloaded
+        # even when TranscriptParser is running as __main__
+        self.parserModule = importlib.import_module('TranscriptParser')
+        self._counts = {}
+        self._rawStamps = self._scanRaw()
+        self._sourceStamps = {name: self._sourceStamp(name) for name in self.watchedSources}
+        self._sources = {name: self.manager.getDataSource(name) for name in self.watchedSources}
+        self._parserStamp = utils.getFileStamp(self.parserModule.__file__)
+        self._fixes = _fixesKeys(self.parserModule.TranscriptParser)
+
+    ##############################################
+    ############## CHANGE DETECTION ##############
+
+    def _sourceStamp(self, name):
+        '''
+        Return a stamp covering both the JSON snapshot and the change log of a
+        single-file data source.
+        '''
+        store = self.manager.getStore(name)
+        return (utils.getFileStamp(store.snapshotFile), utils.getFileStamp(store.logFile))
+
+    def _scanRaw(self):
+        '''
+        Return the current version stamp of every raw transcript, by id, from whichever
+        storage backend holds the raw transcripts.
+        '''
+        storage = self.manager.getStorage('transcriptsRaw')
+        return {_id: storage.version(_id) for _id in storage.ids()}
+
+    def _changedRaw(self):
+        stamps = self._scanRaw()
+        changed = {_id for _id in stamps if stamps[_id] != self._rawStamps.get(_id)}
+        for _id in changed:
+            if _id in self._rawStamps:
+                self.manager.invalidate('transcriptsRaw', _id)
+            else:
+                # A new raw transcript means the id list is out of date as well
+                self.manager.invalidate('transcriptsRaw')
+        self._rawStamps = stamps
+        return changed
+
+    def _changedSource(self, name):
+        '''
+        If the given single-file data source has changed on disk, reload it and return
+        the ids of the debates affected by the change.
+        '''
+        stamp = self._sourceStamp(name)
+        if stamp == self._sourceStamps[name]:
+            return set()
+        self._sourceStamps[name] = stamp
+
+        old = self._sources[name]
+        self.manager.invalidate(name)
+        new = self._sources[name] = self.manager.getDataSource(name)
+        changed = {_id for _id in set(old) | set(new) if old.get(_id) != new.get(_id)}
+
+        if name == 'peopleMetadata':
+            # A change to a person affects every debate they took part in
+            debates = self.manager.getDataSource('debateMetadata')
+            return {_id for _id, md in debates.items() if changed.intersection(md['participants'], md['moderators'])}
+        return changed
+
+    def _changedFixes(self):
+        '''
+        If the parser source has changed, reload it and return the ids of the debates
+        whose special fixes were added, removed, or changed.
+        '''
+        stamp = utils.getFileStamp(self.parserModule.__file__)
+        if stamp == self._parserStamp:
+            return set()
+        self._parserStamp = stamp
+
+        try:
+            importlib.reload(self.parserModule)
+        except Exception:
+            traceback.print_exc()
+            print("Could not reload the parser; keeping the previous version.")
+            return set()
+
+        old, new = self._fixes, _fixesKeys(self.parserModule.TranscriptParser)
+        self._fixes = new
+        print("Parser reloaded. Only debates with changed special fixes will be reparsed.")
+        return {_id for _id in set(old) | set(new) if old.get(_id) != new.get(_id)}
+
+    def poll(self):
+        '''
+        Return the set of debate ids affected by changes since the last poll.
+        '''
+        affected = self._changedRaw()
+        for name in self.watchedSources:
+            affected |= self._changedSource(name)
+        affected |= self._changedFixes()
+        return affected
+
+    ##############################################
+    ################# REPARSING ##################
+
+    def _previousCounts(self, _id):
+        '''
+        Return the event counts from the last time this debate was parsed, reading them
+        from the existing parsed transcript if this watcher hasn't parsed it yet.
+        '''
+        if _id not in self._counts:
+            try:
+                events = self.manager.getStorage('transcripts').read(_id)['events']
+            except (FileNotFoundError, KeyError):
+                events = []
+            self._counts[_id] = collections.Counter(e['eventType'] for e in events)
+        return self._counts[_id]
+
+    def reparse(self, _id):
+        '''
+        Reparse a single debate and print the difference in its event counts.
+        '''
+        old = self._previousCounts(_id)
+        start = time.time()
+        parsed = self.parserModule.writeParsedTranscript(data.debates[_id])
+        new = self._counts[_id] = collections.Counter(e['eventType'] for e in parsed['events'])
+        print("Reparsed debate {0} in {1:.2f}s:".format(_id, time.time() - start))
+        printCountsDiff(old, new)
+
+    def run(self):
+        '''
+        Poll for changes until interrupted, reparsing affected debates as they appear.
+        '''
+        print("Watching for changes (Ctrl-C to stop)...")
+        try:
+            while True:
+                time.sleep(self.interval)
+                known = set(self.manager.getDataSourceIds('debateMetadata'))
+                for _id in sorted(self.poll()):
+                    if _id not in known or _id not in self._rawStamps:
+                        print("Skipping debate {0}: no metadata or raw transcript.".format(_id))
+                        continue
+                    try:
+                        self.reparse(_id)
+                    except Exception:
+                        traceback.print_exc()
+                        print("Error while reparsing debate with id {0}".format(_id))
+        except KeyboardInterrupt:
+            print("Stopped watching.")
+
+
+def printCountsDiff(old, new):
+    '''
+    Print a table of event counts before and after a reparse.
+    '''
+    if old == new:
+        print("    No change ({0} events).".format(sum(new.values())))
+        return
+    for eventType in sorted(set(old) | set(new)):
+        delta = new[eventType] - old[eventType]
+        print("    {0:<16} {1:>6} -> {2:<6} {3}".format(eventType, old[eventType], new[eventType],
+            "({0:+d})".format(delta) if delta else ""))
+    print("    {0:<16} {1:>6} -> {2:<6}".format("total", sum(old.values()), sum(new.values())))
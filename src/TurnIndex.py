@@ -0,0 +1,91 @@
+'''
+Contains the TurnIndex class, a compact index of the speaker turns in a
+parsed transcript. Turns are stored as parallel arrays of start and end
+event indices, with a third array mapping every event to the turn that
+contains it, so both iterating over turns and finding the turn of an event
+take constant time per lookup. Also contains helpers for reading turns and
+reactions from a transcript's events.
+'''
+
+import itertools
+from array import array
+
+
+def turnsFromEvents(events):
+    '''
+    Recover the turns of a parsed transcript that was written without them: each turn
+    starts at an utterance whose speaker differs from the previous utterance's, and
+    reactions belong to the turn they follow. This cannot see the boundary between
+    consecutive extents by different speakers who couldn't be identified (both have a
+    None speaker), which the parser records.
+    '''
+    turns = []
+    for i, event in enumerate(events):
+        if event['eventType'] == 'utterance':
+            if not turns or turns[-1][2] != event['speaker']:
+                turns.append([i, i + 1, event['speaker']])
+            else:
+                turns[-1][1] = i + 1
+        elif turns:
+            turns[-1][1] = i + 1
+    return turns
+
+
+def reactionAfter(events, i):
+    '''
+    Return a string describing the non-utterance events that immediately follow
+    the utterance at index i (e.g. 'applause' or 'applause+laughter'), or 'none'
+    if the next event is another utterance.
+    '''
+    reactions = set()
+    for event in itertools.islice(events, i + 1, None):
+        if event['eventType'] == 'utterance':
+            break
+        reactions.add(event['eventType'])
+    return '+'.join(sorted(reactions)) if reactions else 'none'
+
+
+class TurnIndex:
+    '''
+    The speaker turns of a parsed transcript, as built by the parser. Turn i covers
+    events[starts[i]:ends[i]] and was spoken by speakers[i] (a person id, or None).
+    Events before the first turn (if any) belong to no turn.
+    '''
+
+    def __init__(self, turns, eventCount):
+        self.starts = array('l', (turn[0] for turn in turns))
+        self.ends = array('l', (turn[1] for turn in turns))
+        self.speakers = [turn[2] for turn in turns]
+        # The turn containing each event, or -1
+        self.eventTurns = array('l', [-1]) * eventCount
+        for i, (start, end) in enumerate(zip(self.starts, self.ends)):
+            self.eventTurns[start:end] = array('l', [i]) * (end - start)
+
+    @classmethod
+    def fromTranscript(cls, transcript):
+        '''
+        Build the index of a parsed transcript, recovering its turns from the events if
+        it was written before the parser recorded them.
+        '''
+        events = transcript['events']
+        turns = transcript.get('turns')
+        return cls(turnsFromEvents(events) if turns is None else turns, len(events))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def turn(self, i):
+        '''Return the (start, end, speaker) of turn i.'''
+        return self.starts[i], self.ends[i], self.speakers[i]
+
+    def __iter__(self):
+        return zip(self.starts, self.ends, self.speakers)
+
+    def turnOf(self, eventIndex):
+        '''Return the index of the turn containing the given event, or None.'''
+        i = self.eventTurns[eventIndex]
+        return None if i < 0 else i
+
+    def turnsBy(self, speaker):
+        '''Return the indices of the turns spoken by the given person id.'''
+        return [i for i, s in enumerate(self.speakers) if s == speaker]
@@ -12,6 +12,8 @@ class TypeNode():
         self._children = {}
         self._datahook = _datahook
         self._idshook = _idshook
+        # The number of times getSubtype has found this node (see lookups)
+        self._lookups = 0
 
     def name(self):
         '''Return this node's name.'''
@@ -57,6 +59,7 @@ class TypeNode():
         if node is None:
             raise KeyError("Node with name {0} not found".format(name))
         else:
+            node._lookups += 1
             return node
 
     def _search(self, name):
@@ -72,6 +75,24 @@ class TypeNode():
                 if n != None:
                     return n
 
+    def lookups(self):
+        '''
+        Return a dictionary mapping the name of each node in this subtree (excluding this
+        node) to the number of times getSubtype has found it.
+        '''
+        counts = {}
+        for child in self._children.values():
+            counts[child.name()] = counts.get(child.name(), 0) + child._lookups
+            for name, count in child.lookups().items():
+                counts[name] = counts.get(name, 0) + count
+        return counts
+
+    def resetLookups(self):
+        '''Reset the lookup counts of this subtree.'''
+        self._lookups = 0
+        for child in self._children.values():
+            child.resetLookups()
+
     def setDataHook(self, datahook):
         '''
         Sets this type's datahook, which is a function that takes a node and an id
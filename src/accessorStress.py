@@ -0,0 +1,95 @@
+'''
+A stress test for sharing the data accessor between threads. Many threads query
+random debates' metadata and transcripts at once, from a cold start, and the
+script checks that every thread saw the same data as a single-threaded pass and
+that each transcript was read from disk exactly once.
+'''
+
+import argparse
+import collections
+import random
+import sys
+import threading
+
+from ThesisDataAccessor import Accessor as data
+
+
+def summarize(debate):
+    '''
+    Return a comparable summary of a debate's metadata and transcript.
+    '''
+    return (debate.debateMetadata.date, debate.debateMetadata.party, len(debate.transcripts.events))
+
+
+def countReads(manager, dataSourceName):
+    '''
+    Wrap the data source's storage so that every read from disk is counted, by id.
+    '''
+    storage = manager.getStorage(dataSourceName)
+    read = storage.read
+    counts = collections.Counter()
+    lock = threading.Lock()
+
+    def countingRead(_id):
+        with lock:
+            counts[_id] += 1
+        return read(_id)
+    storage.read = countingRead
+    return counts
+
+
+def worker(ids, queries, seed, expected, errors, barrier):
+    rng = random.Random(seed)
+    barrier.wait()
+    try:
+        for _ in range(queries):
+            _id = rng.choice(ids)
+            summary = summarize(data.debates[_id])
+            if summary != expected[_id]:
+                errors.append("Debate {0}: expected {1}, got {2}".format(_id, expected[_id], summary))
+    except Exception as err:
+        errors.append("{0}: {1}".format(type(err).__name__, err))
+
+
+def run(threads=32, queries=200, seed=0):
+    '''
+    Run the stress test and return a list of errors (empty if it passed).
+    '''
+    manager = data.dataManager
+    ids = sorted(set(manager.getDataSourceIds('transcripts')) & set(manager.getDataSourceIds('debateMetadata')))
+
+    # A single-threaded reference pass, then start again from cold
+    expected = {_id: summarize(data.debates[_id]) for _id in ids}
+    manager.invalidate('transcripts')
+    manager.invalidate('debateMetadata')
+    reads = countReads(manager, 'transcripts')
+
+    errors = []
+    barrier = threading.Barrier(threads)
+    pool = [threading.Thread(target=worker, args=(ids, queries, seed + i, expected, errors, barrier))
+            for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+
+    # Every instance read in this run should have been read once, however many threads asked for it
+    errors.extend("Transcript {0} was read {1} times".format(_id, n) for _id, n in sorted(reads.items()) if n > 1)
+    return errors
+
+
+def getArgs():
+    parser = argparse.ArgumentParser(description='''Query the data accessor from many threads at once and check that
+                                                  the results match a single-threaded pass.''')
+    parser.add_argument('--threads', type=int, default=32, help="The number of threads.")
+    parser.add_argument('--queries', type=int, default=200, help="The number of queries per thread.")
+    parser.add_argument('--seed', type=int, default=0, help="The random seed.")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = getArgs()
+    errors = run(args.threads, args.queries, args.seed)
+    for error in errors:
+        print(error)
+    print("{0} errors.".format(len(errors)))
+    sys.exit(1 if errors else 0)
@@ -0,0 +1,92 @@
+'''
+Measures the tradeoff between disk size and load latency for each supported
+compression codec on a multiple-file data source. Every instance is rewritten
+with each codec into a temporary directory, then loaded back through the same
+path DataSourceManager uses, so the numbers reflect what the accessor sees.
+'''
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import utils
+from StorageBackend import DirectoryStorage
+from ThesisDataAccessor import Accessor as data
+
+
+def benchmarkCodec(source, ids, compression, directory, repeats=3):
+    '''
+    Write every instance of source to directory with the given compression and return
+    a dictionary with the total size in bytes, the write time, and the mean load latency.
+    '''
+    target = DirectoryStorage(directory, source.isJson, source.ext, compression=compression)
+
+    start = time.perf_counter()
+    for _id in ids:
+        target.write(_id, source.read(_id))
+    writeTime = time.perf_counter() - start
+
+    size = sum(os.path.getsize(target.location(_id)) for _id in ids)
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for _id in ids:
+            target.read(_id)
+    loadTime = (time.perf_counter() - start) / (repeats * len(ids)) if ids else 0.0
+
+    return {'codec': compression or 'none', 'bytes': size, 'writeSeconds': writeTime, 'meanLoadSeconds': loadTime}
+
+
+def benchmark(dataSourceName, codecs=("none", "gzip", "bz2", "lzma"), limit=None, repeats=3):
+    '''
+    Benchmark each codec on a multiple-file data source and return a list of results.
+    '''
+    manager = data.dataManager
+    location = manager.locations[dataSourceName]
+    if location['single']:
+        raise KeyError("{0} is a single-file data source.".format(dataSourceName))
+    source = DirectoryStorage(manager.getDataSourceDirectory(dataSourceName), location['isJson'])
+    ids = sorted(source.ids())[:limit]
+
+    results = []
+    scratch = tempfile.mkdtemp(prefix="compression-")
+    try:
+        for codec in codecs:
+            directory = os.path.join(scratch, codec)
+            results.append(benchmarkCodec(source, ids, None if codec == "none" else codec, directory, repeats))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return results
+
+
+def printResults(results):
+    base = results[0]['bytes'] if results and results[0]['bytes'] else None
+    print("{0:<6} {1:>12} {2:>7} {3:>10} {4:>12}".format("codec", "bytes", "ratio", "write (s)", "load (ms)"))
+    for r in results:
+        ratio = "{0:.2f}".format(r['bytes'] / base) if base else "-"
+        print("{0:<6} {1:>12} {2:>7} {3:>10.2f} {4:>12.3f}".format(r['codec'], r['bytes'], ratio,
+            r['writeSeconds'], r['meanLoadSeconds'] * 1000))
+
+
+def getArgs():
+    parser = argparse.ArgumentParser(description='''Compare the disk size and load latency of each compression
+                                                  codec on a multiple-file data source. To store a data source
+                                                  compressed, set its "compression" in locs.json.''')
+    parser.add_argument('dataSource', nargs='?', default='transcripts', help="The name of the data source in locs.json.")
+    parser.add_argument('--codecs', nargs='*', default=["none", "gzip", "bz2", "lzma"],
+                        choices=["none"] + sorted(utils.compressionExtensions), help="The codecs to compare.")
+    parser.add_argument('--limit', type=int, default=None, help="Only use the first n instances.")
+    parser.add_argument('--repeats', type=int, default=3, help="How many times to load each instance.")
+    parser.add_argument('--json', default=None, help="Also write the results to this JSON file.")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = getArgs()
+    results = benchmark(args.dataSource, args.codecs, args.limit, args.repeats)
+    printResults(results)
+    if args.json is not None:
+        with open(args.json, 'w') as outputFile:
+            json.dump(results, outputFile, indent=2)
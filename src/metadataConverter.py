@@ -6,27 +6,164 @@ from datetime import datetime
 from dateutil.parser import parse
 import os
 
+import utils
+
+# The formats tried, in order, before falling back to dateutil's (much slower) parser
+dateFormats = ["%B %d, %Y", "%b %d, %Y", "%m/%d/%Y", "%Y-%m-%d", "%Y/%m/%d"]
+
+# The TSV column holding each debate's title
+nameColumn = 'Name'
+
+# The fields of an existing debate that a row updates. The title is only taken from the
+# TSV for new debates, since existing titles may have been edited by hand.
+mergedFields = ('date', 'transcriptUrl')
+
 def getArgs():
     parser = argparse.ArgumentParser(description='''Given an input TSV with date, name, and url information on each row, creates a new JSON data file for each debate.
-                                                  Uses the UCSB page ID as the debate id.''')
+                                                  Uses the UCSB page ID as the debate id. With --bulk, merges the rows into the debateMetadata
+                                                  data source (or the single JSON file given by --output) instead.''')
     parser.add_argument('inputFile', help="The input TSV.")
-    parser.add_argument('outputDir', help="The location in which to create the output JSON files, one for each debate.")
-    return parser.parse_args()
+    parser.add_argument('outputDir', nargs='?', default=None, help="The location in which to create the output JSON files, one for each debate.")
+    parser.add_argument('--bulk', action='store_true', help="Merge every row into a single metadata file, by debate id, in one write.")
+    parser.add_argument('--output', default=None, help="With --bulk, the single JSON file to merge into (defaults to the debateMetadata data source).")
+    args = parser.parse_args()
+    if not args.bulk and args.outputDir is None:
+        parser.error("an output directory is required unless --bulk is given")
+    return args
 
 def encoderExtension(field):
     if type(field) == datetime:
         return datetime.strftime(field, "%Y/%m/%d")
     else: raise TypeError()
 
+class DateParser:
+    '''
+    Parses the dates in a TSV. The dates in a TSV are almost always in one format, so the
+    format that last worked is tried first, and dateutil is only used as a last resort.
+    '''
+
+    def __init__(self, formats=dateFormats):
+        self.formats = list(formats)
+        self.format = None
+
+    def __call__(self, string):
+        string = string.strip().strip("\"")
+        if self.format is not None:
+            try:
+                return datetime.strptime(string, self.format)
+            except ValueError:
+                pass
+        for dateFormat in self.formats:
+            try:
+                date = datetime.strptime(string, dateFormat)
+            except ValueError:
+                continue
+            self.format = dateFormat
+            return date
+        return parse(string)
+
+def readRows(inputFile, parseDate=None):
+    '''
+    Stream the rows of the input TSV as (debate id, fields) pairs, where fields holds the
+    debate's date (formatted as in debateMetadata), transcript URL, and title.
+    '''
+    parseDate = DateParser() if parseDate is None else parseDate
+    with open(inputFile, 'r') as inputTSV:
+        for row in csv.DictReader(inputTSV, delimiter='\t'):
+            debateId = str(int(row['URL'].split('=')[1]))
+            yield debateId, {'date': encoderExtension(parseDate(row['Date'])), 'transcriptUrl': row['URL'],
+                             'friendlyName': (row.get(nameColumn) or "").strip().strip("\"")}
+
+def electionYear(date):
+    '''
+    Return the year of the presidential election that a debate on the given date
+    (formatted as in debateMetadata) is held for: its own year, or the next election year.
+    '''
+    year = int(date[:4])
+    return year + (-year % 4)
+
+def newRecord(debateId, fields):
+    '''
+    Return the debateMetadata record for a debate that is not in the metadata yet, with every
+    required field present. Its participants, moderators, and party are not in the TSV, so
+    they are left empty (and null) until they are filled in by hand.
+    '''
+    record = {
+        'id': debateId,
+        'friendlyName': "",
+        'applauseTranscribed': False,
+        'moderators': [],
+        'participants': [],
+        'electionYear': electionYear(fields['date']),
+        'party': None
+    }
+    record.update(fields)
+    return record
+
+def mergeRows(existing, rows):
+    '''
+    Return the changes needed to merge the rows into the existing metadata, as a dictionary
+    mapping each new or changed debate id to the fields to set, and the number of rows that
+    were already up to date. New debates get a complete record (see newRecord); existing
+    debates only have their mergedFields updated.
+    '''
+    changes = {}
+    unchanged = 0
+    for debateId, fields in rows:
+        record = existing.get(debateId)
+        if record is None:
+            changes[debateId] = newRecord(debateId, fields)
+            continue
+        fields = {key: fields[key] for key in mergedFields if key in fields}
+        if any(record.get(key) != value for key, value in fields.items()):
+            changes[debateId] = fields
+        else:
+            unchanged += 1
+    return changes, unchanged
+
+def mergeIntoDataSource(rows, dataSourceName='debateMetadata'):
+    '''
+    Merge the rows into a single-file data source, committing every change as one
+    transaction, so that other readers see all of the rows or none of them.
+    '''
+    from ThesisDataAccessor import Accessor as data
+    manager = data.dataManager
+    changes, unchanged = mergeRows(manager.getDataSource(dataSourceName), rows)
+    if changes:
+        with manager.transaction(dataSourceName) as txn:
+            for debateId, fields in changes.items():
+                txn.update(debateId, fields)
+    return len(changes), unchanged
+
+def mergeIntoFile(rows, filename):
+    '''
+    Merge the rows into a single JSON metadata file, which is replaced atomically.
+    '''
+    existing = utils.getJSON(filename) if os.path.exists(filename) else {}
+    changes, unchanged = mergeRows(existing, rows)
+    if changes:
+        for debateId, fields in changes.items():
+            existing.setdefault(debateId, {}).update(fields)
+        utils.writeJSON(existing, filename)
+    return len(changes), unchanged
+
 def main():
     args = getArgs()
+    if args.bulk:
+        rows = readRows(args.inputFile)
+        changed, unchanged = mergeIntoDataSource(rows) if args.output is None else mergeIntoFile(rows, args.output)
+        print("Merged {0} new or changed debates ({1} unchanged).".format(changed, unchanged))
+        return
+
+    parseDate = DateParser()
     with open(args.inputFile, 'r') as inputTSV:
         reader = csv.DictReader(inputTSV, delimiter='\t')
         for row in reader:
             debateId = int(row['URL'].split('=')[1])
             debateFile = str(debateId)+".json"
-            debate = {'id': debateId, 'date': parse(row['Date'].strip("\"")), 'url': row['URL']}
+            debate = {'id': debateId, 'date': parseDate(row['Date']), 'url': row['URL']}
             with open(os.path.join(args.outputDir, debateFile), 'w') as outputFile:
                 json.dump(debate, outputFile, sort_keys=True, indent=4, default=encoderExtension)
 
-main()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
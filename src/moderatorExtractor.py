@@ -1,4 +1,5 @@
 from ThesisDataAccessor import Accessor as data
+from HeaderExtractor import HeaderExtractor
 import re
 import binascii
 import utils
@@ -48,24 +49,17 @@ mappings = {
     'Brett Baier': 'Bret Baier'
 }
 
-moderatorsSection = "<(b|i)> (HOSTS?|Hosts?|MODERATORS?|Moderators?): (<br/> )?</(b|i)> (<br/> )?(.*?) </?p>"
 suffix = "[;,\.]?( (and|with);?)?\s*$"
 n = 0
 uncovered = []
+extractor = HeaderExtractor()
 for debate in data.debates:
     #print(debate.get("id"))
-    transcript = re.sub("\s+"," ", debate.transcriptsRaw)
-    
-    moderators = re.search(moderatorsSection, transcript)
-
-    #if debate.get('id') == '29427':
-    #    print(transcript[:1000])
-    #    print(moderators.groups())
-    #    input()
+    moderators = extractor.header(debate.get('id'))['moderators']
 
-    if moderators and moderators.group(6) is not None:
+    if moderators is not None:
         n += 1
-        nameStrings = [re.sub(suffix, "", line).strip() for line in moderators.group(6).split("<br/>") if not re.match("^\s*$", line)]
+        nameStrings = [re.sub(suffix, "", line).strip() for line in moderators.split("<br/>") if not re.match("^\s*$", line)]
         names = [parseName(name) for name in nameStrings if "PANELIST" not in name]
         debatesDict[debate.get('id')] = [(lambda full: mappings.get(full, full))("{0} {1}".format(d['first'], d['last'])) for d in names]
         for d in names:
@@ -104,7 +98,9 @@ for person in people:
     _id = makeId(person)
     peopleMetadata[_id] = makePersonMetadata(_id, person.split()[0], person.split()[1], 'moderator')
 
-current = utils.getJSON("../data/people/metadata/metadata.json")
+# The metadata is committed through the data sources' change logs (writing the JSON
+# files directly would be undone when the logs are replayed on top of them)
+current = data.dataManager.getDataSource('peopleMetadata')
 utils.writeJSON(current, "../data/people/metadata/metadata_backup.json")
 
 alone = set([_id for _id in current if current[_id]['personType'] == 'moderator']) - set(peopleMetadata.keys())
@@ -112,17 +108,18 @@ print(alone)
 
 print(len(peopleMetadata))
 print(len(current))
-current.update(peopleMetadata)
+with data.dataManager.transaction('peopleMetadata') as txn:
+    for _id in peopleMetadata:
+        txn.put(_id, peopleMetadata[_id])
 print("-------")
-print(len(current))
-utils.writeJSON(current, "../data/people/metadata/metadata.json")
+print(len(data.dataManager.getDataSource('peopleMetadata')))
 
 ## UNSAFE!!! ##
-debateMetadata = utils.getJSON("../data/debates/metadata/metadata.json")
+debateMetadata = data.dataManager.getDataSource('debateMetadata')
 utils.writeJSON(debateMetadata, "../data/debates/metadata/metadata_backup.json")
-for debateId in debateMetadata:
-    debateMetadata[debateId]['moderators'] = [makeId(moderator) for moderator in debatesDict[debateId]]
-utils.writeJSON(debateMetadata, "../data/debates/metadata/metadata.json")
+with data.dataManager.transaction('debateMetadata') as txn:
+    for debateId in debateMetadata:
+        txn.update(debateId, {'moderators': [makeId(moderator) for moderator in debatesDict[debateId]]})
 
 
 # ------------------------------------- VALIDATE ------------------------------------- #
@@ -0,0 +1,281 @@
+'''
+Contains the NgramCounter class, a map-reduce engine for counting n-grams
+over the parsed transcripts. Debates are sharded across worker processes,
+each worker spills its partial counts to sorted files on disk whenever
+it holds too many distinct n-grams, and the spill files are merged back
+together in a single streaming pass. Counts can be grouped by speaker,
+party, debate party, election year, and reaction outcome.
+'''
+
+import argparse
+import heapq
+import itertools
+import json
+import os
+import shutil
+import tempfile
+from collections import Counter
+from multiprocessing import Pool
+
+import utils
+from ThesisDataAccessor import Accessor as data
+from TurnIndex import reactionAfter
+
+
+def loadStoplist(filename):
+    '''
+    Load a JSON list of stop words into a frozenset of lowercased strings.
+    '''
+    return frozenset(word.lower() for word in utils.getJSON(filename))
+
+
+# Each grouping maps a name to a function of (context, debateId, events, i)
+# that returns the group value for the utterance at index i.
+groupings = {
+    'speaker': (lambda ctx, debateId, events, i: events[i]['speaker']),
+    'party': (lambda ctx, debateId, events, i: ctx['peopleParties'].get(events[i]['speaker'])),
+    'debateParty': (lambda ctx, debateId, events, i: ctx['debates'][debateId]['party']),
+    'year': (lambda ctx, debateId, events, i: ctx['debates'][debateId]['electionYear']),
+    'reaction': (lambda ctx, debateId, events, i: reactionAfter(events, i))
+}
+
+
+##############################################
+############### WORKER PROCESS ###############
+
+# The worker context is set once per worker process by the pool initializer
+# so that the metadata and stoplists are not pickled with every task.
+_context = None
+
+def _initWorker(context):
+    global _context
+    _context = context
+
+
+def _writeSpill(pairs, spillDir):
+    '''
+    Write (key, count) pairs, in key order, to a new file in spillDir and return the
+    filename. Each line is a JSON-encoded [group, ngram] key followed by a tab and the count.
+    '''
+    fd, filename = tempfile.mkstemp(suffix=".spill", dir=spillDir)
+    with os.fdopen(fd, 'w', encoding='utf-8') as spillFile:
+        for key, count in pairs:
+            spillFile.write("{0}\t{1}\n".format(key, count))
+    return filename
+
+
+def _spill(counter, spillDir):
+    '''
+    Write the given counter to a new file in spillDir, sorted by key, and
+    return the filename.
+    '''
+    return _writeSpill(((key, counter[key]) for key in sorted(counter)), spillDir)
+
+
+def _countShard(debateIds):
+    '''
+    The map step. Count the n-grams in every debate in the shard and return
+    the list of spill files the counts were written to.
+    '''
+    ctx = _context
+    n = ctx['n']
+    stops = ctx['stops']
+    keyFuncs = [groupings[g] for g in ctx['groupBy']]
+    counter = Counter()
+    spills = []
+
+    for debateId in debateIds:
+        events = ctx['transcripts'].read(debateId)['events']
+        for i, event in enumerate(events):
+            if event['eventType'] != 'utterance':
+                continue
+            tokens = [t.lower() for t in event['tokens']]
+            if ctx['dropPunctuation']:
+                tokens = [t for t in tokens if any(c.isalnum() for c in t)]
+            if len(tokens) < n:
+                continue
+            group = [f(ctx, debateId, events, i) for f in keyFuncs]
+            # Stop words are kept inside n-grams; only n-grams of nothing but stop words are dropped
+            for j in range(len(tokens) - n + 1):
+                ngram = tokens[j:j + n]
+                if not all(t in stops for t in ngram):
+                    counter[json.dumps([group, ngram])] += 1
+
+            if len(counter) >= ctx['maxEntries']:
+                spills.append(_spill(counter, ctx['spillDir']))
+                counter = Counter()
+        # Let the transcript be collected before the next one is read
+        del events
+
+    if counter:
+        spills.append(_spill(counter, ctx['spillDir']))
+    return spills
+
+
+##############################################
+################ REDUCE STEP #################
+
+def _readSpill(filename):
+    with open(filename, 'r', encoding='utf-8') as spillFile:
+        for line in spillFile:
+            key, count = line.rstrip('\n').rsplit('\t', 1)
+            yield key, int(count)
+
+
+def _mergeSorted(filenames):
+    '''
+    Merge sorted spill files into a single stream of (key, count) pairs in key order,
+    summing the counts of equal keys.
+    '''
+    merged = heapq.merge(*[_readSpill(f) for f in filenames], key=lambda kv: kv[0])
+    for key, pairs in itertools.groupby(merged, key=lambda kv: kv[0]):
+        yield key, sum(count for _, count in pairs)
+
+
+def mergeSpills(filenames, fanIn=64):
+    '''
+    The reduce step. Perform a k-way merge of the sorted spill files, summing
+    the counts of equal keys. Yields (group, ngram, count) tuples in key order
+    while holding only one line per open spill file in memory. At most fanIn
+    files are open at once: if there are more spills, they are first merged in
+    batches into intermediate spill files (next to the spills), which are
+    removed once they have been merged in turn.
+    '''
+    filenames = list(filenames)
+    intermediate = set()
+    try:
+        while len(filenames) > fanIn:
+            spillDir = os.path.dirname(filenames[0])
+            merged = []
+            for i in range(0, len(filenames), fanIn):
+                batch = filenames[i:i + fanIn]
+                merged.append(_writeSpill(_mergeSorted(batch), spillDir))
+                intermediate.add(merged[-1])
+                for filename in intermediate.intersection(batch):
+                    os.remove(filename)
+                    intermediate.discard(filename)
+            filenames = merged
+        for key, count in _mergeSorted(filenames):
+            group, ngram = json.loads(key)
+            yield tuple(group), tuple(ngram), count
+    finally:
+        for filename in intermediate:
+            os.remove(filename)
+
+
+class NgramCounter:
+    '''
+    Counts n-grams over the parsed transcripts using a pool of worker processes.
+    Construct the counter, call run(), then stream the merged results with
+    results(), or write them to a file with writeTSV(). Call cleanup() (or use
+    the counter as a context manager) to remove the spill files afterwards.
+    '''
+
+    def __init__(self, n, groupBy=(), processes=None, maxEntries=1000000, shardSize=4,
+                 dropPunctuation=True, spillDir=None, stoplists=("names", "stops")):
+        for g in groupBy:
+            if g not in groupings:
+                raise KeyError("{0} is not a valid grouping. Choose from {1}.".format(g, sorted(groupings)))
+        self.n = n
+        self.groupBy = list(groupBy)
+        self.processes = processes
+        self.maxEntries = maxEntries
+        self.shardSize = shardSize
+        self.dropPunctuation = dropPunctuation
+        self.stoplists = stoplists
+        self._ownsSpillDir = spillDir is None
+        self.spillDir = tempfile.mkdtemp(prefix="ngrams-") if spillDir is None else spillDir
+        self.spills = []
+
+    def _makeContext(self):
+        '''
+        Gather everything a worker needs into a plain, picklable dictionary.
+        '''
+        manager = data.dataManager
+        stoplistDir = os.path.join(manager.top, manager.dataDir, "stoplists")
+        stops = frozenset().union(*[loadStoplist(utils.makeJSONFilename(stoplistDir, name)) for name in self.stoplists])
+
+        return {
+            'n': self.n,
+            'groupBy': self.groupBy,
+            'stops': stops,
+            'dropPunctuation': self.dropPunctuation,
+            'maxEntries': self.maxEntries,
+            'spillDir': self.spillDir,
+            'transcripts': manager.getStorage('transcripts'),
+            'debates': {_id: {'party': md.get('party'), 'electionYear': md['electionYear']} for _id, md in \
+                manager.getDataSource('debateMetadata').items()},
+            'peopleParties': {_id: md.get('party') for _id, md in manager.getDataSource('peopleMetadata').items()}
+        }
+
+    def run(self, debateIds=None):
+        '''
+        Count the n-grams in the given debates (by default, every parsed transcript).
+        Returns self so that results can be chained.
+        '''
+        if debateIds is None:
+            debateIds = sorted(data.dataManager.getDataSourceIds('transcripts'))
+        debateIds = list(debateIds)
+        shards = [debateIds[i:i + self.shardSize] for i in range(0, len(debateIds), self.shardSize)]
+
+        with Pool(self.processes, initializer=_initWorker, initargs=(self._makeContext(),)) as pool:
+            for spills in pool.imap_unordered(_countShard, shards):
+                self.spills.extend(spills)
+        return self
+
+    def results(self):
+        '''
+        Return a generator of (group, ngram, count) tuples merged from every worker.
+        '''
+        return mergeSpills(self.spills)
+
+    def mostCommon(self, k):
+        '''
+        Return the k most common (group, ngram, count) tuples without materializing
+        the whole result set.
+        '''
+        return heapq.nlargest(k, self.results(), key=lambda r: r[2])
+
+    def writeTSV(self, filename):
+        '''
+        Write the merged results to a TSV file with one row per group and n-gram.
+        '''
+        with open(filename, 'w', encoding='utf-8') as outputFile:
+            outputFile.write('\t'.join(self.groupBy + ['ngram', 'count']) + '\n')
+            for group, ngram, count in self.results():
+                outputFile.write('\t'.join([str(g) for g in group] + [' '.join(ngram), str(count)]) + '\n')
+
+    def cleanup(self):
+        '''
+        Remove the spill files (and the spill directory, if the counter created it).
+        '''
+        for filename in self.spills:
+            os.remove(filename)
+        self.spills = []
+        if self._ownsSpillDir:
+            shutil.rmtree(self.spillDir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+
+
+def getArgs():
+    parser = argparse.ArgumentParser(description='''Count n-grams over the parsed transcripts in parallel,
+                                                  optionally grouped by speaker, party, debate party, year, or reaction.''')
+    parser.add_argument('n', type=int, help="The length of the n-grams to count.")
+    parser.add_argument('outputFile', help="The TSV file to write the counts to.")
+    parser.add_argument('--group-by', nargs='*', default=[], choices=sorted(groupings), help="The fields to group counts by.")
+    parser.add_argument('--processes', type=int, default=None, help="The number of worker processes (defaults to the CPU count).")
+    parser.add_argument('--max-entries', type=int, default=1000000, help="The number of distinct n-grams a worker holds before spilling to disk.")
+    parser.add_argument('--spill-dir', default=None, help="Where to write spill files (defaults to a temporary directory).")
+    parser.add_argument('--ids', nargs='*', default=None, help="Only count n-grams in these debates.")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = getArgs()
+    with NgramCounter(args.n, groupBy=args.group_by, processes=args.processes,
+                      maxEntries=args.max_entries, spillDir=args.spill_dir) as counter:
+        counter.run(args.ids).writeTSV(args.outputFile)
@@ -0,0 +1,180 @@
+'''
+Compares two runs of the parser, debate by debate, to find the debates whose
+events changed. Each event is reduced to a hash while the transcripts are
+streamed, the two hash sequences are aligned with difflib's SequenceMatcher,
+and only the events in (or around) changed regions are read again to be
+reported. Debates are compared in parallel.
+'''
+
+import argparse
+import difflib
+import hashlib
+import json
+import os
+from multiprocessing import Pool
+
+import utils
+from PackedShard import ShardStorage
+from StorageBackend import DirectoryStorage
+
+
+def openRun(path):
+    '''
+    Return the storage for a parse run, given its parsed transcript directory or shard file.
+    '''
+    return DirectoryStorage(path, True) if os.path.isdir(path) else ShardStorage(path, True)
+
+
+def hashEvent(event):
+    return hashlib.blake2b(json.dumps(event, sort_keys=True).encode('utf-8'), digest_size=8).digest()
+
+
+def iterEvents(storage, _id):
+    with storage.open(_id) as file:
+        yield from utils.iterJSONArray(file, 'events')
+
+
+def hashEvents(storage, _id):
+    '''Stream a transcript's events and return the list of their hashes.'''
+    return [hashEvent(event) for event in iterEvents(storage, _id)]
+
+
+def pickEvents(storage, _id, indices):
+    '''Stream a transcript's events again and return the ones at the given indices, by index.'''
+    return {i: event for i, event in enumerate(iterEvents(storage, _id)) if i in indices}
+
+
+def diffDebate(args):
+    '''
+    Compare one debate between two runs. Returns a dictionary with the debate id, the
+    number of inserted, deleted, and changed events, and the hunks of the diff, each a
+    list of (tag, oldIndex, newIndex, oldEvent, newEvent) rows, where tag is one of
+    ' ' (context), '-' (deleted), '+' (inserted), and '~' (changed). hunkRanges holds the
+    [oldStart, oldCount, newStart, newCount] of each hunk; a count of 0 means the hunk has
+    no events in that run, and start is then where its events were removed or would go.
+    '''
+    old, new, _id, context = args
+    oldHashes, newHashes = hashEvents(old, _id), hashEvents(new, _id)
+    result = {'id': _id, 'inserted': 0, 'deleted': 0, 'changed': 0, 'oldEvents': len(oldHashes),
+              'newEvents': len(newHashes), 'hunks': [], 'hunkRanges': []}
+    if oldHashes == newHashes:
+        return result
+
+    matcher = difflib.SequenceMatcher(None, oldHashes, newHashes, autojunk=False)
+    groups = list(matcher.get_grouped_opcodes(context))
+
+    # Only the events in the hunks are read again
+    oldWanted, newWanted = set(), set()
+    for group in groups:
+        for tag, i1, i2, j1, j2 in group:
+            oldWanted.update(range(i1, i2))
+            newWanted.update(range(j1, j2))
+    oldEvents, newEvents = pickEvents(old, _id, oldWanted), pickEvents(new, _id, newWanted)
+
+    for group in groups:
+        hunk = []
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                hunk.extend((' ', i, j, oldEvents[i], newEvents[j]) for i, j in zip(range(i1, i2), range(j1, j2)))
+                continue
+            # Replaced events are paired up as changes; any excess is deleted or inserted
+            paired = min(i2 - i1, j2 - j1) if tag == 'replace' else 0
+            for k in range(paired):
+                hunk.append(('~', i1 + k, j1 + k, oldEvents[i1 + k], newEvents[j1 + k]))
+            for i in range(i1 + paired, i2):
+                hunk.append(('-', i, None, oldEvents[i], None))
+            for j in range(j1 + paired, j2):
+                hunk.append(('+', None, j, None, newEvents[j]))
+            result['changed'] += paired
+            result['deleted'] += i2 - i1 - paired
+            result['inserted'] += j2 - j1 - paired
+        result['hunks'].append(hunk)
+        result['hunkRanges'].append([group[0][1], group[-1][2] - group[0][1], group[0][3], group[-1][4] - group[0][3]])
+    return result
+
+
+def diffRuns(old, new, ids=None, context=2, processes=None):
+    '''
+    Compare two parse runs (storages, see openRun) and return a generator of the results
+    of diffDebate for every debate in both runs (or the given ids), in id order. Debates
+    that are only in one run are reported with 'onlyIn' set to 'old' or 'new', and given
+    ids that are in neither run with 'onlyIn' set to None.
+    '''
+    oldIds, newIds = set(old.ids()), set(new.ids())
+    ids = sorted(oldIds | newIds) if ids is None else list(ids)
+    common = [_id for _id in ids if _id in oldIds and _id in newIds]
+    for _id in ids:
+        if _id not in common:
+            yield {'id': _id, 'onlyIn': 'old' if _id in oldIds else 'new' if _id in newIds else None}
+    with Pool(processes) as pool:
+        yield from pool.imap(diffDebate, [(old, new, _id, context) for _id in common], chunksize=4)
+
+
+def formatEvent(event, width=100):
+    if event is None:
+        return ""
+    if event['eventType'] == 'utterance':
+        text = "{0}: {1}".format(event['speaker'], event['text'])
+    else:
+        text = "[{0}] {1}".format(event['eventType'], event['text'])
+    return text if len(text) <= width else text[:width - 3] + "..."
+
+
+def printResult(result):
+    '''
+    Print the diff of one debate in a unified-diff-like format.
+    '''
+    if 'onlyIn' in result:
+        if result['onlyIn'] is None:
+            print("Debate {0}: in neither run".format(result['id']))
+        else:
+            print("Debate {0}: only in the {1} run".format(result['id'], result['onlyIn']))
+        return
+    print("Debate {0}: {1} inserted, {2} deleted, {3} changed ({4} -> {5} events)".format(result['id'],
+        result['inserted'], result['deleted'], result['changed'], result['oldEvents'], result['newEvents']))
+    for hunk, ranges in zip(result['hunks'], result['hunkRanges']):
+        print("  @@ old {0},{1} new {2},{3} @@".format(*ranges))
+        for tag, i, j, oldEvent, newEvent in hunk:
+            if tag == '~':
+                print("  - {0:>6} {1}".format(i, formatEvent(oldEvent)))
+                print("  + {0:>6} {1}".format(j, formatEvent(newEvent)))
+            elif tag == '-':
+                print("  - {0:>6} {1}".format(i, formatEvent(oldEvent)))
+            else:
+                print("  {0} {1:>6} {2}".format(tag, j, formatEvent(newEvent)))
+
+
+def getArgs():
+    parser = argparse.ArgumentParser(description='''Compare two runs of the parser and report the inserted, deleted, and changed
+                                                  events in each debate. Each run is a parsed transcript directory or shard.''')
+    parser.add_argument('old', help="The earlier run, e.g. a copy of data/debates/parsedTranscripts.")
+    parser.add_argument('new', nargs='?', default=None, help="The later run (defaults to the current transcripts data source).")
+    parser.add_argument('--ids', nargs='*', default=None, help="Only compare these debates.")
+    parser.add_argument('--context', type=int, default=2, help="The number of unchanged events to show around each change.")
+    parser.add_argument('--processes', type=int, default=None, help="The number of worker processes (defaults to the CPU count).")
+    parser.add_argument('--summary', action='store_true', help="Only print the per-debate counts.")
+    parser.add_argument('--json', default=None, help="Also write the full results to this JSON file.")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = getArgs()
+    if args.new is None:
+        from ThesisDataAccessor import Accessor as data
+        new = data.dataManager.getStorage('transcripts')
+    else:
+        new = openRun(args.new)
+
+    changed, results = 0, []
+    for result in diffRuns(openRun(args.old), new, args.ids, args.context, args.processes):
+        if 'onlyIn' in result or result['hunks']:
+            changed += result.get('onlyIn', True) is not None
+            if args.summary:
+                result = dict(result, hunks=[], hunkRanges=[])
+            printResult(result)
+        if args.json is not None:
+            results.append(result)
+    print("{0} debates changed.".format(changed))
+
+    if args.json is not None:
+        with open(args.json, 'w') as outputFile:
+            json.dump(results, outputFile, indent=2)
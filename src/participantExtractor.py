@@ -1,4 +1,5 @@
 from ThesisDataAccessor import Accessor as data
+from HeaderExtractor import HeaderExtractor
 import re
 import binascii
 import utils
@@ -64,16 +65,14 @@ mappings = {
     'Rodham Clinton': 'Hillary Clinton' # This is the bug
 }
 
-participantsSection = "<(b|i)> (PARTICIPANTS|Participants|Candidates): (<br/> )?</(b|i)> (<br/> )?(.*?) </?p>"
 suffix = "[;,\.]?( and;?)?\s*$"
 
+extractor = HeaderExtractor()
 for debate in data.debates:
-    transcript = re.sub("\s+"," ", debate.transcriptsRaw)
-    
-    participants = re.search(participantsSection, transcript)
+    participants = extractor.header(debate.get('id'))['participants']
 
-    if participants and participants.group(6) is not None and "<br/>" in participants.group(6):
-        nameStrings = [re.sub(suffix, "", line).strip() for line in participants.group(6).split("<br/>") if not re.match("^\s*$", line)]
+    if participants is not None and "<br/>" in participants:
+        nameStrings = [re.sub(suffix, "", line).strip() for line in participants.split("<br/>") if not re.match("^\s*$", line)]
         names = [parseName(name) for name in nameStrings if "Moderator" not in name]
         participantsDict[debate.get('id')] = [(lambda full: mappings.get(full, full))("{0} {1}".format(d['first'], d['last'])) for d in names]
 
@@ -98,15 +97,21 @@ for person in people:
     _id = makeId(person)
     peopleMetadata[_id] = makePersonMetadata(_id, person.split()[0], person.split()[1], 'candidate', data.debates[people[person]].debateMetadata.party)
 
-
-utils.writeJSON(peopleMetadata, "../data/people/metadata/metadata.json")
+# The metadata is committed through the data sources' change logs (writing the JSON
+# files directly would be undone when the logs are replayed on top of them)
+current = data.dataManager.getDataSource('peopleMetadata')
+with data.dataManager.transaction('peopleMetadata') as txn:
+    for _id in set(current) - set(peopleMetadata):
+        txn.delete(_id)
+    for _id in peopleMetadata:
+        txn.put(_id, peopleMetadata[_id])
 
 ## UNSAFE!!! ##
-debateMetadata = utils.getJSON("../data/debates/metadata/metadata.json")
+debateMetadata = data.dataManager.getDataSource('debateMetadata')
 utils.writeJSON(debateMetadata, "../data/debates/metadata/metadata_backup.json")
-for debateId in debateMetadata:
-    debateMetadata[debateId]['participants'] = [makeId(participant) for participant in participantsDict[debateId]]
-utils.writeJSON(debateMetadata, "../data/debates/metadata/metadata.json")
+with data.dataManager.transaction('debateMetadata') as txn:
+    for debateId in debateMetadata:
+        txn.update(debateId, {'participants': [makeId(participant) for participant in participantsDict[debateId]]})
 
 
 # ------------------------------------- VALIDATE ------------------------------------- #
@@ -0,0 +1,353 @@
+'''
+Measures how the data access layer (DataSourceManager, ThesisDataAccessor, and
+its PartialDataObjects) scales with the size of the corpus. Synthetic corpora
+are generated at multiples of the real corpus' size, laid out exactly as
+locs.json describes (with a copy of this repository's schema directory), and
+each one is benchmarked in a fresh process so that cold start and peak memory
+are measured cleanly. Results are written as JSON, and can be compared
+against the results of a previous version.
+'''
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import utils
+
+# The size of the real corpus, which scale 1 reproduces
+realDebates = 104
+realPeople = 156
+
+locationsFile = "schema/locs.json"
+reactions = ["applause", "laughter", "crosstalk", "cheering", "booing"]
+
+
+##############################################
+############# CORPUS GENERATION ##############
+
+def makeVocabulary(rng, size=5000):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(2, 10))) for _ in range(size)]
+
+
+def makePerson(rng, n):
+    firstName, lastName = "Person{0}".format(n), rng.choice(["Smith", "Jones", "Garcia", "Lee", "Brown"])
+    person = {'id': (firstName + " " + lastName).encode('utf-8').hex(), 'firstName': firstName, 'lastName': lastName}
+    kind = rng.random()
+    if kind < 0.2:
+        person.update(personType='candidate', party=rng.choice("DR"))
+    else:
+        person['personType'] = 'moderator' if kind < 0.4 else 'other'
+    return person
+
+
+def makeDebate(rng, n, candidates, moderators):
+    year = rng.choice([2000, 2004, 2008, 2012, 2016])
+    _id = str(100000 + n)
+    return {
+        'id': _id,
+        'date': "{0}/{1:02d}/{2:02d}".format(year - rng.randint(0, 1), rng.randint(1, 12), rng.randint(1, 28)),
+        'transcriptUrl': "http://www.presidency.ucsb.edu/ws/index.php?pid={0}".format(_id),
+        'friendlyName': "Synthetic Debate {0}".format(n),
+        'applauseTranscribed': rng.random() < 0.8,
+        # Small scales can have fewer people of a type than a debate would draw
+        'moderators': rng.sample(moderators, min(len(moderators), rng.randint(1, 3))),
+        'participants': rng.sample(candidates, min(len(candidates), rng.randint(2, 10))),
+        'electionYear': year,
+        'party': rng.choice("DR")
+    }
+
+
+def makeTranscript(rng, debate, vocabulary, weights, events):
+    speakers = debate['participants'] + debate['moderators']
+    transcript = []
+    for _ in range(events):
+        if rng.random() < 0.1:
+            eventType = rng.choice(reactions)
+            transcript.append({'eventType': eventType, 'text': "({0})".format(eventType.upper())})
+        else:
+            tokens = rng.choices(vocabulary, weights, k=rng.randint(5, 40)) + ["."]
+            transcript.append({'eventType': 'utterance', 'speaker': rng.choice(speakers),
+                'text': " ".join(tokens), 'tokens': tokens})
+    return {'id': debate['id'], 'events': transcript}
+
+
+def generateCorpus(top, scale, events=1500, maxTranscripts=1000, seed=0):
+    '''
+    Generate a synthetic corpus at the given multiple of the real corpus' size under top,
+    and return a description of it. Every debate has metadata, and up to maxTranscripts of
+    them (chosen at random) have a parsed transcript of the given number of events.
+    '''
+    rng = random.Random(seed)
+    shutil.copytree(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "schema"),
+        os.path.join(top, "schema"))
+    locs = utils.getJSON(os.path.join(top, locationsFile))
+    dataDir = os.path.join(top, locs['dataDir'])
+
+    # Start every data source out empty, so the corpus is complete as locs.json describes it
+    for dataSource, location in locs['dataSources'].items():
+        directory = os.path.join(dataDir, location['dir'])
+        os.makedirs(directory, exist_ok=True)
+        if location['single']:
+            utils.writeJSON({}, utils.makeJSONFilename(directory, os.path.basename(directory)))
+
+    people = [makePerson(rng, n) for n in range(int(realPeople * scale))]
+    candidates = [person['id'] for person in people if person['personType'] == 'candidate']
+    moderators = [person['id'] for person in people if person['personType'] == 'moderator']
+    debates = [makeDebate(rng, n, candidates, moderators) for n in range(int(realDebates * scale))]
+
+    def singleFile(dataSource):
+        directory = os.path.join(dataDir, locs['dataSources'][dataSource]['dir'])
+        return utils.makeJSONFilename(directory, os.path.basename(directory))
+    utils.writeJSON({person['id']: person for person in people}, singleFile('peopleMetadata'))
+    utils.writeJSON({debate['id']: debate for debate in debates}, singleFile('debateMetadata'))
+
+    # Token frequencies roughly follow Zipf's law
+    vocabulary = makeVocabulary(rng)
+    weights = [1.0 / rank for rank in range(1, len(vocabulary) + 1)]
+    transcripts = rng.sample(debates, min(len(debates), maxTranscripts))
+    directory = os.path.join(dataDir, locs['dataSources']['transcripts']['dir'])
+    size = 0
+    for debate in transcripts:
+        filename = utils.makeJSONFilename(directory, debate['id'])
+        utils.writeJSON(makeTranscript(rng, debate, vocabulary, weights, events), filename)
+        size += os.path.getsize(filename)
+
+    return {'scale': scale, 'debates': len(debates), 'people': len(people), 'transcripts': len(transcripts),
+            'eventsPerTranscript': events, 'transcriptBytes': size}
+
+
+##############################################
+################# BENCHMARKS #################
+
+def timeEach(f, items):
+    '''Call f on each item and return the sorted list of the calls' durations in seconds.'''
+    durations = []
+    for item in items:
+        start = time.perf_counter()
+        f(item)
+        durations.append(time.perf_counter() - start)
+    return sorted(durations)
+
+
+def summarize(durations, prefix, unit=1e3):
+    if not durations:
+        return {}
+    return {
+        prefix + 'Mean': sum(durations) / len(durations) * unit,
+        prefix + 'P50': durations[len(durations) // 2] * unit,
+        prefix + 'P95': durations[min(len(durations) - 1, int(len(durations) * 0.95))] * unit
+    }
+
+
+def peakRss():
+    '''Return the peak resident set size of this process, in bytes.'''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def runBenchmarks(top, samples=200, seed=0):
+    '''
+    Benchmark the data access layer on the corpus under top, in this process, and return a
+    dictionary of results. Times ending in Seconds are in seconds, Ms in milliseconds, and Us
+    in microseconds. This should be run in a fresh process (see benchmarkCorpus).
+    '''
+    from ThesisDataAccessor import ThesisDataAccessor
+    rng = random.Random(seed)
+    results = {}
+
+    # Building the accessor once its modules are imported (see coldStart for a true cold start)
+    start = time.perf_counter()
+    accessor = ThesisDataAccessor(top, locationsFile)
+    results['constructSeconds'] = time.perf_counter() - start
+    debateIds = list(accessor.dataManager.getDataSourceIds('debateMetadata'))
+
+    # Listing ids, directly and by iterating over PartialDataObjects
+    start = time.perf_counter()
+    transcriptIds = accessor.entityIds('transcripts')
+    results['listTranscriptIdsSeconds'] = time.perf_counter() - start
+    start = time.perf_counter()
+    peopleIds = list(accessor.dataManager.getDataSourceIds('peopleMetadata'))
+    results['listPeopleIdsSeconds'] = time.perf_counter() - start
+    start = time.perf_counter()
+    results['iteratedDebates'] = sum(1 for _ in accessor.debates)
+    results['iterateDebatesSeconds'] = time.perf_counter() - start
+
+    # Deep attribute chains through the metadata: debate -> participants -> people
+    def chain(debateId):
+        for personId in accessor.debates[debateId].debateMetadata.participants:
+            accessor.people[personId].peopleMetadata.lastName
+    chained = [rng.choice(debateIds) for _ in range(samples)]
+    results.update(summarize(timeEach(chain, chained), 'deepChainUs', 1e6))
+    results.update(summarize(timeEach(lambda personId: accessor.people[personId].peopleMetadata.firstName,
+        [rng.choice(peopleIds) for _ in range(samples)]), 'personAttributeUs', 1e6))
+
+    # Random access to transcripts, first when each is read from disk, then once loaded
+    sampled = rng.sample(transcriptIds, min(samples, len(transcriptIds)))
+    access = lambda debateId: accessor.debates[debateId].transcripts.id
+    results.update(summarize(timeEach(access, sampled), 'randomColdMs'))
+    results.update(summarize(timeEach(access, sampled), 'randomWarmUs', 1e6))
+
+    # A full scan of the transcripts from disk, read ahead and released as it goes
+    manager = accessor.dataManager
+    manager.invalidate('transcripts')
+    start = time.perf_counter()
+    events = sum(len(transcript['events']) for _, transcript in manager.prefetch('transcripts', release=True))
+    results['fullScanSeconds'] = time.perf_counter() - start
+    results['fullScanEvents'] = events
+    size = sum(manager.getStorage('transcripts').size(_id) for _id in transcriptIds)
+    results['fullScanMBps'] = size / (1 << 20) / results['fullScanSeconds'] if results['fullScanSeconds'] else 0.0
+
+    stats = accessor.stats(sizes=False)
+    results['pdoAllocations'] = stats['pdos']['allocations']
+    results['peakRssBytes'] = peakRss()
+    return results
+
+
+# Run in a fresh interpreter by coldStart: nothing but the timer is imported before the accessor
+coldStartScript = """
+import time
+start = time.perf_counter()
+from ThesisDataAccessor import ThesisDataAccessor
+imported = time.perf_counter()
+accessor = ThesisDataAccessor({top!r}, {locs!r})
+debateId = next(iter(accessor.dataManager.getDataSourceIds('debateMetadata')))
+accessor.debates[debateId].debateMetadata.date
+print(imported - start, time.perf_counter() - start)
+"""
+
+
+def coldStart(top):
+    '''
+    Time a cold start on the corpus under top in a fresh Python process: importing the data
+    access layer, building the accessor, and answering the first query. Returns the import
+    time, the cold start time, and the wall time of the whole process (which includes the
+    interpreter's own start up), in seconds.
+    '''
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", coldStartScript.format(top=top, locs=locationsFile)], check=True,
+        stdout=subprocess.PIPE, cwd=os.path.dirname(os.path.abspath(__file__)))
+    processSeconds = time.perf_counter() - start
+    importSeconds, coldStartSeconds = map(float, output.stdout.decode('utf-8').split()[-2:])
+    return {'importSeconds': importSeconds, 'coldStartSeconds': coldStartSeconds, 'coldProcessSeconds': processSeconds}
+
+
+def benchmarkCorpus(top, samples=200, seed=0):
+    '''
+    Benchmark the corpus under top in fresh Python processes and return its results.
+    '''
+    results = coldStart(top)
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), "--run", top, "--samples", str(samples),
+        "--seed", str(seed)], check=True, stdout=subprocess.PIPE, cwd=os.path.dirname(os.path.abspath(__file__)))
+    results.update(json.loads(output.stdout.decode('utf-8').splitlines()[-1]))
+    return results
+
+
+def revision():
+    '''Return the git revision of this repository, or None.'''
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], check=True, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(scales=(1, 10), events=1500, maxTranscripts=1000, samples=200, seed=0, directory=None, keep=False):
+    '''
+    Generate a corpus at each scale, benchmark it, and return the results: a dictionary with
+    the revision and platform benchmarked, the parameters, and a list of each corpus'
+    description with its results.
+    '''
+    scratch = tempfile.mkdtemp(prefix="scale-", dir=directory)
+    runs = []
+    try:
+        for scale in scales:
+            top = os.path.join(scratch, "x{0}".format(scale))
+            start = time.perf_counter()
+            corpus = generateCorpus(top, scale, events, maxTranscripts, seed)
+            corpus['generateSeconds'] = time.perf_counter() - start
+            corpus['results'] = benchmarkCorpus(top, samples, seed)
+            runs.append(corpus)
+            printRun(corpus)
+            if not keep:
+                shutil.rmtree(top, ignore_errors=True)
+    finally:
+        if not keep:
+            shutil.rmtree(scratch, ignore_errors=True)
+    return {
+        'revision': revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {'events': events, 'maxTranscripts': maxTranscripts, 'samples': samples, 'seed': seed},
+        'runs': runs
+    }
+
+
+##############################################
+################## REPORTING #################
+
+def printRun(run):
+    print("Scale {0}: {1} debates, {2} people, {3} transcripts ({4:.1f} MB)".format(run['scale'], run['debates'],
+        run['people'], run['transcripts'], run['transcriptBytes'] / (1 << 20)))
+    for metric, value in sorted(run['results'].items()):
+        print("  {0:<28} {1:>14.3f}".format(metric, value) if isinstance(value, float) else
+              "  {0:<28} {1:>14}".format(metric, value))
+
+
+def compare(baseline, current):
+    '''
+    Print the ratio of each result to the baseline's result at the same scale. For times and
+    memory, ratios above 1 are regressions; for fullScanMBps, ratios below 1 are.
+    '''
+    print("Compared with revision {0}:".format(baseline.get('revision')))
+    if baseline.get('parameters') != current.get('parameters'):
+        print("  Warning: the benchmarks were run with different parameters.")
+    baseRuns = {run['scale']: run['results'] for run in baseline['runs']}
+    for run in current['runs']:
+        base = baseRuns.get(run['scale'])
+        if base is None:
+            continue
+        print("Scale {0}:".format(run['scale']))
+        for metric, value in sorted(run['results'].items()):
+            if base.get(metric):
+                print("  {0:<28} {1:>8.2f}x".format(metric, value / base[metric]))
+
+
+def getArgs():
+    parser = argparse.ArgumentParser(description='''Benchmark the data access layer on synthetic corpora at multiples of
+                                                  the real corpus' size.''')
+    parser.add_argument('--scales', nargs='*', type=float, default=[1, 10], help="The multiples of the real corpus' size to generate.")
+    parser.add_argument('--events', type=int, default=1500, help="The number of events in each synthetic transcript.")
+    parser.add_argument('--max-transcripts', type=int, default=1000, help="The most transcripts to generate per corpus (they dominate disk use).")
+    parser.add_argument('--samples', type=int, default=200, help="The number of random accesses to time for each measurement.")
+    parser.add_argument('--seed', type=int, default=0, help="The seed for generating and sampling the corpora.")
+    parser.add_argument('--dir', default=None, help="Generate the corpora under this directory (defaults to the system's temporary directory).")
+    parser.add_argument('--keep', action='store_true', help="Keep the generated corpora.")
+    parser.add_argument('--json', default=None, help="Write the results to this JSON file.")
+    parser.add_argument('--compare', default=None, help="Compare the results with those in this JSON file, from a previous run.")
+    parser.add_argument('--run', default=None, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = getArgs()
+    if args.run is not None:
+        # Benchmark a single corpus in this process, for benchmarkCorpus
+        print(json.dumps(runBenchmarks(args.run, args.samples, args.seed)))
+    else:
+        scales = [int(scale) if scale == int(scale) else scale for scale in args.scales]
+        results = benchmark(scales, args.events, args.max_transcripts, args.samples, args.seed, args.dir, args.keep)
+        if args.json is not None:
+            with open(args.json, 'w') as outputFile:
+                json.dump(results, outputFile, indent=2)
+        if args.compare is not None:
+            with open(args.compare) as baselineFile:
+                compare(json.load(baselineFile), results)
@@ -0,0 +1,74 @@
+'''
+Computes the summary statistics of parsed transcripts (utterance and token
+counts, and counts of applause, laughter, and other reactions, per debate
+and per speaker) and stores them in the transcriptStats data source. The
+parser updates a debate's statistics whenever it writes the debate's parsed
+transcript; run this script to rebuild them from the existing transcripts.
+'''
+
+import argparse
+import collections
+
+from ThesisDataAccessor import Accessor as data
+
+# The key under which utterances with an unidentified speaker are counted
+unknownSpeaker = "unknown"
+
+
+def newCounts():
+    return {'utterances': 0, 'tokens': 0, 'reactions': collections.Counter()}
+
+
+def computeStats(debateId, events):
+    '''
+    Return the statistics record for a debate given its parsed events. Each non-utterance
+    event counts as a reaction for the whole debate and, if it follows an utterance
+    (possibly after other reactions), for the speaker of that utterance.
+    '''
+    debate = newCounts()
+    speakers = collections.defaultdict(newCounts)
+    lastSpeaker = None
+    for event in events:
+        if event['eventType'] == 'utterance':
+            lastSpeaker = unknownSpeaker if event['speaker'] is None else event['speaker']
+            for counts in (debate, speakers[lastSpeaker]):
+                counts['utterances'] += 1
+                counts['tokens'] += len(event['tokens'])
+        else:
+            debate['reactions'][event['eventType']] += 1
+            if lastSpeaker is not None:
+                speakers[lastSpeaker]['reactions'][event['eventType']] += 1
+
+    def plain(counts):
+        return dict(counts, reactions=dict(counts['reactions']))
+    return {
+        'id': debateId,
+        'debate': plain(debate),
+        'speakers': {speaker: plain(counts) for speaker, counts in speakers.items()}
+    }
+
+
+def rebuildStats(debateIds=None):
+    '''
+    Recompute the statistics of the given debates (by default, every parsed transcript)
+    from their parsed transcripts, committing them to transcriptStats in one transaction.
+    Transcripts are streamed, so the corpus is never held in memory at once.
+    '''
+    manager = data.dataManager
+    if debateIds is None:
+        debateIds = sorted(manager.getDataSourceIds('transcripts'))
+    with manager.transaction('transcriptStats') as txn:
+        for debateId in debateIds:
+            txn.put(debateId, computeStats(debateId, data.iterEvents(debateId)))
+    return len(debateIds)
+
+
+def getArgs():
+    parser = argparse.ArgumentParser(description='''Rebuild the per-debate and per-speaker statistics in the transcriptStats
+                                                  data source from the parsed transcripts.''')
+    parser.add_argument('--ids', nargs='*', default=None, help="Only rebuild the statistics of these debates.")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = getArgs()
+    print("Rebuilt statistics for {0} debates.".format(rebuildStats(args.ids)))
@@ -3,8 +3,60 @@ A module containing a variety of utility functions in a single location.
 '''
 
 import os
+import io
+import sys
 import json
 import glob
+import pickle
+import hashlib
+import time
+import functools
+import importlib
+import threading
+
+
+# Compressed files are recognized by extension. compressionExtensions maps the
+# names used for the 'compression' key in locs.json to their extensions.
+compressionExtensions = {'gzip': '.gz', 'bz2': '.bz2', 'lzma': '.xz'}
+# The module whose open() reads each compression extension, imported on first use
+_compressedOpeners = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'lzma', '.lzma': 'lzma'}
+
+
+# Calls to and time spent in the instrumented loaders below, by function name (see ioStats)
+_ioStats = {}
+_ioStatsLock = threading.Lock()
+
+
+def timed(func):
+    """Decorate a function so that its calls and the time spent in them are counted in ioStats."""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            with _ioStatsLock:
+                stats = _ioStats.setdefault(name, {'calls': 0, 'seconds': 0.0})
+                stats['calls'] += 1
+                stats['seconds'] += elapsed
+    return wrapper
+
+
+def ioStats():
+    """Return the number of calls to, and total seconds spent in, each instrumented loader
+    (getText, getJSON, and getCachedJSON) in this process. A getCachedJSON call that misses
+    its cache also counts as a getJSON call."""
+    with _ioStatsLock:
+        return {name: dict(stats) for name, stats in _ioStats.items()}
+
+
+def resetIOStats():
+    """Reset the counts reported by ioStats."""
+    with _ioStatsLock:
+        _ioStats.clear()
 
 
 def debug(func, args, dbg):
@@ -31,23 +83,240 @@ def makeJSONFilename(filepath, filename):
     return makeFilename(filepath, filename, "json")
 
 
+def compressionExtension(compression):
+    """Return the file extension for a compression name ('gzip', 'bz2', or 'lzma'),
+    or the empty string if compression is None or 'none'."""
+    if compression is None or compression == 'none':
+        return ""
+    try:
+        return compressionExtensions[compression]
+    except KeyError:
+        raise ValueError("Unknown compression {0}. Choose from {1}.".format(compression, sorted(compressionExtensions)))
+
+
+def isCompressed(filename):
+    """Return true if the filename has a recognized compression extension."""
+    return os.path.splitext(filename)[1] in _compressedOpeners
+
+
+def openFile(filename, mode='r', encoding='latin1', fileobj=None):
+    """Open a file, transparently (de)compressing it if its name ends in .gz, .bz2, .xz, or
+    .lzma. Text modes use the given encoding. If fileobj is given, it is the underlying binary
+    file to wrap, and filename is only used to choose the compression."""
+    module = _compressedOpeners.get(os.path.splitext(filename)[1])
+    binary = 'b' in mode
+    if module is None:
+        if fileobj is None:
+            return open(filename, mode, encoding=None if binary else encoding)
+        return fileobj if binary else io.TextIOWrapper(fileobj, encoding=encoding)
+    mode = mode if binary or 't' in mode else mode + 't'
+    opener = importlib.import_module(module).open
+    return opener(filename if fileobj is None else fileobj, mode, encoding=None if binary else encoding)
+
+
+@timed
 def getText(filename, encoding='latin1'):
-    """Get the raw text of a file with an optionally specified encoding."""
-    with open(filename, 'r', encoding=encoding) as file:
+    """Get the raw text of a (possibly compressed) file with an optionally specified encoding."""
+    with openFile(filename, 'r', encoding=encoding) as file:
         return file.read()
 
 
+@timed
 def getJSON(filename, encoding='latin1'):
-    """Given a JSON filename, load the contents of that file into a dictionary.
-    Optionally, specify an encoding."""
-    with open(filename, 'r', encoding=encoding) as file:
+    """Given a (possibly compressed) JSON filename, load the contents of that file into a
+    dictionary. Optionally, specify an encoding."""
+    with openFile(filename, 'r', encoding=encoding) as file:
         return json.load(file)
 
 
-def writeJSON(data, filename):
-    """Given a dictionary and a filename, write that dictionary to the filename as JSON."""
-    with open(filename, 'w') as file:
-        json.dump(data, file, indent=4)
+def iterJSONArray(source, key, encoding='latin1', chunkSize=1 << 16):
+    """Given a JSON filename (or an open text file) containing an object, lazily yield the
+    items of the array stored under key in that object, decoding them as the file is read.
+    Only as much of the file as has been consumed is read, so stopping early stops the read.
+    Other top-level values before the array are decoded and discarded. Yields nothing if
+    the key is not present."""
+    if hasattr(source, 'read'):
+        yield from _iterJSONArray(source, key, chunkSize)
+    else:
+        with openFile(source, 'r', encoding=encoding) as file:
+            yield from _iterJSONArray(file, key, chunkSize)
+
+
+def _iterJSONArray(file, key, chunkSize):
+    decoder = json.JSONDecoder()
+    state = {'buf': file.read(chunkSize), 'pos': 0, 'eof': False}
+
+    def more():
+        # Drop the consumed part of the buffer and read another chunk. Returns False at EOF.
+        chunk = file.read(chunkSize)
+        state['buf'] = state['buf'][state['pos']:] + chunk
+        state['pos'] = 0
+        state['eof'] = not chunk
+        return not state['eof']
+
+    def skipWhitespace():
+        while True:
+            buf, pos = state['buf'], state['pos']
+            while pos < len(buf) and buf[pos] in ' \t\n\r':
+                pos += 1
+            state['pos'] = pos
+            if pos < len(buf) or not more():
+                return buf[pos] if pos < len(buf) else ''
+
+    def expect(chars):
+        c = skipWhitespace()
+        if c not in chars:
+            raise ValueError("Expected one of {0!r} but found {1!r} while streaming JSON".format(chars, c))
+        state['pos'] += 1
+        return c
+
+    def value():
+        # Decode the next value, reading more of the file if it is incomplete. A value
+        # that isn't followed by a delimiter might be a truncated number, so read on.
+        skipWhitespace()
+        while True:
+            try:
+                obj, end = decoder.raw_decode(state['buf'], state['pos'])
+                if state['eof'] or (end < len(state['buf']) and state['buf'][end] in ' \t\n\r,:]}'):
+                    state['pos'] = end
+                    return obj
+            except json.JSONDecodeError:
+                if state['eof']:
+                    raise
+            more()
+
+    expect('{')
+    if skipWhitespace() == '}':
+        return
+    while True:
+        name = value()
+        expect(':')
+        if name == key:
+            expect('[')
+            if skipWhitespace() == ']':
+                return
+            while True:
+                yield value()
+                if expect(',]') == ']':
+                    return
+        value()
+        if expect(',}') == '}':
+            return
+
+
+def hashFile(filename, blockSize=1 << 20):
+    """Return the SHA-1 hex digest of a file's contents."""
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as file:
+        for block in iter(lambda: file.read(blockSize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def getFileStamp(filename):
+    """Return a (mtime, size) pair identifying the current version of a file (or
+    directory), or None if it does not exist."""
+    try:
+        stat = os.stat(filename)
+        return (stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        return None
+
+
+def makeCacheFilename(filename):
+    """Return the name of the binary load cache that sits next to the given file."""
+    directory, basename = os.path.split(filename)
+    return os.path.join(directory, "." + basename + ".cache")
+
+
+@timed
+def getCachedJSON(filename, encoding='latin1'):
+    """Like getJSON, but keep a pickled copy of the decoded data next to the file and
+    load that instead when it is fresh. The cache is keyed by the source file's mtime,
+    size, and SHA-1 hash: if the mtime and size match, the cache is used directly; if
+    only the mtime has changed, the hash decides. A stale or unreadable cache is
+    rebuilt from the JSON, and failing to write the cache is not an error. If the
+    file changes while it is being read, the cache is not written."""
+    cacheFilename = makeCacheFilename(filename)
+    stat = os.stat(filename)
+    fileHash = None
+    try:
+        with open(cacheFilename, 'rb') as cacheFile:
+            key = pickle.load(cacheFile)
+            if key['size'] == stat.st_size:
+                if key['mtime'] == stat.st_mtime_ns:
+                    return pickle.load(cacheFile)
+                fileHash = hashFile(filename)
+                if key['hash'] == fileHash:
+                    data = pickle.load(cacheFile)
+                    _writeCache(filename, cacheFilename, stat, fileHash, data)
+                    return data
+    except (OSError, EOFError, KeyError, TypeError, pickle.UnpicklingError):
+        pass
+
+    data = getJSON(filename, encoding)
+    _writeCache(filename, cacheFilename, stat, fileHash if fileHash is not None else hashFile(filename), data)
+    return data
+
+
+def _writeCache(filename, cacheFilename, stat, fileHash, data):
+    """Atomically write a binary load cache with the given key and data, unless the source
+    file's stamp no longer matches stat (it was replaced while being read or hashed), in
+    which case the data and hash may not belong to the stamp."""
+    import tempfile
+    try:
+        after = os.stat(filename)
+        if (after.st_ino, after.st_mtime_ns, after.st_size) != (stat.st_ino, stat.st_mtime_ns, stat.st_size):
+            return
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(cacheFilename), suffix=".tmp")
+        with os.fdopen(fd, 'wb') as cacheFile:
+            pickle.dump({'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'hash': fileHash},
+                cacheFile, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(data, cacheFile, protocol=pickle.HIGHEST_PROTOCOL)
+        # mkstemp creates the file private; anyone who can read the JSON can read its cache
+        os.chmod(tmp, after.st_mode & 0o666)
+        os.replace(tmp, cacheFilename)
+    except OSError:
+        pass
+
+
+def writeJSON(data, filename, encoding=None):
+    """Given a dictionary and a filename, write that dictionary to the filename as JSON,
+    compressing it if the filename has a compression extension (see openFile).
+    The file is written to a temporary file first and then moved into place, so readers
+    never see a partially written file."""
+    import tempfile
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as raw, openFile(filename, 'w', encoding, fileobj=raw) as file:
+            json.dump(data, file, indent=4)
+        # Keep the permissions of the file being replaced (mkstemp creates it private)
+        os.chmod(tmp, os.stat(filename).st_mode if os.path.exists(filename) else 0o644)
+        os.replace(tmp, filename)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def estimateSize(obj):
+    """Estimate the memory held by a decoded JSON value (or any structure of dicts, lists,
+    tuples, and sets) as the sum of sys.getsizeof over every object it contains, counting
+    objects that appear more than once (e.g. interned strings) only once."""
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+    return total
 
 
 def getFilenames(directory, ext=None):
@@ -0,0 +1,28 @@
+'''
+Shared pytest configuration. The modules in src/ import each other as top-level
+modules (they are run from src/), so src/ is put on the path for the tests.
+'''
+
+import os
+import shutil
+import sys
+
+import pytest
+
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(repository, "src"))
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    '''
+    A DataSourceManager over a copy of the schemas and the debate and people metadata,
+    with its metadata locks kept in the temporary directory too.
+    '''
+    from DataSourceManager import DataSourceManager
+    from MetadataStore import MetadataStore
+    monkeypatch.setattr(MetadataStore, 'lockDirectory', str(tmp_path / "locks"))
+    shutil.copytree(os.path.join(repository, "schema"), str(tmp_path / "schema"))
+    for source in (("debates", "metadata"), ("people", "metadata")):
+        shutil.copytree(os.path.join(repository, "data", *source), str(tmp_path.joinpath("data", *source)))
+    return DataSourceManager(str(tmp_path), os.path.join("schema", "locs.json"), useLoadCache=False)
@@ -0,0 +1,93 @@
+import threading
+
+import pytest
+
+import SchemaValidator
+
+
+def test_refreshReplacesLoadedData(manager):
+    before = manager.getDataSource('debateMetadata')
+    count = len(before)
+    with manager.transaction('debateMetadata') as txn:
+        txn.put('new', {'id': 'new'})
+    after = manager.getDataSource('debateMetadata')
+    assert after is not before
+    assert len(before) == count
+    assert after['new'] == {'id': 'new'}
+    # Nothing changed on disk, so there is nothing to replay
+    manager.refresh('debateMetadata')
+    assert manager.getDataSource('debateMetadata') is after
+
+
+def test_refreshWhileReadersIterate(manager):
+    manager.getDataSource('debateMetadata')
+    done = threading.Event()
+    errors = []
+
+    def read():
+        try:
+            while not done.is_set():
+                source = manager.getDataSource('debateMetadata')
+                ids = [_id for _id in source]
+                # Each transaction adds a pair of records, which must be seen together
+                pairs = [_id[2:] for _id in ids if _id.startswith("a-")]
+                for n in pairs:
+                    if "b-" + n not in source:
+                        errors.append("Saw a-{0} without b-{0}".format(n))
+        except Exception as err:
+            errors.append("{0}: {1}".format(type(err).__name__, err))
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    try:
+        for n in range(100):
+            with manager.transaction('debateMetadata') as txn:
+                txn.put("a-{0}".format(n), {'id': "a-{0}".format(n)})
+                txn.put("b-{0}".format(n), {'id': "b-{0}".format(n)})
+    finally:
+        done.set()
+        for reader in readers:
+            reader.join()
+    assert errors == []
+    assert "b-99" in manager.getDataSource('debateMetadata')
+
+
+@pytest.fixture
+def reports(manager):
+    reports = []
+    manager.validator.reporter = reports.append
+    return reports
+
+
+def test_transactionsAreValidated(manager, reports):
+    manager.validationModes['debateMetadata'] = SchemaValidator.FULL
+    with manager.transaction('debateMetadata') as txn:
+        for n in range(20):
+            txn.put("bad-{0}".format(n), {'id': "bad-{0}".format(n)})
+    manager.validator.join()
+    # One report for the file, capped at maxErrors violations across its records
+    assert len(reports) == 1
+    assert reports[0].label == manager.getStore('debateMetadata').snapshotFile
+    assert len(reports[0].errors) == manager.validator.maxErrors
+    assert reports[0].truncated
+    assert all(path.startswith("bad-") for path, message in reports[0].errors)
+
+
+def test_updatesToUnloadedSourcesAreValidatedOnLoad(manager, reports):
+    manager.validationModes['debateMetadata'] = SchemaValidator.FULL
+    with manager.transaction('debateMetadata') as txn:
+        txn.update('105443', {'party': 'X'})
+    manager.validator.join()
+    assert reports == []
+    manager.getDataSource('debateMetadata')
+    manager.validator.join()
+    assert [path for path, message in reports[0].errors] == ["105443/party"]
+
+
+def test_instanceWritesAreValidated(manager, reports):
+    manager.validationModes['transcriptsNormalized'] = SchemaValidator.FULL
+    manager.writeDataSourceInstance('transcriptsNormalized', '1', {'id': '1'})
+    manager.writeDataSourceInstance('transcriptsNormalized', '2', {'id': '2'}, validation=SchemaValidator.OFF)
+    manager.validator.join()
+    assert [report.label for report in reports] == [manager.getStorage('transcriptsNormalized').location('1')]
@@ -0,0 +1,49 @@
+from HeaderExtractor import HeaderExtractor
+
+
+def normalized(text):
+    return HeaderExtractor.normalize(text)
+
+
+def test_normalizeCollapsesWhitespace():
+    assert HeaderExtractor.normalize("<p>\n  a \t\n b\n</p>") == "<p> a b </p>"
+
+
+def test_extractHeaderFindsBothSections():
+    text = normalized('''<span class="displaytext">
+<p>
+ <b>
+  PARTICIPANTS:
+ </b>
+ <br/>
+ Jane Doe;
+ <br/>
+ John Roe
+</p>
+<p>
+ <b>
+  MODERATOR:
+ </b>
+ Max Moe
+</p>
+<p>
+ <b>
+  DOE:
+ </b>
+ Hello.
+</p>''')
+    header = HeaderExtractor.extractHeader(text)
+    assert header['participants'] == "Jane Doe; <br/> John Roe"
+    assert header['moderators'] == "Max Moe"
+    assert text[:header['headerLength']].endswith("Max Moe </p>")
+
+
+def test_extractHeaderMissingSections():
+    header = HeaderExtractor.extractHeader(normalized("<p> <b> DOE: </b> Hello. </p>"))
+    assert header == {'participants': None, 'moderators': None, 'headerLength': 0}
+
+
+def test_extractHeaderOnlyScansHeaderRegion(monkeypatch):
+    text = normalized("<p> intro </p> <p> <i> Moderators: </i> Max Moe </p>")
+    monkeypatch.setattr(HeaderExtractor, 'headerRegionLength', text.index("<i>"))
+    assert HeaderExtractor.extractHeader(text)['moderators'] is None
@@ -0,0 +1,109 @@
+import os
+
+import pytest
+
+import utils
+from MetadataStore import MetadataStore, applyOps
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(MetadataStore, 'lockDirectory', str(tmp_path / "locks"))
+    snapshot = str(tmp_path / "metadata.json")
+    utils.writeJSON({'a': {'id': 'a', 'x': 1}}, snapshot)
+    return MetadataStore(snapshot, useLoadCache=False)
+
+
+def test_applyOpsReplacesRecords():
+    data = {'a': {'x': 1, 'y': 2}}
+    before = dict(data)
+    applyOps(data, [["update", "a", {"x": 3}], ["put", "b", {"z": 1}], ["delete", "c"]])
+    assert data == {'a': {'x': 3, 'y': 2}, 'b': {'z': 1}}
+    # Updated records are new dictionaries, so a shallow copy is unaffected
+    assert before['a'] == {'x': 1, 'y': 2}
+
+
+def test_applyOpsRejectsUnknownOperations():
+    with pytest.raises(ValueError):
+        applyOps({}, [["frobnicate", "a"]])
+
+
+def test_transactionIsReplayedOnLoad(store):
+    with store.transaction() as txn:
+        txn.update('a', {'x': 2})
+        txn.put('b', {'id': 'b'})
+    assert store.load() == {'a': {'id': 'a', 'x': 2}, 'b': {'id': 'b'}}
+    # The snapshot itself is untouched until compaction
+    assert utils.getJSON(store.snapshotFile) == {'a': {'id': 'a', 'x': 1}}
+
+
+def test_failedTransactionIsNotCommitted(store):
+    with pytest.raises(RuntimeError):
+        with store.transaction() as txn:
+            txn.delete('a')
+            raise RuntimeError()
+    assert not os.path.exists(store.logFile)
+    assert store.load() == {'a': {'id': 'a', 'x': 1}}
+
+
+def test_refreshReadsOnlyNewRecords(store):
+    data = store.load()
+    with store.transaction() as txn:
+        txn.put('b', {'id': 'b'})
+    assert store.refresh(data) is data
+    assert 'b' in data
+
+
+def test_partialTrailingRecordIsIgnored(store):
+    with store.transaction() as txn:
+        txn.put('b', {'id': 'b'})
+    with open(store.logFile, 'ab') as log:
+        log.write(b'[["delete", "a"]')
+    assert set(store.load()) == {'a', 'b'}
+
+
+def test_headerlessLogIsGenerationZero(store):
+    with open(store.logFile, 'wb') as log:
+        log.write(b'[["put", "b", {"id": "b"}]]\n')
+    assert store.generation() == 0
+    assert set(store.load()) == {'a', 'b'}
+
+
+def test_compactionFoldsLogIntoSnapshot(store):
+    with store.transaction() as txn:
+        txn.delete('a')
+        txn.put('b', {'id': 'b'})
+    assert store.generation() == 0
+    store.compact()
+    assert store.generation() == 1
+    assert utils.getJSON(store.snapshotFile) == {'b': {'id': 'b'}}
+    assert store.load() == {'b': {'id': 'b'}}
+
+
+def test_refreshReloadsAfterCompaction(store):
+    data = store.load()
+    with store.transaction() as txn:
+        txn.put('b', {'id': 'b'})
+    data = store.refresh(data)
+    store.compact()
+    # The new log grows past the offset data was read up to in the old one
+    with store.transaction() as txn:
+        txn.put('c', {'id': 'c', 'padding': 'x' * 100})
+    data = store.refresh(data)
+    assert set(data) == {'a', 'b', 'c'}
+
+
+def test_commitCompactsPastThreshold(store):
+    store.compactThreshold = 1
+    with store.transaction() as txn:
+        txn.put('b', {'id': 'b'})
+    assert store.generation() == 1
+    assert set(utils.getJSON(store.snapshotFile)) == {'a', 'b'}
+
+
+def test_lockFileIsOutsideDataTree(store, tmp_path):
+    with store.transaction() as txn:
+        txn.put('b', {'id': 'b'})
+    assert os.path.dirname(store.lockFile) == str(tmp_path / "locks")
+    assert os.path.exists(store.lockFile)
+    assert sorted(os.listdir(tmp_path)) == ["locks", "metadata.json", "metadata.log"]
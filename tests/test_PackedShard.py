@@ -0,0 +1,71 @@
+import json
+import pickle
+
+import pytest
+
+from PackedShard import ReadOnlyError, ShardError, ShardStorage, writeShard
+
+
+def records(count):
+    return [(str(i), json.dumps({'id': str(i), 'events': list(range(i))}).encode('latin1')) for i in range(count)]
+
+
+@pytest.fixture(params=[False, True], ids=['plain', 'compressed'])
+def shard(request, tmp_path):
+    filename = str(tmp_path / "transcripts.shard")
+    # Records are consumed as they are written, so a generator is enough
+    writeShard(filename, iter(records(50)), isJson=True, compress=request.param)
+    storage = ShardStorage(filename, isJson=True)
+    yield storage
+    storage.close()
+
+
+def test_shardRoundTrips(shard):
+    assert sorted(shard.ids(), key=int) == [str(i) for i in range(50)]
+    for _id, content in records(50):
+        assert shard.readBytes(_id) == content
+        assert shard.read(_id) == json.loads(content.decode('latin1'))
+    with shard.open('3') as text:
+        assert json.load(text)['id'] == '3'
+    with shard.open('3', 'rb') as binary:
+        assert binary.read() == records(4)[3][1]
+
+
+def test_shardIsReadOnly(shard):
+    with pytest.raises(ReadOnlyError):
+        shard.write('1', {'id': '1'})
+
+
+def test_shardDetectsCorruption(tmp_path):
+    filename = str(tmp_path / "bad.shard")
+    writeShard(filename, records(3), isJson=True)
+    with open(filename, 'r+b') as shard:
+        shard.seek(-2, 2)
+        shard.write(b'??')
+    storage = ShardStorage(filename, isJson=True)
+    with pytest.raises(ShardError):
+        storage.readBytes('2')
+    assert ShardStorage(filename, isJson=True, verify=False).readBytes('2').endswith(b'??')
+    storage.close()
+
+
+def test_notAShard(tmp_path):
+    filename = tmp_path / "notAShard"
+    filename.write_bytes(b'{"id": "1"}')
+    with pytest.raises(ShardError):
+        ShardStorage(str(filename), isJson=True).ids()
+
+
+def test_repackedShardIsRemapped(shard):
+    assert shard.read('1')['events'] == [0]
+    writeShard(shard.filename, records(60), isJson=True)
+    assert len(shard.ids()) == 60
+    assert shard.read('59')['id'] == '59'
+
+
+def test_shardPicklesWithoutItsMap(shard):
+    shard.ids()
+    copy = pickle.loads(pickle.dumps(shard))
+    assert copy._state is None
+    assert copy.read('7') == shard.read('7')
+    copy.close()
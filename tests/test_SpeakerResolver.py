@@ -0,0 +1,55 @@
+import pytest
+
+from SpeakerResolver import SpeakerResolver
+
+
+@pytest.fixture(autouse=True)
+def sharedResolver(monkeypatch):
+    monkeypatch.setattr(SpeakerResolver, '_shared', None)
+
+
+people = {
+    'jdoe': {'id': 'jdoe', 'firstName': 'Jane', 'lastName': 'Doe'},
+    'jroe': {'id': 'jroe', 'firstName': 'John', 'lastName': 'ROE'}
+}
+
+
+def test_lastNames():
+    resolver = SpeakerResolver(people)
+    assert resolver.lastNames(['jdoe', 'jroe']) == {'doe': 'jdoe', 'roe': 'jroe'}
+
+
+def test_debateSpeakersMemoize():
+    resolver = SpeakerResolver(people)
+    calls = []
+
+    def identify(speakerString):
+        calls.append(speakerString)
+        return resolver.lastNames(people).get(speakerString.strip(':').lower())
+    speakers = resolver.forDebate('1', people, identify)
+    assert [speakers.resolve(s) for s in ("DOE:", "DOE:", "MOE:", "ROE:")] == ['jdoe', 'jdoe', None, 'jroe']
+    assert calls == ["DOE:", "MOE:", "ROE:"]
+    stats = resolver.stats()
+    assert (stats['hits'], stats['misses']) == (1, 3)
+    assert stats['unresolved'] == {'1': ["MOE:"]}
+
+
+def test_sharedResolverFollowsVersion():
+    data = dict(people)
+    resolver = SpeakerResolver.forPeople(data, version=1)
+    assert SpeakerResolver.forPeople(data, version=1) is resolver
+    # A change made in place is only visible through the version
+    data['mmoe'] = {'id': 'mmoe', 'firstName': 'Max', 'lastName': 'Moe'}
+    rebuilt = SpeakerResolver.forPeople(data, version=2)
+    assert rebuilt is not resolver
+    assert rebuilt.lastNames(['mmoe']) == {'moe': 'mmoe'}
+
+
+def test_personAddedByTransactionIsResolved(manager):
+    resolver = SpeakerResolver.forManager(manager)
+    with manager.transaction('peopleMetadata') as txn:
+        txn.put('mmoe', {'id': 'mmoe', 'firstName': 'Max', 'lastName': 'Moe',
+                         'party': 'D', 'personType': 'moderator'})
+    resolver = SpeakerResolver.forManager(manager)
+    assert resolver.lastNames(['mmoe']) == {'moe': 'mmoe'}
+    assert SpeakerResolver.forManager(manager) is resolver
@@ -0,0 +1,80 @@
+import os
+import pickle
+import zipfile
+
+import pytest
+
+from StorageBackend import ZipStorage
+
+
+@pytest.fixture
+def archive(tmp_path):
+    storage = ZipStorage(str(tmp_path / "rawTranscripts.zip"), isJson=False)
+    yield storage
+    storage.close()
+
+
+def test_emptyArchive(archive):
+    assert archive.ids() == []
+    assert archive.version() is None
+    with pytest.raises(KeyError):
+        archive.read('1')
+
+
+def test_writeManyAndRead(archive):
+    assert archive.writeMany(('{0}'.format(i), "<p> debate {0} </p>".format(i)) for i in range(5)) == 5
+    assert sorted(archive.ids()) == ['0', '1', '2', '3', '4']
+    assert archive.read('3') == "<p> debate 3 </p>"
+    with archive.open('3') as text:
+        assert text.read() == "<p> debate 3 </p>"
+    assert archive.location('3').endswith("rawTranscripts.zip#3.html")
+
+
+def test_replacedMemberIsCurrent(archive):
+    archive.writeMany([('1', "old"), ('2', "two")])
+    before = archive.version('2')
+    archive.write('1', "new")
+    assert archive.read('1') == "new"
+    assert archive.read('2') == "two"
+    assert archive.version('2') == before
+    assert sorted(archive.ids()) == ['1', '2']
+
+
+def test_duplicateIdInABatchIsWrittenOnce(archive):
+    assert archive.writeMany([('1', "first"), ('1', "second")]) == 1
+    assert archive.read('1') == "first"
+
+
+def test_replacedMembersAreCompacted(archive):
+    archive.writeMany([('1', "a" * 1000), ('2', "b" * 1000)])
+    for i in range(10):
+        archive.write('1', "version {0} ".format(i) * 100)
+    with zipfile.ZipFile(archive.filename) as z:
+        names = [info.filename for info in z.infolist()]
+    # Stale copies of 1.html are dropped once they outweigh the live members
+    assert names.count('1.html') < 10
+    assert sorted(set(names)) == ['1.html', '2.html']
+    assert archive.read('1') == "version 9 " * 100
+
+
+def test_failedWriteLeavesArchive(archive):
+    archive.write('1', "one")
+    stamp = archive.version()
+
+    def records():
+        yield '2', b"two"
+        raise RuntimeError()
+    with pytest.raises(RuntimeError):
+        archive.writeRecords(records())
+    assert archive.version() == stamp
+    assert archive.ids() == ['1']
+    assert [f for f in os.listdir(os.path.dirname(archive.filename)) if f.endswith(".tmp")] == []
+
+
+def test_jsonArchivePickles(tmp_path):
+    storage = ZipStorage(str(tmp_path / "transcripts.zip"), isJson=True)
+    storage.write('1', {'id': '1', 'events': []})
+    copy = pickle.loads(pickle.dumps(storage))
+    assert copy.read('1') == {'id': '1', 'events': []}
+    storage.close()
+    copy.close()
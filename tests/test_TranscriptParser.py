@@ -0,0 +1,105 @@
+import pickle
+
+import pytest
+
+from TranscriptParser import RawTranscriptParser, loadParsingLibraries, parseTranscript
+
+
+@pytest.fixture(autouse=True)
+def parsingLibraries():
+    bs4 = pytest.importorskip("bs4")
+    pytest.importorskip("nltk")
+    loadParsingLibraries()
+    from nltk.tokenize import sent_tokenize
+    try:
+        sent_tokenize("Tokenizer data. Is it installed?")
+    except LookupError:
+        pytest.skip("NLTK tokenizer data is not installed")
+
+
+raw = '''<span class="displaytext">
+<p>
+ <b>
+  PARTICIPANTS:
+ </b>
+ <br/>
+ Jane Doe;
+ <br/>
+ John Roe
+</p>
+<p>
+ <b>
+  MODERATOR:
+ </b>
+ Max Moe
+</p>
+<p>
+ <b>
+  MOE:
+ </b>
+ Welcome to the debate. (APPLAUSE)
+</p>
+<p>
+ <b>
+  DOE:
+ </b>
+ Thank you. It is good to be here.
+</p>
+<p>
+ <b>
+ </b>
+ And I mean that. [laughter]
+</p>
+<p>
+ <b>
+  ROE:
+ </b>
+ Likewise.
+</p>
+</span>
+'''
+
+parsingMetadata = {'eventDetector': 0, 'utteranceIterator': 2, 'speakerIdentifier': 0, 'speakerDetector': 0}
+lastNames = {'doe': 'jdoe', 'roe': 'jroe', 'moe': 'mmoe'}
+
+
+def parse(**kwargs):
+    parser = RawTranscriptParser(raw, parsingMetadata, lastNames, moderators=['mmoe'], **kwargs)
+    return parser, list(parser.parse())
+
+
+def test_parseWalksHeaderAndRecordsOffset():
+    parser, events = parse()
+    assert [e['speaker'] for e in events if e['eventType'] == 'utterance'] == \
+        ['mmoe', 'jdoe', 'jdoe', 'jdoe', 'jroe']
+    assert [e['eventType'] for e in events if e['eventType'] != 'utterance'] == ['applause', 'laughter']
+    assert parser.turns == [[0, 2, 'mmoe'], [2, 6, 'jdoe'], [6, 7, 'jroe']]
+    # The offset is that of the <p> tag after the header in the normalized transcript
+    normalized = ' '.join(raw.split())
+    assert normalized[parser.utteranceOffset:].startswith("<p> <b> MOE: </b>")
+
+
+def test_parseFromOffsetMatchesFullParse():
+    parser, events = parse()
+    for normalized in (False, True):
+        text = ' '.join(raw.split()) if normalized else raw
+        fromOffset = RawTranscriptParser(text, parsingMetadata, lastNames, moderators=['mmoe'],
+                                         normalized=normalized, utteranceOffset=parser.utteranceOffset)
+        assert fromOffset.startsAtOffset()
+        assert list(fromOffset.parse()) == events
+        assert fromOffset.turns == parser.turns
+    assert list(parseTranscript(raw, parsingMetadata, lastNames, moderators=['mmoe'],
+                                utteranceOffset=parser.utteranceOffset)) == events
+
+
+def test_specialFixesWalkTheHeader(monkeypatch):
+    monkeypatch.setitem(RawTranscriptParser.specialFixes, 'fixed', lambda soup: None)
+    parser = RawTranscriptParser(raw, parsingMetadata, lastNames, debateId='fixed', utteranceOffset=1)
+    assert not parser.startsAtOffset()
+
+
+def test_parserPicklesAfterParsing():
+    parser, events = parse()
+    copy = pickle.loads(pickle.dumps(parser))
+    assert copy.turns == parser.turns
+    assert list(copy.parse()) == events
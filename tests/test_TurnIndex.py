@@ -0,0 +1,60 @@
+from TurnIndex import TurnIndex, reactionAfter, turnsFromEvents
+
+
+def utterance(speaker):
+    return {'eventType': 'utterance', 'speaker': speaker}
+
+
+def reaction(eventType):
+    return {'eventType': eventType}
+
+
+events = [
+    reaction('other'),
+    utterance('a'), utterance('a'), reaction('applause'),
+    utterance('b'), reaction('applause'), reaction('laughter'),
+    utterance('a')
+]
+
+
+def test_turnsFromEvents():
+    assert turnsFromEvents(events) == [[1, 4, 'a'], [4, 7, 'b'], [7, 8, 'a']]
+
+
+def test_reactionAfter():
+    assert reactionAfter(events, 1) == 'none'
+    assert reactionAfter(events, 2) == 'applause'
+    assert reactionAfter(events, 4) == 'applause+laughter'
+    assert reactionAfter(events, 7) == 'none'
+
+
+def test_turnIndex():
+    index = TurnIndex(turnsFromEvents(events), len(events))
+    assert len(index) == 3
+    assert list(index) == [(1, 4, 'a'), (4, 7, 'b'), (7, 8, 'a')]
+    assert index.turn(1) == (4, 7, 'b')
+    assert [index.turnOf(i) for i in range(len(events))] == [None, 0, 0, 0, 1, 1, 1, 2]
+    assert index.turnsBy('a') == [0, 2]
+    assert index.turnsBy('c') == []
+
+
+def test_turnIndexPrefersRecordedTurns():
+    # Two extents in a row by different speakers that can't be identified are separate
+    # turns to the parser, but their utterances both have a None speaker, so the events
+    # alone merge them into one turn
+    unidentified = [
+        utterance('a'), utterance(None), utterance(None), reaction('applause'), utterance('a')
+    ]
+    turns = [[0, 1, 'a'], [1, 2, None], [2, 4, None], [4, 5, 'a']]
+    index = TurnIndex.fromTranscript({'events': unidentified, 'turns': turns})
+    assert len(index) == 4
+    assert index.turnOf(3) == 2
+    assert index.turnsBy(None) == [1, 2]
+    recovered = TurnIndex.fromTranscript({'events': unidentified})
+    assert list(recovered) == [(0, 1, 'a'), (1, 4, None), (4, 5, 'a')]
+
+
+def test_emptyTranscript():
+    index = TurnIndex.fromTranscript({'events': []})
+    assert len(index) == 0
+    assert list(index) == []
@@ -0,0 +1,90 @@
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("dateutil")
+
+import os
+
+import utils
+from metadataConverter import DateParser, electionYear, mergeIntoFile, mergeRows, readRows
+from SchemaValidator import SchemaValidator
+
+schemaDir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "schema")
+
+
+existing = {
+    '100': {'id': '100', 'date': '2016/01/01', 'transcriptUrl': 'u100', 'party': 'R'},
+    '200': {'id': '200', 'date': '2016/02/01', 'transcriptUrl': 'u200'}
+}
+
+
+def test_mergeRows():
+    rows = [
+        ('100', {'date': '2016/01/01', 'transcriptUrl': 'u100'}),
+        ('200', {'date': '2016/02/02', 'transcriptUrl': 'u200'}),
+        ('300', {'date': '2015/12/01', 'transcriptUrl': 'u300', 'friendlyName': 'Debate in Des Moines'})
+    ]
+    changes, unchanged = mergeRows(existing, iter(rows))
+    assert unchanged == 1
+    assert changes == {
+        '200': {'date': '2016/02/02', 'transcriptUrl': 'u200'},
+        '300': {'id': '300', 'date': '2015/12/01', 'transcriptUrl': 'u300', 'friendlyName': 'Debate in Des Moines',
+                'applauseTranscribed': False, 'moderators': [], 'participants': [], 'electionYear': 2016, 'party': None}
+    }
+
+
+def test_mergeRowsKeepsExistingNames():
+    rows = [('100', {'date': '2016/01/01', 'transcriptUrl': 'u100', 'friendlyName': 'Renamed'})]
+    assert mergeRows(existing, rows) == ({}, 1)
+
+
+def test_mergeRowsLastRowWins():
+    rows = [('300', {'date': '2016/03/01'}), ('300', {'date': '2016/03/02'})]
+    assert mergeRows(existing, rows)[0]['300']['date'] == '2016/03/02'
+
+
+def test_electionYear():
+    assert [electionYear(date) for date in ('1999/10/27', '2007/06/03', '2008/01/05', '2016/03/10')] == \
+        [2000, 2008, 2008, 2016]
+
+
+def test_newDebateMatchesSchema(tmp_path):
+    pytest.importorskip("jsonschema")
+    filename = str(tmp_path / "metadata.json")
+    utils.writeJSON(existing, filename)
+    rows = [('300', {'date': '2019/06/26', 'transcriptUrl': 'http://www.presidency.ucsb.edu/ws/index.php?pid=300',
+                     'friendlyName': 'Democratic Candidates Debate in Miami, Florida'})]
+    assert mergeIntoFile(rows, filename) == (1, 0)
+    validator = SchemaValidator(schemaDir, reporter=None)
+    report = validator.validateInstance('debateMetadata', "dataSources/debateMetadata.schema.json",
+                                        utils.getJSON(filename)['300'], "300")
+    assert report.errors == []
+
+
+def test_mergeIntoFileKeepsOtherFields(tmp_path):
+    filename = str(tmp_path / "metadata.json")
+    utils.writeJSON(existing, filename)
+    assert mergeIntoFile([('100', {'date': '2016/01/05', 'transcriptUrl': 'u100'})], filename) == (1, 0)
+    assert utils.getJSON(filename)['100'] == {'id': '100', 'date': '2016/01/05', 'transcriptUrl': 'u100', 'party': 'R'}
+
+
+def test_readRows(tmp_path):
+    tsv = tmp_path / "debates.tsv"
+    tsv.write_text("Date\tName\tURL\n"
+                   "\"January 14, 2016\"\tRepublican Candidates Debate\thttp://www.presidency.ucsb.edu/ws/index.php?pid=0111395\n"
+                   "2/6/2016\t\thttp://www.presidency.ucsb.edu/ws/index.php?pid=111412\n")
+    assert list(readRows(str(tsv))) == [
+        ('111395', {'date': '2016/01/14', 'transcriptUrl': 'http://www.presidency.ucsb.edu/ws/index.php?pid=0111395',
+                    'friendlyName': 'Republican Candidates Debate'}),
+        ('111412', {'date': '2016/02/06', 'transcriptUrl': 'http://www.presidency.ucsb.edu/ws/index.php?pid=111412',
+                    'friendlyName': ''})
+    ]
+
+
+def test_dateParserRemembersFormat():
+    parseDate = DateParser()
+    assert parseDate("March 3, 2016") == datetime(2016, 3, 3)
+    assert parseDate.format == "%B %d, %Y"
+    assert parseDate("2016-03-04") == datetime(2016, 3, 4)
+    assert parseDate.format == "%Y-%m-%d"
@@ -0,0 +1,64 @@
+import io
+import json
+import os
+
+import pytest
+
+import utils
+
+
+transcript = {
+    'id': '1',
+    'meta': {'nested': [1, 2, {'events': 'not these'}]},
+    'events': [
+        {'eventType': 'utterance', 'text': 'a "quoted" ] } , text'},
+        {'eventType': 'applause', 'text': '(APPLAUSE)'},
+        12345678901234567890,
+        -1.5e3,
+        None
+    ],
+    'turns': [[0, 1, 'x']]
+}
+
+
+@pytest.mark.parametrize('chunkSize', [1, 2, 7, 1 << 16])
+@pytest.mark.parametrize('indent', [None, 4])
+def test_iterJSONArrayMatchesJSONLoads(chunkSize, indent):
+    text = json.dumps(transcript, indent=indent)
+    assert list(utils.iterJSONArray(io.StringIO(text), 'events', chunkSize=chunkSize)) == transcript['events']
+    assert list(utils.iterJSONArray(io.StringIO(text), 'turns', chunkSize=chunkSize)) == transcript['turns']
+
+
+@pytest.mark.parametrize('text', ['{}', '{"id": "1"}', '{"events": []}', ' { "events" : [ ] } '])
+def test_iterJSONArrayEmpty(text):
+    assert list(utils.iterJSONArray(io.StringIO(text), 'events', chunkSize=1)) == []
+
+
+def test_iterJSONArrayStopsReadingEarly():
+    text = json.dumps({'events': list(range(100000))})
+    source = io.StringIO(text)
+    events = utils.iterJSONArray(source, 'events', chunkSize=64)
+    assert [next(events) for _ in range(3)] == [0, 1, 2]
+    assert source.tell() < len(text)
+
+
+def test_iterJSONArrayReadsFiles(tmp_path):
+    filename = str(tmp_path / "1.json")
+    utils.writeJSON(transcript, filename)
+    assert list(utils.iterJSONArray(filename, 'events')) == transcript['events']
+
+
+@pytest.mark.parametrize('text', ['[1, 2]', '{"events": [1, 2', '{"events": [1 2]}'])
+def test_iterJSONArrayMalformed(text):
+    with pytest.raises(ValueError):
+        list(utils.iterJSONArray(io.StringIO(text), 'events', chunkSize=4))
+
+
+def test_cachedJSONCacheHasSourceMode(tmp_path):
+    filename = str(tmp_path / "metadata.json")
+    utils.writeJSON({'a': 1}, filename)
+    os.chmod(filename, 0o644)
+    assert utils.getCachedJSON(filename) == {'a': 1}
+    cacheFilename = utils.makeCacheFilename(filename)
+    assert os.stat(cacheFilename).st_mode & 0o777 == 0o644
+    assert utils.getCachedJSON(filename) == {'a': 1}